@@ -2,10 +2,17 @@
 A module containing a variety of functions for analyzing the data. This is supposed to be more data
     specific than statistics.
 """
+from collections import namedtuple
+from math import fsum
+
 import numpy as np
 
+from graphics import NoProgressBar
+from instrument import timed
+from parallel import parallel_map
 from tools import cached_property
 
+@timed("grader compensation")
 def compensate_for_grader_means(evals, z_thresh=1):
     """
     Compensates for grader means by subtracting each grader's average grades per problem. Eliminates
@@ -18,6 +25,130 @@ def compensate_for_grader_means(evals, z_thresh=1):
     zeroed = filt.zero_meaned()
     return zeroed
 
+class CompensationCache:
+    """
+    Performs compensate_for_grader_means while remembering the unusualness and grader mean
+        calculations for each question, so that after an incremental update only the questions that
+        changed need to be recomputed.
+
+    The unusualness of a question depends only on that question, so it is invalidated only when the
+        question changes. The grader means depend on which emails were filtered out, so they are all
+        recomputed whenever that set changes.
+    """
+    def __init__(self, z_thresh=1):
+        self.__z_thresh = z_thresh
+        self.__problematic = {}
+        self.__means = {}
+        self.__removed = None
+    def invalidate(self, problems):
+        """
+        Forgets the calculations for the given iterable of problems, which have changed.
+        """
+        for problem in problems:
+            self.__problematic.pop(problem, None)
+            self.__means.pop(problem, None)
+    @timed("grader compensation")
+    def compensate(self, evals):
+        """
+        Equivalent to compensate_for_grader_means(evals, z_thresh), reusing any cached calculations
+            for problems that have not been invalidated.
+        """
+        if not evals.evaluation_for(list(evals.emails)[0]).means_need_compensation:
+            return evals
+        problems = [problem for problem, _ in evals]
+        self.__problematic = {problem : self.__problematic[problem]
+                              for problem in problems if problem in self.__problematic}
+        for problem, graded_question in evals:
+            if problem not in self.__problematic:
+                self.__problematic[problem] = set(
+                    _problematic_for_question(graded_question, self.__z_thresh))
+        problematic = set().union(*self.__problematic.values())
+        if problematic != self.__removed:
+            self.__means = {}
+            self.__removed = problematic
+        filt = evals.remove(problematic)
+        for problem in problems:
+            if problem not in self.__means:
+                self.__means[problem] = filt.grader_means(problem)
+        return filt.zero_meaned(self.__means)
+
+class _RunningStats:
+    """
+    The running mean and (population) standard deviation of a stream of vectors, kept using
+        Welford's algorithm.
+    """
+    def __init__(self, size):
+        self.count = 0
+        self.mean = np.zeros(size)
+        self.__sum_squares = np.zeros(size)
+    def add(self, values):
+        """
+        Adds a vector to the stream.
+        """
+        self.count += 1
+        delta = values - self.mean
+        self.mean += delta / self.count
+        self.__sum_squares += delta * (values - self.mean)
+    @property
+    def std(self):
+        """
+        The standard deviation of every vector seen so far.
+        """
+        return np.sqrt(self.__sum_squares / self.count)
+
+class GraderMonitor:
+    """
+    Tracks the unusualness of each grader on each question while grading is still in progress.
+
+    Agrees with _unusualness on the questions seen so far, but each new ScoredQuestion only costs
+        an update of the running statistics for its question and grader.
+    """
+    def __init__(self, z_thresh=1):
+        self.__z_thresh = z_thresh
+        self.__overall = {}
+        self.__by_grader = {}
+    def observe(self, problem, scored_question):
+        """
+        Adds a newly graded question for the given problem.
+
+        Output: the current unusualness of that question's grader on the problem.
+        """
+        rubric_items = np.array(scored_question.rubric_items, dtype=float)
+        if problem not in self.__overall:
+            self.__overall[problem] = _RunningStats(len(rubric_items))
+            self.__by_grader[problem] = {}
+        self.__overall[problem].add(rubric_items)
+        graders = self.__by_grader[problem]
+        if scored_question.grader not in graders:
+            graders[scored_question.grader] = _RunningStats(len(rubric_items))
+        graders[scored_question.grader].add(rubric_items)
+        return self.unusualness(problem, scored_question.grader)
+    def observe_exam(self, evals):
+        """
+        Adds every question of the given ExamGrades.
+        """
+        for problem, graded_question in evals:
+            for scored_question in graded_question.evaluations:
+                self.observe(problem, scored_question)
+    def unusualness(self, problem, grader):
+        """
+        Get the current unusualness of the grader on the given problem.
+        """
+        overall = self.__overall[problem]
+        by_grader = self.__by_grader[problem][grader]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.mean(np.abs(by_grader.mean - overall.mean) / overall.std)
+    def flagged(self):
+        """
+        Ouptuts an iterable of (problem, grader, unusualness) for every grader whose unusualness is
+            currently greater than the z threshold.
+        """
+        for problem, graders in self.__by_grader.items():
+            for grader in graders:
+                unusualness = self.unusualness(problem, grader)
+                if unusualness > self.__z_thresh:
+                    yield problem, grader, unusualness
+
 class ExamPair:
     """
     Structure representing a correlation between exam scores, as well as metadata on location.
@@ -74,30 +205,128 @@ def all_pairs(graded_exam, seating_chart, time_delta, progress, require_same_roo
 def _pairs_per_individual(graded_exam, seating_chart, time_delta, progress, emails, known_same_room,
                           require_not_time_adj, adjacency_type):
     p_bar = progress(len(emails))
+    ids = graded_exam.ids_for(emails)
+    times = graded_exam.time_indices
     for index_x, email_x in enumerate(emails):
         p_bar.update(index_x)
-        if email_x not in graded_exam.emails:
+        if ids[index_x] < 0:
             continue
         eval_x = graded_exam.evaluation_for(email_x)
         if not known_same_room:
             room_x = seating_chart.room_for(email_x)
-        for email_y in emails[index_x+1:]:
-            if email_y not in graded_exam.emails:
+        later = np.flatnonzero(ids[index_x+1:] >= 0) + index_x + 1
+        time_adjacent = np.abs(times[ids[index_x]] - times[ids[later]]) <= time_delta
+        for index_y, is_time_adjacent in zip(later.tolist(), time_adjacent.tolist()):
+            if require_not_time_adj and is_time_adjacent:
                 continue
+            email_y = emails[index_y]
             if not known_same_room:
                 same_room = room_x == seating_chart.room_for(email_y)
             else:
                 same_room = True
-            time_adjacent = abs(graded_exam.time_diff(email_x, email_y)) <= time_delta
-            if require_not_time_adj and time_adjacent:
-                continue
             yield ExamPair(eval_x,
                            graded_exam.evaluation_for(email_y),
-                           time_adjacent,
+                           is_time_adjacent,
                            seating_chart.are_adjacent(email_x, email_y, adjacency_type),
                            same_room)
 
 
+class Totals(namedtuple("Totals", ["total", "count"])):
+    """
+    The sum and number of a set of values, computed separately for each room and combined into the
+        result for the whole exam.
+    """
+    @staticmethod
+    def of(values):
+        """
+        The totals of the given list of values.
+        """
+        return Totals(fsum(values), len(values))
+    @staticmethod
+    def combine(totals):
+        """
+        The totals of the union of the sets of values with the given totals. The sums are added
+            with fsum, so the result does not depend on the order of the rooms.
+        """
+        totals = list(totals)
+        return Totals(fsum(x.total for x in totals), sum(x.count for x in totals))
+    @property
+    def mean(self):
+        """
+        The mean of the values, or nan if there are none.
+        """
+        return self.total / self.count if self.count else float('nan')
+
+def per_room(function, seating_chart, n_processes=None, progress=NoProgressBar):
+    """
+    Computes FUNCTION(list of emails) for every room of SEATING_CHART in N_PROCESSES worker
+        processes, handing out the largest rooms first so that they do not end up running alone.
+
+    Output: a list of the results, in the order of seating_chart.emails_by_room
+    """
+    return parallel_map(lambda room: function(room[1]), list(seating_chart.emails_by_room),
+                        n_processes, progress, weight=lambda room: len(room[1]))
+
+def _pair_values(graded_exam, seating_chart, statistic, time_delta, adjacency_type, emails):
+    adjacent, other = [], []
+    for pair in _pairs_per_individual(graded_exam, seating_chart, time_delta, NoProgressBar,
+                                      emails, True, True, adjacency_type):
+        (adjacent if pair.are_space_adjacent else other).append(statistic(pair))
+    return adjacent, other
+
+def room_pair_statistics(graded_exam, seating_chart, statistic, time_delta, adjacency_type,
+                         n_processes=None, progress=NoProgressBar):
+    """
+    The values of STATISTIC on the pairs of students in the same room who are not time adjacent,
+        computed for each room in a separate worker process. The pairs are in the same order as
+        all_pairs(..., require_same_room=True, require_not_time_adj=True, ...) outputs them.
+
+    Output: (values for the space adjacent pairs, values for the other pairs)
+    """
+    adjacent, other = [], []
+    for room_adjacent, room_other in per_room(
+            lambda emails: _pair_values(graded_exam, seating_chart, statistic, time_delta,
+                                        adjacency_type, emails),
+            seating_chart, n_processes, progress):
+        adjacent += room_adjacent
+        other += room_other
+    return adjacent, other
+
+def room_pair_totals(graded_exam, seating_chart, statistic, time_delta, adjacency_type,
+                     n_processes=None, progress=NoProgressBar):
+    """
+    Like room_pair_statistics, but each room only sends back the Totals of its values.
+
+    Output: (Totals of the space adjacent pairs, Totals of the other pairs)
+    """
+    def _room(emails):
+        adjacent, other = _pair_values(graded_exam, seating_chart, statistic, time_delta,
+                                       adjacency_type, emails)
+        return Totals.of(adjacent), Totals.of(other)
+    adjacent, other = zip(*per_room(_room, seating_chart, n_processes, progress))
+    return Totals.combine(adjacent), Totals.combine(other)
+
+def room_layer_differences(graded_exam, seating_chart, adjacency_type,
+                           gambler_fallacy_allowable_limit, similarity_fn, n_processes=None,
+                           progress=NoProgressBar):
+    """
+    The Totals of the difference between the similarity of each student to the students one and two
+        seats away, as computed by similarity_layers, over the students for whom it is defined. The
+        students of each room are handled in a separate worker process.
+    """
+    def _room(emails):
+        diffs = []
+        for email in emails:
+            if email not in graded_exam.emails:
+                continue
+            one_apart, two_apart = seating_chart.similarity_layers(
+                email, 2, adjacency_type, graded_exam, similarity_fn,
+                gambler_fallacy_allowable_limit=gambler_fallacy_allowable_limit)
+            if not np.isnan(one_apart - two_apart):
+                diffs.append(one_apart - two_apart)
+        return Totals.of(diffs)
+    return Totals.combine(per_room(_room, seating_chart, n_processes, progress))
+
 def _unusualness(grader, question):
     """
     Get the unusualness of a grader with respect to a graded question; i.e., the average of the
@@ -114,6 +343,13 @@ def _identify_problematic_ranges(evals, z_thresh):
         z threshold.
     """
     for _, graded_question in evals:
-        for grader in graded_question.graders:
-            if _unusualness(grader, graded_question) > z_thresh:
-                yield from graded_question.for_grader(grader).emails
+        yield from _problematic_for_question(graded_question, z_thresh)
+
+def _problematic_for_question(graded_question, z_thresh):
+    """
+    Outputs an iterable of emails graded by a grader whose unusualness on the given question is
+        greater than the z threshold.
+    """
+    for grader in graded_question.graders:
+        if _unusualness(grader, graded_question) > z_thresh:
+            yield from graded_question.for_grader(grader).emails
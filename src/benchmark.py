@@ -0,0 +1,187 @@
+"""
+A benchmark suite that times each stage of the analysis on synthetic exams of a configurable size.
+
+Usage: benchmark.py [--sizes 100,1000] [--output FILE] [--baseline FILE] [--save-baseline]
+
+Results are written as JSON. When a baseline is given, every stage that is slower than the baseline
+    by more than the tolerance is reported and the exit status is nonzero. The time taken to import
+    each compute-only entry point is measured too, and must stay within STARTUP_BUDGET.
+"""
+import json
+import subprocess
+import sys
+from argparse import ArgumentParser
+from os.path import abspath, dirname
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+import numpy as np
+
+from analytics import compensate_for_grader_means, all_pairs
+from evaluations import proc_evaluations
+from graphics import NoProgressBar
+from models import model_on_params, binary_cheater, RandomSeatingModel
+from models import score_diff_summary, one_way_vs_two_way_summary
+from seating_chart import SeatingChart, AdjacencyType
+from statistics import Bootstrap
+from synthetic import write_exam
+
+SRC_DIR = dirname(abspath(__file__))
+
+# seconds that importing each compute-only entry point may take, beyond starting the interpreter
+STARTUP_BUDGET = {"script" : 0.5, "profile" : 0.5, "comparison" : 0.5, "report_data" : 0.5}
+
+# modules that are slow to import and only needed for plotting or OCR
+HEAVY_MODULES = ("matplotlib", "PIL", "pytesseract", "editdistance")
+
+def _run_python(code):
+    """
+    Runs CODE in a fresh interpreter in the source directory, returning the seconds it took.
+    """
+    start = perf_counter()
+    subprocess.check_call([sys.executable, "-c", code], cwd=SRC_DIR)
+    return perf_counter() - start
+
+def startup_time(module, repeats=3):
+    """
+    The least number of seconds taken to import MODULE in a fresh interpreter, over REPEATS tries,
+        beyond the time taken to start the interpreter itself.
+    """
+    base = min(_run_python("pass") for _ in range(repeats))
+    return min(_run_python("import %s" % module) for _ in range(repeats)) - base
+
+def heavy_imports(module):
+    """
+    The modules in HEAVY_MODULES that are imported along with MODULE.
+    """
+    output = subprocess.check_output(
+        [sys.executable, "-c", "import sys, %s; print(' '.join(sorted(sys.modules)))" % module],
+        cwd=SRC_DIR)
+    loaded = set(output.decode().split())
+    return [x for x in HEAVY_MODULES if x in loaded]
+
+def startup_over_budget(results, budget=STARTUP_BUDGET):
+    """
+    Outputs an iterable of (result, budget seconds) for every startup result over its budget.
+    """
+    for result in results:
+        module = result["stage"][len("startup "):]
+        if result["stage"].startswith("startup ") and result["seconds"] > budget.get(module, 0):
+            yield result, budget[module]
+
+def _correlation_summary(grades, seats):
+    return one_way_vs_two_way_summary(grades, seats, gambler_fallacy_allowable_limit=1,
+                                      similarity_fn=lambda x, y: x.correlation(y))
+
+def _stages(directory, n_students, n_trials):
+    """
+    Outputs an iterable of (stage name, function to time) for an exam of the given size. Each stage
+        may depend on the results of the earlier ones.
+    """
+    evaluations, seat_file = write_exam(directory, n_students)
+    state = {}
+    def _load_evaluations():
+        state["evals"] = proc_evaluations(evaluations)
+    def _load_seats():
+        state["seats"] = SeatingChart(seat_file)
+    def _compensate():
+        state["zero_meaned"] = compensate_for_grader_means(state["evals"])
+    def _all_pairs():
+        for _ in all_pairs(state["zero_meaned"], state["seats"], 2, NoProgressBar,
+                           require_same_room=True, require_not_time_adj=True,
+                           adjacency_type=AdjacencyType.all_ways):
+            pass
+    def _score_diff():
+        score_diff_summary(state["evals"], state["seats"])
+    def _one_way_vs_two_way():
+        state["true_value"] = _correlation_summary(state["evals"], state["seats"])
+    def _model_on_params():
+        model = binary_cheater(RandomSeatingModel, (), AdjacencyType.sideways_only)
+        model_on_params(state["evals"], state["seats"], state["true_value"], model, (0.1, 0.5),
+                        _correlation_summary, n_trials)
+    def _bootstrap():
+        scores = [state["evals"].evaluation_for(x).score for x in state["evals"].emails]
+        Bootstrap(scores, 1000, ci_amt=95)
+    yield "proc_evaluations", _load_evaluations
+    yield "SeatingChart", _load_seats
+    yield "compensate_for_grader_means", _compensate
+    yield "all_pairs", _all_pairs
+    yield "score_diff_summary", _score_diff
+    yield "one_way_vs_two_way_summary", _one_way_vs_two_way
+    yield "model_on_params", _model_on_params
+    yield "Bootstrap", _bootstrap
+
+def run_benchmarks(sizes, n_trials=10):
+    """
+    Times every stage for each exam size in SIZES.
+
+    Output: a list of dictionaries with keys stage, students, and seconds.
+    """
+    results = []
+    for n_students in sizes:
+        with TemporaryDirectory() as directory:
+            for stage, function in _stages(directory, n_students, n_trials):
+                start = perf_counter()
+                function()
+                results.append({"stage" : stage, "students" : n_students,
+                                "seconds" : perf_counter() - start})
+    return results
+
+def regressions(results, baseline, tolerance):
+    """
+    Outputs an iterable of (result, baseline seconds) for every result that took more than TOLERANCE
+        times as long as the matching result in BASELINE.
+    """
+    expected = {(x["stage"], x["students"]) : x["seconds"] for x in baseline}
+    for result in results:
+        key = result["stage"], result["students"]
+        if key in expected and result["seconds"] > tolerance * expected[key]:
+            yield result, expected[key]
+
+def main(argv):
+    """
+    Runs the benchmarks, writes the results, and compares them to the baseline.
+    """
+    parser = ArgumentParser(description="Benchmark the analysis on synthetic exams.")
+    parser.add_argument("--sizes", default="100,1000",
+                        help="comma separated numbers of students (default: 100,1000)")
+    parser.add_argument("--trials", type=int, default=10,
+                        help="number of trials for model_on_params (default: 10)")
+    parser.add_argument("--output", default="benchmark.json", help="where to write the results")
+    parser.add_argument("--baseline", default="benchmark-baseline.json",
+                        help="the results to compare against")
+    parser.add_argument("--tolerance", type=float, default=1.5,
+                        help="allowed ratio of time taken to baseline time (default: 1.5)")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="write the results to the baseline file instead of comparing")
+    args = parser.parse_args(argv)
+    sizes = [int(x) for x in args.sizes.split(",")]
+    results = run_benchmarks(sizes, args.trials)
+    results += [{"stage" : "startup " + module, "students" : 0, "seconds" : startup_time(module)}
+                for module in sorted(STARTUP_BUDGET)]
+    for result in results:
+        print("%-30s %6d students %10.4fs" % (result["stage"], result["students"],
+                                              result["seconds"]))
+    report = {"numpy" : np.__version__, "python" : sys.version, "results" : results}
+    with open(args.baseline if args.save_baseline else args.output, "w") as fil:
+        json.dump(report, fil, indent=2)
+    over_budget = list(startup_over_budget(results))
+    for result, budget in over_budget:
+        print("OVER BUDGET: %s took %.4fs (budget %.4fs)" % (result["stage"], result["seconds"],
+                                                             budget))
+    if args.save_baseline:
+        return 1 if over_budget else 0
+    try:
+        with open(args.baseline) as fil:
+            baseline = json.load(fil)["results"]
+    except FileNotFoundError:
+        print("No baseline at %s; run with --save-baseline to create one" % args.baseline)
+        return 1 if over_budget else 0
+    slow = list(regressions(results, baseline, args.tolerance))
+    for result, expected in slow:
+        print("REGRESSION: %s with %s students took %.4fs (baseline %.4fs)"
+              % (result["stage"], result["students"], result["seconds"], expected))
+    return 1 if slow or over_budget else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
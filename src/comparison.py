@@ -0,0 +1,140 @@
+"""
+Compares many models against many summaries on many exams in a single parallel batch.
+
+Usage: comparison.py N_TRIALS [N_PROCESSES]
+
+Runs every default model against the summaries in SUMMARIES on each exam of the semester, and
+    prints a table of the results.
+"""
+import sys
+from collections import namedtuple, OrderedDict
+from itertools import product
+
+from analytics import compensate_for_grader_means, room_pair_totals, room_layer_differences
+from analytics import _pair_values, _pairs_per_individual
+from constants import DATA_DIR
+from evaluations import proc_evaluations
+from graded_exam import ExamGrades
+from graphics import NoProgressBar, TerminalProgressBar
+from models import model_on_params, binary_cheater, score_diff_summary, one_way_vs_two_way_summary
+from models import ScoreIndependentModel, QuestionIndependentModel, RandomSeatingModel
+from models import PointEvaluation
+from parallel import parallel_map
+from seating_chart import SeatingChart, AdjacencyType
+from statistics import TailType
+
+class ComparisonResult(namedtuple("ComparisonResult",
+                                  ["exam", "model", "summary", "params", "true_value", "report"])):
+    """
+    The result of running one model on one exam and testing it with one summary.
+    """
+    @property
+    def p_value(self):
+        """
+        The p-value of the true value of the summary under the model.
+        """
+        return self.report.p_value
+
+def default_models(cheater_params=(0.1, 0.5)):
+    """
+    An ordered dictionary from model name to (model, params) containing the independent models, the
+        random seating model, and a binary cheater model based on random seating for every adjacency
+        type, each with CHEATER_PARAMS.
+    """
+    models = OrderedDict()
+    for model in ScoreIndependentModel, QuestionIndependentModel, RandomSeatingModel:
+        models[model.name()] = model, ()
+    for adjacency_type in AdjacencyType:
+        model = binary_cheater(RandomSeatingModel, (), adjacency_type)
+        models["%s (%s)" % (model.name(), adjacency_type.name)] = model, cheater_params
+    return models
+
+def _correlation_summary(grades, seats):
+    """
+    The difference in correlation between students one and two seats apart.
+    """
+    return one_way_vs_two_way_summary(grades, seats, gambler_fallacy_allowable_limit=1,
+                                      similarity_fn=lambda x, y: x.correlation(y))
+
+SUMMARIES = OrderedDict([("score difference", score_diff_summary),
+                         ("one vs two away correlation", _correlation_summary)])
+
+# the functions each summary calls, which identify its trials in a ResultStore
+_DEPENDS = {
+    score_diff_summary : (compensate_for_grader_means, room_pair_totals, _pair_values,
+                          _pairs_per_individual),
+    _correlation_summary : (one_way_vs_two_way_summary, room_layer_differences,
+                            SeatingChart.similarity_layers,
+                            SeatingChart.similarity_layers_by_limit, ExamGrades.time_masks,
+                            PointEvaluation.correlation),
+}
+
+def compare_models(exams, models, summaries, n_trials, tail_type=TailType.UNKNOWN,
+                   n_processes=None, progress=NoProgressBar, store=None, seed=None):
+    """
+    Runs every model against every summary on every exam, in parallel.
+
+    Inputs:
+        exams: an ordered dictionary from exam name to (ExamGrades, SeatingChart)
+        models: an ordered dictionary from model name to (model, params)
+        summaries: an ordered dictionary from summary name to summary function
+        n_trials, tail_type, store, seed: passed to model_on_params
+        n_processes: the number of worker processes; the exams, models, and summaries are shared
+            with them rather than copied for each task
+        progress: Integer -> ProgressBar, used to report the number of tasks completed
+
+    Output: a list of ComparisonResult, ordered by exam, then model, then summary.
+    """
+    true_tasks = list(product(exams, summaries))
+    true_values = dict(zip(true_tasks, parallel_map(
+        lambda task: summaries[task[1]](*exams[task[0]]), true_tasks, n_processes)))
+    tasks = list(product(exams, models, summaries))
+    def _run(task):
+        exam, model, summary = task
+        grades, seats = exams[exam]
+        model_type, params = models[model]
+        _, _, report = model_on_params(grades, seats, true_values[exam, summary], model_type,
+                                       params, summaries[summary], n_trials, tail_type=tail_type,
+                                       store=store, seed=seed,
+                                       depends=_DEPENDS.get(summaries[summary], ()))
+        return report
+    reports = parallel_map(_run, tasks, n_processes, progress)
+    return [ComparisonResult(exam, model, summary, models[model][1],
+                             true_values[exam, summary], report)
+            for (exam, model, summary), report in zip(tasks, reports)]
+
+def comparison_table(results):
+    """
+    Formats a list of ComparisonResult as a plain text table.
+    """
+    header = ("Exam", "Model", "Summary", "Params", "True value", "P-value", "Trials")
+    rows = [header] + [(result.exam, result.model, result.summary, str(result.params),
+                        "%.4f" % result.true_value, "%.4f" % result.p_value,
+                        str(result.report.n_trials))
+                       for result in results]
+    widths = [max(len(row[column]) for row in rows) for column in range(len(header))]
+    lines = ["  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip()
+             for row in rows]
+    lines.insert(1, "  ".join("-" * width for width in widths))
+    return "\n".join(lines)
+
+def main(argv):
+    """
+    Compares the default models on the exams of the semester.
+    """
+    if len(argv) not in (1, 2):
+        raise RuntimeError("Usage: comparison.py N_TRIALS [N_PROCESSES]")
+    n_trials = int(argv[0])
+    n_processes = int(argv[1]) if len(argv) == 2 else None
+    exams = OrderedDict()
+    for exam in "mt1", "mt2", "final":
+        exams[exam] = (proc_evaluations('%s/real-data/%s_evaluations.zip' % (DATA_DIR, exam)),
+                       SeatingChart('%s/real-data/%s_seats.csv' % (DATA_DIR, exam)))
+    results = compare_models(exams, default_models(), SUMMARIES, n_trials,
+                             tail_type=TailType.KNOWN_HIGH, n_processes=n_processes,
+                             progress=TerminalProgressBar)
+    print()
+    print(comparison_table(results))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
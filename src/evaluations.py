@@ -3,13 +3,19 @@ Module for reading and processing evaluations, which are the scores for individu
 """
 from os import system
 from os import listdir
+from os.path import basename
+from hashlib import sha1
+from io import StringIO
+from zipfile import ZipFile
 import csv
+import re
 
 import numpy as np
 
 from graded_exam import ExamGrades
 
 from constants import DATA_DIR
+from instrument import timed
 from tools import cached_property
 
 class Evaluation:
@@ -31,6 +37,12 @@ class Evaluation:
         """
         return Evaluation(self.name, self.email,
                           *[x.zero_mean(y) for x, y in zip(self.evals, means)])
+    def replace_questions(self, scores_per_index):
+        """
+        Replace the scored questions at the given indices : dictionary index -> ScoredQuestion.
+        """
+        return Evaluation(self.name, self.email,
+                          *[scores_per_index.get(i, x) for i, x in enumerate(self.evals)])
     @cached_property
     def score(self):
         """
@@ -156,31 +168,129 @@ class ScoredQuestion:
         """
         return self.complete_score.rubric_items
 
-RUBRIC_ITEMS = {'true' : 1, 'false' : 0}
+class QuestionColumns:
+    """
+    The contents of a single question's evaluation CSV, stored column by column.
 
-def _read_evaluation_csv(csv_file):
+    Each array is aligned by row; rubric_items is a boolean matrix with one row per submission and
+        one column per rubric item, and grader_codes indexes into graders.
+    """
+    def __init__(self, run_ids, names, emails, scores, rubric_items, adjustments, comments,
+                 grader_codes, graders):
+        self.run_ids = run_ids
+        self.names = names
+        self.emails = emails
+        self.scores = scores
+        self.rubric_items = rubric_items
+        self.adjustments = adjustments
+        self.comments = comments
+        self.grader_codes = grader_codes
+        self.graders = graders
+    def __len__(self):
+        return len(self.run_ids)
+    def scored_question(self, index):
+        """
+        Builds the ScoredQuestion for the submission in the given row.
+        """
+        rubric_items = self.rubric_items[index].astype(int).tolist()
+        return ScoredQuestion(self.emails[index],
+                              QuestionScore(float(self.scores[index]), rubric_items,
+                                            float(self.adjustments[index])),
+                              self.comments[index],
+                              self.graders[self.grader_codes[index]])
+
+def _column_mapping(header):
     """
-    Reads in a CSV as an evaluation. Format specified by assertions.
+    Checks the header of an evaluation CSV and returns the (name, email, score, rubric, adjustment,
+        comments, grader) column positions, with rubric being a slice.
     """
-    with open(csv_file, 'r') as fil:
-        csvlines = list(csv.reader(fil))
-    header, *rows = csvlines
     assert header[1] == "Name"
     assert header[3] == "Email"
     assert header[4] == "Score"
     assert header[-3:] == ["Adjustment", "Comments", "Grader"]
-    for run_id, row in enumerate(rows):
+    width = len(header)
+    return 1, 3, 4, slice(5, width - 3), width - 3, width - 2, width - 1
+
+def _parse_evaluation_rows(csv_rows):
+    """
+    Parses an iterable of CSV rows (including the header) into a QuestionColumns. Format specified by
+        assertions in _column_mapping.
+    """
+    csv_rows = iter(csv_rows)
+    name, email, score, rubric, adjustment, comments, grader = _column_mapping(next(csv_rows))
+    columns = [], [], [], [], [], [], []
+    names, emails, scores, rubrics, adjustments, all_comments, graders = columns
+    for row in csv_rows:
         if len(row) == 0:
             break
-        rubric_items = [RUBRIC_ITEMS[x] for x in row[5:-3]]
-        adjustment = float(row[-3]) if row[-3] != '' else 0
-        yield (run_id, row[1], row[3]), \
-                ScoredQuestion(row[3],
-                               QuestionScore(float(row[4]), rubric_items, adjustment),
-                               row[-2],
-                               row[-1])
+        names.append(row[name])
+        emails.append(row[email])
+        scores.append(row[score])
+        rubrics.append(row[rubric])
+        adjustments.append(row[adjustment])
+        all_comments.append(row[comments])
+        graders.append(row[grader])
+    cells = np.array(rubrics, dtype=str).reshape(len(rubrics), rubric.stop - rubric.start)
+    rubric_items = cells == 'true'
+    unknown = ~(rubric_items | (cells == 'false'))
+    if unknown.any():
+        raise KeyError(cells[unknown][0])
+    adjustments = np.array(adjustments, dtype=object)
+    adjustments[adjustments == ''] = 0
+    grader_names, grader_codes = np.unique(np.array(graders, dtype=str), return_inverse=True)
+    return QuestionColumns(np.arange(len(names)),
+                           np.array(names, dtype=object),
+                           np.array(emails, dtype=object),
+                           np.array(scores, dtype=float),
+                           rubric_items,
+                           adjustments.astype(float),
+                           np.array(all_comments, dtype=object),
+                           grader_codes,
+                           grader_names.tolist())
 
+def _read_evaluation_csv(csv_file):
+    """
+    Reads in a CSV as a QuestionColumns. Format specified by assertions.
+    """
+    with open(csv_file, 'r', newline='') as fil:
+        return _parse_evaluation_rows(csv.reader(fil))
 
+def _merge_questions(problems_and_columns):
+    """
+    Joins the QuestionColumns for each problem into a single ExamGrades. Every question must contain
+        the same submissions in the same order, which are identified by their run id (their row).
+    """
+    problems_and_columns = sorted(problems_and_columns, key=lambda x: x[0])
+    problems = [problem for problem, _ in problems_and_columns]
+    questions = [columns for _, columns in problems_and_columns]
+    first = questions[0]
+    for question in questions[1:]:
+        aligned = len(question) == len(first) \
+            and np.array_equal(question.run_ids, first.run_ids) \
+            and np.array_equal(question.names, first.names) \
+            and np.array_equal(question.emails, first.emails)
+        if not aligned:
+            raise RuntimeError("Evaluation CSVs do not contain the same submissions")
+    merged = {}
+    for index, identity in enumerate(first.run_ids.tolist()):
+        merged[identity] = Evaluation(first.names[index], first.emails[index],
+                                      *[question.scored_question(index) for question in questions])
+    return ExamGrades.create(problems, merged)
+
+def _problem_number(fil):
+    """
+    Gets the problem number from the name of an evaluation CSV, e.g., 1.3 for 1.3_Question_1.csv
+    """
+    return float(fil[:fil.index("_")])
+
+def _is_evaluation_csv(fil):
+    """
+    Whether the given file name is that of an evaluation CSV, e.g., 1.3_Question_1.csv, rather than
+        another file in the export, such as a README or macOS metadata.
+    """
+    return re.fullmatch(r"[0-9]+(\.[0-9]+)?_.*\.csv", fil) is not None
+
+@timed("ingestion")
 def proc_evaluations(evaluations):
     """
     Extracts the given zip file of evaluations and merges them all into a single dictionary from
@@ -188,19 +298,76 @@ def proc_evaluations(evaluations):
     """
     extracted = DATA_DIR + '/extracted/'
     system("unzip {} -d {}".format(evaluations, extracted))
-    loc = extracted + listdir(extracted)[0]
+    loc = extracted + [x for x in listdir(extracted) if x != "__MACOSX"][0]
     evals = []
-    keys = set()
     for fil in listdir(loc):
-        problem = float(fil[:fil.index("_")])
-        current = dict(_read_evaluation_csv(loc + "/" + fil))
-        keys.update(current.keys())
-        evals.append((problem, current))
-    evals.sort()
-    problems = [x for x, _ in evals]
-    merged = {}
-    for key in keys:
-        identity, name, email = key
-        merged[identity] = Evaluation(name, email, *[x[key] for _, x in evals])
+        if not _is_evaluation_csv(fil):
+            continue
+        problem = _problem_number(fil)
+        evals.append((problem, _read_evaluation_csv(loc + "/" + fil)))
     system('rm -r {}'.format(extracted))
-    return ExamGrades.create(problems, merged)
+    return _merge_questions(evals)
+
+class IncrementalEvaluations:
+    """
+    Ingests successive exports of the same zip file of evaluations, only re-parsing the question
+        CSVs whose contents have changed since the previous export.
+
+    After each call to update, grades holds the same ExamGrades proc_evaluations would produce, and
+        every cache in CACHES (e.g., a CompensationCache) has been told which problems changed.
+    """
+    def __init__(self, caches=()):
+        self.__fingerprints = {}
+        self.__columns = {}
+        self.__caches = list(caches)
+        self.grades = None
+    def update(self, evaluations):
+        """
+        Reads the given zip file of evaluations and patches grades with every question that changed.
+            If a question cannot be read or merged, the error is raised and nothing is updated, so
+            the next call reads every changed question again.
+
+        Output: the set of problems that were added, removed, or modified.
+        """
+        changed = {}
+        fingerprints = {}
+        with ZipFile(evaluations) as zipped:
+            for member in zipped.namelist():
+                fil = basename(member)
+                if not _is_evaluation_csv(fil):
+                    continue
+                problem = _problem_number(fil)
+                contents = zipped.read(member)
+                fingerprints[problem] = sha1(contents).hexdigest()
+                if self.__fingerprints.get(problem) == fingerprints[problem]:
+                    continue
+                changed[problem] = _parse_evaluation_rows(
+                    csv.reader(StringIO(contents.decode(), newline='')))
+        removed = set(self.__columns) - set(fingerprints)
+        if not changed and not removed:
+            return set()
+        columns = {problem : question for problem, question in self.__columns.items()
+                   if problem not in removed}
+        columns.update(changed)
+        if self.grades is not None and not removed and self.__can_patch(changed):
+            grades = self.grades.replace_questions(
+                {problem : {question.emails[i] : question.scored_question(i)
+                            for i in range(len(question))}
+                 for problem, question in changed.items()})
+        else:
+            grades = _merge_questions(columns.items())
+        self.__fingerprints, self.__columns, self.grades = fingerprints, columns, grades
+        for cache in self.__caches:
+            cache.invalidate(set(changed) | removed)
+        return set(changed) | removed
+    def __can_patch(self, changed):
+        """
+        Whether every changed question updates an existing problem without changing the submissions.
+        """
+        if not set(changed) <= set(self.__columns):
+            return False
+        reference = next(iter(self.__columns.values()))
+        return all(np.array_equal(columns.run_ids, reference.run_ids)
+                   and np.array_equal(columns.emails, reference.emails)
+                   and np.array_equal(columns.names, reference.names)
+                   for columns in changed.values())
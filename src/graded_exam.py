@@ -1,10 +1,12 @@
 """
 A set of classes for handling graded exams
 """
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 import numpy as np
 
-from tools import cached_property
+from tools import cached_property, fingerprint
+
+GroupedProfile = namedtuple("GroupedProfile", ["groups", "means", "stds", "counts"])
 
 class ExamQuestion:
     """
@@ -47,7 +49,9 @@ class ExamQuestion:
         """
         Get the standard deviation of the rubrics
         """
-        return np.std(self.__scores)
+        scores = self.__scores
+        mean = np.mean(scores)
+        return np.mean([(x - mean) * (x - mean) for x in scores]).sqrt()
     @property
     def mean_score(self):
         """
@@ -91,6 +95,45 @@ class ExamGrades:
         return [x
                 for ev in self.evaluation_for(email).evals
                 for x in ev.complete_score.rubric_items]
+    @cached_property
+    def rubric_matrix(self):
+        """
+        Outputs (emails, matrix), where emails is a sorted list and each row of the matrix is the
+            exam profile of the corresponding email.
+        """
+        emails = sorted(self.__emails)
+        return emails, np.array([self.exam_profile(email) for email in emails], dtype=float)
+    def grouped_profile(self, key):
+        """
+        Computes the mean and standard deviation of every rubric item within each group of students,
+            with a single grouped reduction over the rubric matrix.
+
+        key: a function from email to the student's group (e.g., their room, y region, grader, or
+            row), or None to leave them out
+
+        Output: a GroupedProfile with the groups (in order of first appearance by email), arrays of
+            means and standard deviations with a row per group and a column per rubric item, and an
+            array of the number of students in each group.
+        """
+        emails, matrix = self.rubric_matrix
+        labels = [key(email) for email in emails]
+        index_of = {}
+        for label in labels:
+            if label is not None and label not in index_of:
+                index_of[label] = len(index_of)
+        kept = np.array([label is not None for label in labels], dtype=bool)
+        codes = np.array([index_of[label] for label in labels if label is not None], dtype=int)
+        if len(codes) == 0:
+            empty = np.zeros((0, matrix.shape[1] if matrix.ndim == 2 else 0))
+            return GroupedProfile([], empty, empty, np.zeros(0, dtype=int))
+        order = np.argsort(codes, kind="stable")
+        rows = matrix[kept][order]
+        counts = np.bincount(codes, minlength=len(index_of))
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        means = np.add.reduceat(rows, starts, axis=0) / counts[:, np.newaxis]
+        squares = np.add.reduceat(rows * rows, starts, axis=0) / counts[:, np.newaxis]
+        stds = np.sqrt(np.maximum(squares - means * means, 0))
+        return GroupedProfile(list(index_of), means, stds, counts)
     def change_grades(self, new_evals_per_email):
         """
         Outputs a new ExamGrades object with the given evaluations per email dictionary.
@@ -158,21 +201,31 @@ class ExamGrades:
             self.__problem_names,
             self.__location_per_email,
             {x : updater(y) for x, y in self.__evaluation_per_email.items()})
-    def zero_meaned(self):
+    def replace_questions(self, scores_per_problem):
+        """
+        Outputs a new ExamGrades object in which the scores for each problem in the given dictionary
+            problem -> email -> ScoredQuestion replace the current ones.
+        """
+        by_index = {self.__problem_names.index(problem) : scores
+                    for problem, scores in scores_per_problem.items()}
+        return self.__replace(
+            lambda elem: elem.replace_questions(
+                {index : scores[elem.email] for index, scores in by_index.items()}))
+    def grader_means(self, problem):
+        """
+        Outputs a dictionary from each grader of the given problem to the mean score, rubric items,
+            and adjustment they gave.
+        """
+        question = ExamQuestion(self, problem)
+        return {grader : question.for_grader(grader).mean_score for grader in question.graders}
+    def zero_meaned(self, means_per_problem=None):
         """
         Zero means each question score by grader.
+
+        means_per_problem: a dictionary problem -> grader_means(problem), computed if not provided.
         """
-        def mean_per_question_and_grader():
-            """
-            Produces an iterable of
-                keys : question and grader
-                values : the mean score, rubric items, and adjustment
-            """
-            for quest, grades in self:
-                for grader in grades.graders:
-                    by_grader = grades.for_grader(grader)
-                    yield ((quest, grader), by_grader.mean_score)
-        mpqag = dict(mean_per_question_and_grader())
+        if means_per_problem is None:
+            means_per_problem = {quest : self.grader_means(quest) for quest in self.__problem_names}
         def updater(elem):
             """
             Takes an evaluation and zero means it.
@@ -182,9 +235,63 @@ class ExamGrades:
                 Returns the means for each question for the given grader.
                 """
                 for que, eva in zip(self.__problem_names, elem.evals):
-                    yield mpqag[(que, eva.grader)]
+                    yield means_per_problem[que][eva.grader]
             return elem.zero_mean(means())
         return self.__replace(updater)
+    @cached_property
+    def fingerprint(self):
+        """
+        A digest of the problems and every student's time index and evaluation, which identifies
+            this exam in the result store.
+        """
+        return fingerprint([self.__problem_names] +
+                           [(email, self.__location_per_email[email], self.evaluation_for(email))
+                            for email in sorted(self.__emails)])
+    @cached_property
+    def student_ids(self):
+        """
+        A dictionary from email to the id of the student, which is their row in rubric_matrix.
+        """
+        return {email : index for index, email in enumerate(sorted(self.__emails))}
+    @cached_property
+    def time_indices(self):
+        """
+        An integer array of the time index at which each student's exam was processed, by id.
+        """
+        times = np.zeros(len(self.student_ids), dtype=int)
+        for email, index in self.student_ids.items():
+            times[index] = self.__location_per_email[email]
+        return times
+    def ids_for(self, emails):
+        """
+        An integer array of the ids of the given emails, with -1 for those not in this exam.
+        """
+        ids = self.student_ids
+        return np.array([ids.get(email, -1) for email in emails], dtype=int)
+    def time_diffs(self, first_ids, second_ids):
+        """
+        The vectorized version of time_diff, on aligned arrays of ids. Like time_diff, raises a
+            KeyError if any id is -1, i.e., for a student not in this exam.
+        """
+        first_ids, second_ids = np.asarray(first_ids, dtype=int), np.asarray(second_ids, dtype=int)
+        if (first_ids < 0).any() or (second_ids < 0).any():
+            raise KeyError("A student is not in this exam")
+        times = self.time_indices
+        return times[first_ids] - times[second_ids]
+    def time_masks(self, first_ids, second_ids, limits):
+        """
+        For each of the given gambler's fallacy allowable limits, a mask of the pairs of ids that
+            were processed within that limit, i.e., time_diff(first, second) <= limit. Pairs in
+            which either id is -1 (a student not in this exam) are never within the limit.
+
+        Output: a boolean array with a row per limit and a column per pair
+        """
+        first_ids, second_ids = np.asarray(first_ids, dtype=int), np.asarray(second_ids, dtype=int)
+        known = (first_ids >= 0) & (second_ids >= 0)
+        diffs = self.time_diffs(first_ids[known], second_ids[known])
+        masks = np.zeros((len(limits), len(known)), dtype=bool)
+        masks[:, known] = diffs[np.newaxis, :] <= np.array(limits)[:, np.newaxis]
+        return masks
     def time_diff(self, email_a, email_b):
         """
         Get the difference between the times at which email_a and email_b were processed (in number
@@ -1,7 +1,12 @@
 """
 A module for various graphical functions
 """
+import sys
 from abc import ABCMeta, abstractmethod
+from itertools import count
+from os import getpid
+from threading import Thread
+from time import monotonic
 
 class ProgressBar(metaclass=ABCMeta):
     """
@@ -15,23 +20,145 @@ class ProgressBar(metaclass=ABCMeta):
         Sets the value to the new value
         """
         pass
+    def finish(self):
+        """
+        Shows the last value set, even if it was throttled; e.g., when a loop stops before reaching
+            the maximum value.
+        """
+        pass
+    def __enter__(self):
+        return self
+    def __exit__(self, typ, value, traceback):
+        del typ, value, traceback
+        self.finish()
 
 class NoProgressBar(ProgressBar):
     """
     A progress bar that does nothing
     """
-    def __init_(self):
-        super().__init__(0)
+    def __init__(self, max_value=0):
+        super().__init__(max_value)
     def update(self, new_value):
         del self, new_value
 
+def _format_seconds(seconds):
+    """
+    Formats a number of seconds as H:MM:SS, or ? if it is not finite.
+    """
+    if seconds != seconds or seconds == float('inf'):
+        return "?"
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return "%d:%02d:%02d" % (hours, minutes, seconds)
+
 class TerminalProgressBar(ProgressBar):
     """
-    A progress bar that prints to the terminal
+    A progress bar that prints to the terminal, along with the number of items processed per second
+        and the estimated time remaining.
+
+    The bar is redrawn at most once every min_interval seconds (and always for the final value, or
+        when finish is called), so updating it on every iteration of a tight loop costs very little.
     """
-    def __init__(self, max_value, n_cols=100):
+    def __init__(self, max_value, n_cols=100, min_interval=0.1, stream=None, clock=monotonic):
         super().__init__(max_value)
         self.__total_dashes = n_cols - 2
+        self.__min_interval = min_interval
+        self.__stream = stream
+        self.__clock = clock
+        self.__start = clock()
+        self.__last_draw = None
+        # the last value set, and the last value drawn
+        self.__value = self.__drawn = None
     def update(self, new_value):
-        dashes = round(self.__total_dashes * (new_value + 1) / self._max_value)
-        print("\r|{}{}|".format("-" * dashes, " " * (self.__total_dashes - dashes)), end="")
+        now = self.__clock()
+        self.__value = new_value
+        finished = new_value + 1 >= self._max_value
+        if not finished and self.__last_draw is not None \
+                and now - self.__last_draw < self.__min_interval:
+            return
+        self.__draw(now)
+    def finish(self):
+        if self.__value is not None and self.__value != self.__drawn:
+            self.__draw(self.__clock())
+    def __draw(self, now):
+        self.__last_draw = now
+        self.__drawn = self.__value
+        print("\r" + self.render(self.__value, now), end="", file=self.__stream or sys.stdout)
+    def render(self, new_value, now):
+        """
+        Get the text of the progress bar for the given value at the given time.
+        """
+        completed = new_value + 1
+        fraction = completed / self._max_value if self._max_value else 1
+        dashes = round(self.__total_dashes * fraction)
+        elapsed = now - self.__start
+        rate = completed / elapsed if elapsed > 0 else float('inf')
+        remaining = (self._max_value - completed) / rate if rate > 0 else float('inf')
+        return "|{}{}| {:.1f}/s ETA {}".format("-" * dashes, " " * (self.__total_dashes - dashes),
+                                               rate, _format_seconds(remaining))
+
+_BAR_IDS = count()
+
+class QueueProgressBar(ProgressBar):
+    """
+    A progress bar for use in worker processes, which sends its progress through a queue to a
+        ProgressMonitor in the parent process. The queue must be shareable with the workers, e.g.,
+        one created by multiprocessing.Manager().
+
+    Like TerminalProgressBar, it sends at most one message every min_interval seconds; finish sends
+        the last value if it was held back.
+    """
+    def __init__(self, max_value, queue, min_interval=0.1, clock=monotonic):
+        super().__init__(max_value)
+        self.__queue = queue
+        self.__key = getpid(), next(_BAR_IDS)
+        self.__min_interval = min_interval
+        self.__clock = clock
+        self.__last_sent = None
+        # the last value set, and the last value sent
+        self.__value = self.__sent = None
+    def update(self, new_value):
+        now = self.__clock()
+        self.__value = new_value
+        finished = new_value + 1 >= self._max_value
+        if not finished and self.__last_sent is not None \
+                and now - self.__last_sent < self.__min_interval:
+            return
+        self.__send(now)
+    def finish(self):
+        if self.__value is not None and self.__value != self.__sent:
+            self.__send(self.__clock())
+    def __send(self, now):
+        self.__last_sent = now
+        self.__sent = self.__value
+        self.__queue.put((self.__key, self.__value + 1))
+
+class ProgressMonitor:
+    """
+    Combines the progress sent by every QueueProgressBar using the given queue into a single progress
+        bar of the given total.
+
+    Used as a context manager; while inside it, a background thread reads from the queue.
+    """
+    def __init__(self, queue, total, progress=TerminalProgressBar):
+        self.__queue = queue
+        self.__bar = progress(total)
+        self.__thread = Thread(target=self.__run, daemon=True)
+        self.completed = 0
+    def __enter__(self):
+        self.__thread.start()
+        return self
+    def __exit__(self, typ, value, traceback):
+        del typ, value, traceback
+        self.__queue.put(None)
+        self.__thread.join()
+    def __run(self):
+        completed_per_bar = {}
+        while True:
+            message = self.__queue.get()
+            if message is None:
+                return
+            key, completed = message
+            self.completed += completed - completed_per_bar.get(key, 0)
+            completed_per_bar[key] = completed
+            self.__bar.update(self.completed - 1)
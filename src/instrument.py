@@ -0,0 +1,149 @@
+"""
+Lightweight instrumentation of the named stages of the analysis pipeline.
+
+Spans are only recorded between a call to enable and a call to disable. While disabled, span returns
+    a shared context manager that does nothing and timed functions call straight through, so leaving
+    the instrumentation in place costs almost nothing.
+"""
+import json
+import tracemalloc
+from functools import wraps
+from time import perf_counter
+
+class _NoSpan:
+    """
+    The span used while instrumentation is disabled.
+    """
+    def __enter__(self):
+        return self
+    def __exit__(self, typ, value, traceback):
+        del typ, value, traceback
+
+_NO_SPAN = _NoSpan()
+
+class Recorder:
+    """
+    Records the spans entered while instrumentation is enabled.
+
+    Each record is a dictionary with the span's name, the stack of enclosing span names, the start
+        time and duration in seconds, and, if allocations are being traced, the net number of bytes
+        allocated during the span.
+    """
+    def __init__(self, allocations):
+        self.allocations = allocations
+        self.records = []
+        self.stack = []
+        self.origin = perf_counter()
+        self.started_tracing = False
+    def summary(self):
+        """
+        Get a dictionary from span name to the number of times it was entered, the total wall time
+            in seconds, and the total net allocations in bytes (or None if not traced).
+        """
+        result = {}
+        for record in self.records:
+            if record["name"] not in result:
+                result[record["name"]] = {"count" : 0, "seconds" : 0,
+                                          "allocated" : 0 if self.allocations else None}
+            stage = result[record["name"]]
+            stage["count"] += 1
+            stage["seconds"] += record["seconds"]
+            if self.allocations:
+                stage["allocated"] += record["allocated"]
+        return result
+
+class _Span:
+    """
+    A span that is recorded by the current recorder when it exits.
+    """
+    def __init__(self, recorder, name):
+        self.__recorder = recorder
+        self.__name = name
+        self.__start = None
+        self.__memory = None
+    def __enter__(self):
+        self.__recorder.stack.append(self.__name)
+        if self.__recorder.allocations:
+            self.__memory = tracemalloc.get_traced_memory()[0]
+        self.__start = perf_counter()
+        return self
+    def __exit__(self, typ, value, traceback):
+        del typ, value, traceback
+        end = perf_counter()
+        recorder = self.__recorder
+        record = {"name" : self.__name,
+                  "stack" : list(recorder.stack),
+                  "start" : self.__start - recorder.origin,
+                  "seconds" : end - self.__start}
+        if recorder.allocations:
+            record["allocated"] = tracemalloc.get_traced_memory()[0] - self.__memory
+        recorder.records.append(record)
+        recorder.stack.pop()
+
+_RECORDER = [None]
+
+def enable(allocations=False):
+    """
+    Starts recording spans, discarding anything previously recorded. If ALLOCATIONS is true, the
+        memory allocated in each span is traced as well, which is considerably slower.
+    """
+    disable()
+    _RECORDER[0] = Recorder(allocations)
+    if allocations and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _RECORDER[0].started_tracing = True
+
+def disable():
+    """
+    Stops recording spans. Returns the Recorder holding everything recorded since enable.
+    """
+    recorder, _RECORDER[0] = _RECORDER[0], None
+    if recorder is not None and recorder.started_tracing:
+        tracemalloc.stop()
+    return recorder
+
+def span(name):
+    """
+    A context manager that records the time spent inside it under the given name.
+    """
+    if _RECORDER[0] is None:
+        return _NO_SPAN
+    return _Span(_RECORDER[0], name)
+
+def timed(name):
+    """
+    A decorator that records every call to the function as a span with the given name.
+    """
+    def decorator(function):
+        """
+        Wraps FUNCTION in a span.
+        """
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            """
+            Calls FUNCTION, inside a span if instrumentation is enabled.
+            """
+            if _RECORDER[0] is None:
+                return function(*args, **kwargs)
+            with _Span(_RECORDER[0], name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def export_json(recorder, path):
+    """
+    Writes the per-stage summary and every recorded span to PATH as JSON.
+    """
+    with open(path, "w") as fil:
+        json.dump({"stages" : recorder.summary(), "spans" : recorder.records}, fil, indent=2)
+
+def export_trace(recorder, path):
+    """
+    Writes the recorded spans to PATH in the Trace Event Format, which can be viewed as a flame graph
+        in chrome://tracing or speedscope.
+    """
+    events = [{"name" : record["name"], "ph" : "X", "pid" : 0, "tid" : 0,
+               "ts" : record["start"] * 1e6, "dur" : record["seconds"] * 1e6}
+              for record in recorder.records]
+    with open(path, "w") as fil:
+        json.dump({"traceEvents" : events}, fil)
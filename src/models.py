@@ -3,33 +3,46 @@ A module for handling models.
 """
 
 from abc import abstractmethod, ABCMeta
+from collections import deque
+from hashlib import sha1
 from math import floor
 import numpy as np
-from numpy.random import random, choice, normal, shuffle
 
 from statistics import p_value, PermutationReport, TailType
-from analytics import all_pairs, compensate_for_grader_means
+from analytics import compensate_for_grader_means, room_pair_totals, room_layer_differences
 from graphics import NoProgressBar
+from instrument import span, timed
+from result_store import run_key
+from tools import cached_property
 
 from seating_chart import AdjacencyType
 
+# the largest number of trials model_on_params simulates at once
+BATCH_TRIALS = 25
+
 class Model(metaclass=ABCMeta):
     """
     Represents the abstract concept of a model, which has a parameter and a way to generate grades.
     """
     def __init__(self, environment):
         self._environment = environment
-    def create_grades(self, seating_chart):
+    def create_grades(self, seating_chart, rng=np.random):
         """
-        Creates an ExamGrades at random for the given seating chart.
+        Creates an ExamGrades at random for the given seating chart, drawing from RNG (a numpy
+            RandomState, or numpy's global random state by default).
         """
-        return self._environment.change_grades(dict(self._get_grades(seating_chart)))
+        return self._environment.change_grades(dict(self._get_grades(seating_chart, rng)))
     @abstractmethod
-    def _get_grades(self, seating_chart):
+    def _get_grades(self, seating_chart, rng):
         """
-        Randomly generates a generator (email, Evaluation) for the given exam.
+        Randomly generates a generator (email, Evaluation) for the given exam, drawing from RNG.
         """
         pass
+    def create_grades_batch(self, seating_chart, n_trials, rng=np.random):
+        """
+        Creates a list of N_TRIALS ExamGrades at random for the given seating chart.
+        """
+        return [self.create_grades(seating_chart, rng) for _ in range(n_trials)]
     @staticmethod
     @abstractmethod
     def parameters(granularity):
@@ -47,7 +60,67 @@ class Model(metaclass=ABCMeta):
         """
         pass
 
-def plausible_parameters(true_grades, true_seats, model, summary, granularity, n_trials, progress):
+class GridRefinement:
+    """
+    An adaptive sweep over the parameters of a two-parameter model, such as those produced by
+        binary_cheater, which concentrates the evaluations near the boundary of the plausible region.
+
+    The sweep evaluates an initial by initial grid spanning the bounds, then repeatedly splits into
+        four every cell whose corners have p-values on both sides of alpha, up to max_depth times.
+        Cells are split breadth first, so stopping the sweep early leaves an evenly refined contour.
+
+    Inputs:
+        bounds:     ((low, high), (low, high)), the range of each parameter
+        alpha:      the significance level separating plausible from implausible parameters
+        initial:    the number of points along each side of the initial grid
+        max_depth:  the maximum number of times a cell is split
+    """
+    def __init__(self, bounds=((0, 1), (0, 1)), alpha=0.05, initial=3, max_depth=4):
+        self.bounds = bounds
+        self.alpha = alpha
+        self.initial = initial
+        self.max_depth = max_depth
+    def __params(self, point, resolution):
+        return tuple(low + (high - low) * coordinate / resolution
+                     for (low, high), coordinate in zip(self.bounds, point))
+    def sweep(self, evaluate, budget=None):
+        """
+        Runs the sweep, where evaluate takes parameters and returns (parameters, p-value, report) as
+            model_on_params does, stopping after BUDGET evaluations if it is not None.
+
+        Output: a generator of the result of each evaluation, in the order they are performed.
+        """
+        step = 2 ** self.max_depth
+        resolution = (self.initial - 1) * step
+        p_values = {}
+        def _evaluate(points):
+            for point in points:
+                if point in p_values:
+                    continue
+                if budget is not None and len(p_values) == budget:
+                    return
+                result = evaluate(self.__params(point, resolution))
+                p_values[point] = result[1]
+                yield result
+        cells = deque((x * step, y * step, step)
+                      for x in range(self.initial - 1) for y in range(self.initial - 1))
+        yield from _evaluate((x * step, y * step)
+                             for x in range(self.initial) for y in range(self.initial))
+        while cells:
+            x, y, size = cells.popleft()
+            corners = [(x, y), (x + size, y), (x, y + size), (x + size, y + size)]
+            yield from _evaluate(corners)
+            if any(corner not in p_values for corner in corners):
+                return
+            corner_p_values = [p_values[corner] for corner in corners]
+            if size == 1 or not min(corner_p_values) <= self.alpha < max(corner_p_values):
+                continue
+            half = size // 2
+            cells.extend((x + u * half, y + v * half, half) for u in range(2) for v in range(2))
+
+def plausible_parameters(true_grades, true_seats, model, summary, granularity, n_trials, progress,
+                         sequential=None, refinement=None, bank=None, store=None, seed=None,
+                         depends=()):
     """
     Inputs:
         true_grades: ExamGrades
@@ -60,17 +133,37 @@ def plausible_parameters(true_grades, true_seats, model, summary, granularity, n
             which we are testing
         granularity: Integer
             the number of parameter values to try
+        sequential: SequentialTest or None
+            if provided, used to stop simulating each parameter value early; see model_on_params
+        refinement: GridRefinement or None
+            if provided, the parameters are chosen by the adaptive sweep it describes instead of
+                model.parameters, with granularity being the maximum number to try
+        bank: BaseTrialBank or None
+            if provided, shared by every parameter value; see model_on_params
+        store, seed, depends: ResultStore or None, Integer or None, tuple
+            if provided, used for every parameter value; see model_on_params
     Output:
         a generator of (parameter, probability) for each parameter value we try. The probability is
             P[summary=given_summary | model(parameter) is true]
     """
     true_value = summary(true_grades, true_seats)
     p_bar = progress(granularity)
-    for index, params in enumerate(model.parameters(granularity)):
-        p_bar.update(index)
-        yield model_on_params(true_grades, true_seats, true_value, model, params, summary, n_trials)
+    count = [0]
+    def _evaluate(params):
+        p_bar.update(count[0])
+        count[0] += 1
+        return model_on_params(true_grades, true_seats, true_value, model, params, summary, n_trials,
+                               sequential=sequential, bank=bank, store=store, seed=seed,
+                               depends=depends)
+    if refinement is not None:
+        yield from refinement.sweep(_evaluate, granularity)
+    else:
+        for params in model.parameters(granularity):
+            yield _evaluate(params)
 
-def model_on_params(true_grades, true_seats, true_value, model, params, summary, n_trials, tail_type=TailType.UNKNOWN):
+def model_on_params(true_grades, true_seats, true_value, model, params, summary, n_trials, tail_type=TailType.UNKNOWN,
+                    progress=NoProgressBar, sequential=None, bank=None, store=None, seed=None,
+                    depends=()):
     """
     Run the given model on the given parameters.
 
@@ -88,61 +181,128 @@ def model_on_params(true_grades, true_seats, true_value, model, params, summary,
             the parameters to plug into the model
         summary: (ExamGrades, SeatingChart) -> Float
             which we are testing
-        granularity: Integer
-            the number of parameter values to try
+        n_trials: Integer
+            the number of times to simulate the model, or the maximum number if sequential is given
+        progress: Integer -> ProgressBar
+            used to report progress over the trials
+        sequential: SequentialTest or None
+            if provided, the trials stop as soon as the p-value is decidedly above or below its
+                significance level. The report records how many trials were used.
+        bank: BaseTrialBank or None
+            if provided, trial i perturbs the i-th base trial of the bank rather than simulating the
+                base model afresh. The model must be the binary_cheater the bank was built from.
+        store: ResultStore or None
+            if provided, the trials already stored for this run are used rather than simulated, and
+                the rest are added to the store. Requires a seed.
+        seed: Integer or None
+            if provided, the trials are simulated BATCH_TRIALS at a time, with batch b drawn from a
+                RandomState seeded with (seed, b), so that every trial can be reproduced
+        depends: tuple
+            the functions the summary calls and the module-level values it reads, which identify the
+                run in the store along with the summary itself; see result_store.run_key
 
     Output:
         (parameter, probability, report). see plausible_parameters for more info
     """
+    if bank is not None and not bank.compatible_with(model):
+        raise RuntimeError("The bank of base trials was not simulated from the base model of %s"
+                           % model.name())
+    if bank is not None and len(bank) < n_trials:
+        raise RuntimeError("The bank only has %s base trials, but %s were requested"
+                           % (len(bank), n_trials))
+    if store is not None and seed is None:
+        raise RuntimeError("Results can only be stored for seeded runs")
+    stored = []
+    if store is not None:
+        # the trials drawn for a seed depend on how they are batched
+        key = run_key(true_grades, true_seats, model, params, summary, seed, bank,
+                      tuple(depends) + (_simulate_batches, BATCH_TRIALS))
+        stored = store.values(key)
     current_model = model(true_grades, *params)
-    model_values = [summary(current_model.create_grades(true_seats),
-                            true_seats)
-                    for _ in range(n_trials)]
+    if bank is None:
+        simulations = _simulate_batches(current_model, true_seats, len(stored), n_trials, seed)
+    model_values = []
+    p_bar = progress(n_trials)
+    for index in range(n_trials):
+        p_bar.update(index)
+        if index < len(stored):
+            model_values.append(stored[index])
+        else:
+            if bank is not None:
+                with span("model simulation"):
+                    simulated = current_model.create_grades_from(true_seats, bank.grades(index),
+                                                                 bank.random_state(index))
+            else:
+                simulated = next(simulations)
+            model_values.append(summary(simulated, true_seats))
+        if sequential is not None and sequential.should_stop(true_value, model_values, tail_type):
+            # the last update before stopping may have been throttled
+            p_bar.finish()
+            break
+    if store is not None and len(model_values) > len(stored):
+        store.extend(key, len(stored), model_values[len(stored):],
+                     description="%s %s" % (model.name(), tuple(params)))
     p_val = p_value(true_value, model_values, tail_type)
     return params, p_val, PermutationReport(true_value, model_values, tail_type)
 
-def score_diff_summary(grades, seats):
+def _simulate_batches(model, seats, start, stop, seed):
+    """
+    Outputs a generator of the simulated grades of trials START to STOP - 1 of the given model,
+        simulating up to BATCH_TRIALS of them at once with create_grades_batch. Batch b contains
+        trials b * BATCH_TRIALS onwards and, if SEED is given, is drawn from a RandomState seeded
+        with (seed, b), in which case its trials before START are drawn and discarded.
+    """
+    index = start
+    while index < stop:
+        batch = index // BATCH_TRIALS
+        end = min((batch + 1) * BATCH_TRIALS, stop)
+        if seed is None:
+            rng, first = np.random, index
+        else:
+            rng, first = np.random.RandomState([seed, batch]), batch * BATCH_TRIALS
+        with span("model simulation"):
+            trials = model.create_grades_batch(seats, end - first, rng)
+        yield from trials[index - first:]
+        index = end
+
+@timed("summary evaluation")
+def score_diff_summary(grades, seats, n_processes=1):
     """
     A summary statistic representing the difference in mean absolute score difference between the
-        adjacent and non-adjacent groups of pairs of students.
+        adjacent and non-adjacent groups of pairs of students. The pairs of each room are found in
+        one of N_PROCESSES worker processes.
     """
     zero_meaned = compensate_for_grader_means(grades)
-    non_time_adjacents = all_pairs(zero_meaned, seats, 2, NoProgressBar,
-                                   require_same_room=True, require_not_time_adj=True,
-                                   adjacency_type=AdjacencyType.all_ways)
-    space_adj = []
-    non_space_adj = []
-    for pair in non_time_adjacents:
-        if pair.are_space_adjacent:
-            space_adj.append(pair.abs_score_diff)
-        else:
-            non_space_adj.append(pair.abs_score_diff)
-    return np.mean(space_adj) - np.mean(non_space_adj)
+    with span("pair generation"):
+        space_adj, non_space_adj = room_pair_totals(zero_meaned, seats,
+                                                    lambda pair: pair.abs_score_diff, 2,
+                                                    AdjacencyType.all_ways, n_processes)
+    return space_adj.mean - non_space_adj.mean
 
-def one_way_vs_two_way_summary(grades, seats, gambler_fallacy_allowable_limit, similarity_fn):
+@timed("summary evaluation")
+def one_way_vs_two_way_summary(grades, seats, gambler_fallacy_allowable_limit, similarity_fn,
+                               n_processes=1):
     """
     Returns expectation over all emails e of:
         [similarity of e and one away from e - similarity of e and two away from e]
+    The students of each room are handled in one of N_PROCESSES worker processes.
     """
-    diffs = []
-    for email in grades.emails:
-        one_apart, two_apart = seats.similarity_layers(email, 2, AdjacencyType.sideways_only,
-                                                       grades,
-                                                       similarity_fn,
-                                                       gambler_fallacy_allowable_limit=gambler_fallacy_allowable_limit)
-        if not np.isnan(one_apart-two_apart):
-            diffs.append(one_apart - two_apart)
-    return np.mean(diffs)
+    return room_layer_differences(grades, seats, AdjacencyType.sideways_only,
+                                  gambler_fallacy_allowable_limit, similarity_fn,
+                                  n_processes).mean
 
 class PointEvaluation:
     """
     Represents a Mock Evaluation with each point being an independent item
     """
     means_need_compensation = False
-    def __init__(self, points):
+    def __init__(self, points, score=None):
         self.points = points
-        self.score = None
-        self.recalculate_grade()
+        self.score = score
+        if score is None:
+            self.recalculate_grade()
+    def __repr__(self):
+        return "PointEvaluation({!r})".format(self.points)
     def recalculate_grade(self):
         """
         Recalculate the grade as the sum of the points. Necessary if an external source messes with
@@ -162,7 +322,36 @@ class PointEvaluation:
         first, second = np.array(self.rubrics), np.array(other.rubrics)
         return sum(first * second / (np.linalg.norm(first) * np.linalg.norm(second)))
 
-class ScoreIndependentModel(Model):
+def _point_evaluations(emails, points):
+    """
+    Outputs an iterable of (email, PointEvaluation) from a matrix with a row of points per email,
+        computing every score with a single sum.
+    """
+    scores = points.sum(axis=1).tolist()
+    return zip(emails, (PointEvaluation(row, score) for row, score in zip(points.tolist(), scores)))
+
+class BatchedModel(Model):
+    """
+    A model whose points are drawn for every student, and optionally many trials, at once.
+    """
+    def __init__(self, environment):
+        super().__init__(environment)
+        self.__emails = list(environment.emails)
+    @abstractmethod
+    def _draw(self, size, rng):
+        """
+        Randomly draws an array of points of the given shape (trials, students) from RNG; points
+            are indexed along a final axis.
+        """
+        pass
+    def _get_grades(self, _, rng):
+        return _point_evaluations(self.__emails, self._draw((len(self.__emails),), rng))
+    def create_grades_batch(self, seating_chart, n_trials, rng=np.random):
+        del seating_chart
+        return [self._environment.change_grades(dict(_point_evaluations(self.__emails, trial)))
+                for trial in self._draw((n_trials, len(self.__emails)), rng)]
+
+class ScoreIndependentModel(BatchedModel):
     """
     A simple model where every point is assumed to be independent of every other point.
     """
@@ -170,9 +359,8 @@ class ScoreIndependentModel(Model):
         super().__init__(environment)
         self.__n_questions = round(environment.max_score)
         self.__p = environment.mean_score / self.__n_questions
-    def _get_grades(self, _):
-        for email in self._environment.emails:
-            yield email, PointEvaluation([random() < self.__p for _ in range(self.__n_questions)])
+    def _draw(self, size, rng):
+        return rng.random_sample(size + (self.__n_questions,)) < self.__p
     @staticmethod
     def parameters(_):
         return [()]
@@ -180,18 +368,17 @@ class ScoreIndependentModel(Model):
     def name():
         return "Score Independent Model"
 
-class QuestionIndependentModel(Model):
+class QuestionIndependentModel(BatchedModel):
     """
     A simple model where every question is assumed to be independent
     """
     def __init__(self, environment):
         super().__init__(environment)
-        self.__mean_stds = []
-        for _, question in environment:
-            self.__mean_stds.append((question.mean_score.score, question.std_score.score))
-    def _get_grades(self, _):
-        for email in self._environment.emails:
-            yield email, PointEvaluation([normal(m, s) for m, s in self.__mean_stds])
+        mean_stds = [(question.mean_score.score, question.std_score.score)
+                     for _, question in environment]
+        self.__means, self.__stds = np.array(mean_stds, dtype=float).reshape(-1, 2).T
+    def _draw(self, size, rng):
+        return rng.normal(self.__means, self.__stds, size + self.__means.shape)
     @staticmethod
     def parameters(_):
         return [()]
@@ -203,9 +390,9 @@ class RandomSeatingModel(Model):
     """
     Randomly assigns students to seats.
     """
-    def _get_grades(self, _):
+    def _get_grades(self, _, rng):
         evals = [self._environment.evaluation_for(email) for email in self._environment.emails]
-        shuffle(evals)
+        rng.shuffle(evals)
         for evalu, email in zip(evals, self._environment.emails):
             yield email, PointEvaluation(evalu.rubrics)
     @staticmethod
@@ -236,18 +423,33 @@ def binary_cheater(base_model_type, params, adjacency_type):
             self.__n_cheaters = int(round(len(environment.emails) * percent_cheaters))
             self.__ratio_cheating = ratio_cheating
             self.__base_model = base_model_type(environment, *params)
-        def _get_grades(self, seats):
-            grades = dict(self.__base_model._get_grades(seats)) # pylint: disable=W0212
-            cheaters = choice(list(grades), size=self.__n_cheaters, replace=False)
+        base_model = base_model_type
+        base_params = tuple(params)
+        adjacency = adjacency_type
+        def _get_grades(self, seats, rng):
+            grades = dict(self.__base_model._get_grades(seats, rng)) # pylint: disable=W0212
+            return self._cheat(grades, seats, rng)
+        def create_grades_from(self, seats, base_grades, rng):
+            """
+            Like create_grades, but rather than simulating the base model, makes some of the people
+                in the given base grades (a dictionary from email to PointEvaluation, which is
+                modified) cheat, drawing from the given numpy RandomState.
+            """
+            return self._environment.change_grades(dict(self._cheat(base_grades, seats, rng)))
+        def _cheat(self, grades, seats, rng):
+            """
+            Copies points from a neighbor into the grades of randomly chosen cheaters.
+            """
+            cheaters = rng.choice(list(grades), size=self.__n_cheaters, replace=False)
             for cheat in cheaters:
                 if cheat not in grades:
                     continue
                 marks = list(x for x in seats.adjacent_to(cheat, adjacency_type) if x in grades)
                 if len(marks) == 0:
                     continue
-                mark = choice(marks)
-                indices = choice(len(grades[cheat].points),
-                                 floor(self.__ratio_cheating * len(grades[cheat].points)))
+                mark = rng.choice(marks)
+                indices = rng.choice(len(grades[cheat].points),
+                                     floor(self.__ratio_cheating * len(grades[cheat].points)))
                 if len(indices) == 0:
                     continue
                 for index in indices:
@@ -268,3 +470,79 @@ def binary_cheater(base_model_type, params, adjacency_type):
         def name():
             return "Binary Cheater Model [based on %s]" % base_model_type.name()
     return BinaryCheaterModel
+
+class BaseTrialBank:
+    """
+    A bank of simulations of the base model of a binary_cheater model, which can be shared by every
+        parameter point so that only the cheating is simulated per point (common random numbers).
+
+    Trial i at every parameter point starts from the same base grades, and its cheaters are drawn
+        from a RandomState seeded by (seed, i, 1), so neighboring parameter points differ only
+        through their parameters. The base grades of trial i are simulated from a RandomState seeded
+        by (seed, i, 0), so a bank can be rebuilt exactly.
+
+    Inputs:
+        true_grades: ExamGrades
+            the actual grade distribution for the course
+        true_seats: SeatingChart
+            the actual seating chart for the course
+        model: the result of binary_cheater, whose base model is simulated
+        n_trials: the number of base simulations to store
+        seed: the seed of the base trials and the cheating perturbations
+    """
+    def __init__(self, true_grades, true_seats, model, n_trials, seed=0):
+        self.base_model = model.base_model
+        self.base_params = model.base_params
+        self.seed = seed
+        base = model.base_model(true_grades, *model.base_params)
+        self.__emails = None
+        self.__trials = []
+        with span("model simulation"):
+            for index in range(n_trials):
+                rng = np.random.RandomState([seed, index, 0])
+                emails, points = zip(*((email, evalu.points)
+                                       for email, evalu in base._get_grades(true_seats, rng))) # pylint: disable=W0212
+                if self.__emails is None:
+                    self.__emails = emails
+                elif emails != self.__emails:
+                    raise RuntimeError("The base model must simulate the same students each trial")
+                self.__trials.append(_compact(np.array(points)))
+    def __len__(self):
+        return len(self.__trials)
+    @cached_property
+    def fingerprint(self):
+        """
+        A digest of the stored base trials and the seed, which identifies this bank in the result
+            store.
+        """
+        digest = sha1(repr((self.__emails, self.seed)).encode("utf-8"))
+        for trial in self.__trials:
+            digest.update(trial.tobytes())
+        return digest.hexdigest()
+    def compatible_with(self, model):
+        """
+        Whether the given binary_cheater model has the base model this bank simulates.
+        """
+        return getattr(model, "base_model", None) is self.base_model \
+            and getattr(model, "base_params", None) == self.base_params
+    def grades(self, index):
+        """
+        A fresh copy of the base grades of the given trial, as a dictionary from email to
+            PointEvaluation.
+        """
+        return {email : PointEvaluation(points)
+                for email, points in zip(self.__emails, self.__trials[index].tolist())}
+    def random_state(self, index):
+        """
+        The RandomState used to perturb the given trial.
+        """
+        return np.random.RandomState([self.seed, index, 1])
+
+def _compact(points):
+    """
+    Stores an array of points in a single byte per point when they are all small integers, as
+        rubric items are.
+    """
+    if points.dtype != np.int8 and np.array_equal(points, points.astype(np.int8)):
+        return points.astype(np.int8)
+    return points
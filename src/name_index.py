@@ -0,0 +1,124 @@
+"""
+An index of the names on a class roster, for matching names read by OCR.
+
+Each name is broken into its bigrams, padded at both ends, and an inverted index maps each bigram to
+    the names containing it, built once from the roster. A single edit changes at most two padded
+    bigrams, so a name within distance k of a read of the same length shares all but 2k of its
+    bigrams with it. A query for every name within a given distance of a read counts the bigrams
+    each name shares with the read through the index, and only computes the edit distance of the
+    names whose length and count of shared bigrams allow them to be that close.
+"""
+from collections import Counter
+from collections.abc import Mapping
+
+import numpy as np
+
+# pads each end of a name, so that its first and last characters appear in two bigrams each
+PADDING = "\0"
+
+def edit_distance(first, second):
+    """
+    The Levenshtein distance between two strings: the number of insertions, deletions, and
+        substitutions needed to turn one into the other.
+    """
+    if len(first) < len(second):
+        first, second = second, first
+    previous = list(range(len(second) + 1))
+    for i, first_char in enumerate(first, 1):
+        current = [i]
+        for j, second_char in enumerate(second, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1,
+                               previous[j - 1] + (first_char != second_char)))
+        previous = current
+    return previous[-1]
+
+def default_distance():
+    """
+    The edit distance implemented in C by the editdistance package, or edit_distance if it is not
+        installed.
+    """
+    try:
+        # imported here, since it is slow to import and only needed for OCR
+        from editdistance import eval as c_edit_distance # pylint: disable=C0415
+    except ImportError:
+        return edit_distance
+    return c_edit_distance
+
+def bigrams(name):
+    """
+    A Counter of the bigrams of NAME padded at both ends, of which there are len(name) + 1.
+    """
+    padded = PADDING + name + PADDING
+    return Counter(padded[i:i + 2] for i in range(len(padded) - 1))
+
+class NameIndex(Mapping):
+    """
+    A dictionary from name to class, such as a roster mapping names to emails, which can also be
+        searched for the names close to a given string.
+
+    DISTANCE computes the edit distance of the names that pass the filters, by default the one
+        given by default_distance.
+    """
+    def __init__(self, people_class, distance=None):
+        self.__people_class = dict(people_class)
+        self.__distance = default_distance() if distance is None else distance
+        self.__names = list(self.__people_class)
+        self.__lengths = np.array([len(name) for name in self.__names], dtype=int)
+        postings = {}
+        for index, name in enumerate(self.__names):
+            for gram, count in bigrams(name).items():
+                postings.setdefault(gram, ([], []))
+                postings[gram][0].append(index)
+                postings[gram][1].append(count)
+        # bigram -> (indices of the names containing it, number of times each contains it)
+        self.__postings = {gram : (np.array(indices, dtype=int), np.array(counts, dtype=int))
+                           for gram, (indices, counts) in postings.items()}
+    def __getitem__(self, name):
+        return self.__people_class[name]
+    def __iter__(self):
+        return iter(self.__people_class)
+    def __len__(self):
+        return len(self.__people_class)
+    def candidates(self, read, radius):
+        """
+        The names that may be within RADIUS of READ, given their lengths and the number of bigrams
+            they share with it: a superset of the names that are.
+        """
+        shared = np.zeros(len(self.__names), dtype=int)
+        for gram, count in bigrams(read).items():
+            if gram in self.__postings:
+                indices, counts = self.__postings[gram]
+                shared[indices] += np.minimum(counts, count)
+        lengths = self.__lengths
+        possible = (np.abs(lengths - len(read)) <= radius) \
+            & (shared >= np.maximum(lengths, len(read)) + 1 - 2 * radius)
+        return [self.__names[index] for index in np.flatnonzero(possible)]
+    def within(self, read, radius):
+        """
+        Every (name, distance) for the names within RADIUS of READ, in no particular order.
+        """
+        results = []
+        for name in self.candidates(read, radius):
+            dist = self.__distance(read, name)
+            if dist <= radius:
+                results.append((name, dist))
+        return results
+    def classify(self, read, max_classify_distance=1, min_nonclassify_distance=3):
+        """
+        The class of the unique name within MAX_CLASSIFY_DISTANCE of READ, or None if there is no
+            such name or another name is within MIN_NONCLASSIFY_DISTANCE.
+        """
+        candidates = self.within(read, max(max_classify_distance, min_nonclassify_distance))
+        if len(candidates) != 1 or candidates[0][1] > max_classify_distance:
+            return None
+        return self.__people_class[candidates[0][0]]
+    def classify_all(self, reads, max_classify_distance=1, min_nonclassify_distance=3):
+        """
+        A list of the classification of each of READS, searching the index once for each distinct
+            read.
+        """
+        cache = {}
+        for read in reads:
+            if read not in cache:
+                cache[read] = self.classify(read, max_classify_distance, min_nonclassify_distance)
+        return [cache[read] for read in reads]
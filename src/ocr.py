@@ -1,44 +1,183 @@
 """
 Runs OCR on a given file.
-"""
-from os import system, listdir
 
-from PIL import Image
-from pytesseract import image_to_string
-import editdistance
+The OCR pipeline crops the name regions of each scanned exam and reads them in a bounded pool of
+    worker processes, classifying each read as soon as it arrives and appending it to a results file.
+    Exams already in the results file are skipped, so an interrupted run can be resumed. The
+    external tools (pdftoppm and Tesseract) are reached through an OcrTools, which can be replaced by
+    local functions for testing.
+"""
+import json
+import subprocess
+from collections import namedtuple
+from contextlib import closing
+from os import makedirs
+from os.path import join, normpath, relpath
+from zipfile import ZipFile
 
 from constants import DATA_DIR
+from graphics import NoProgressBar
+from name_index import NameIndex
+from parallel import parallel_imap
+
+# the page, left edge, width, and height of the regions containing names
+NAME_PAGE = 3
+NAME_X, NAME_WIDTH, NAME_HEIGHT = 170, 900, 100
+# the name of each region and its top edge
+NAME_REGIONS = (("left", 1030), ("right", 1115))
+
+def pdftoppm_crop(pdf, y_loc, output):
+    """
+    Crops the name region with the given top edge out of the given scanned exam into the PNG file
+        OUTPUT, using pdftoppm.
+    """
+    with open(output, "wb") as fil:
+        subprocess.check_call(["pdftoppm", "-png", "-f", str(NAME_PAGE), "-l", str(NAME_PAGE),
+                               "-x", str(NAME_X), "-y", str(y_loc),
+                               "-W", str(NAME_WIDTH), "-H", str(NAME_HEIGHT), pdf], stdout=fil)
 
-def classify(image, people_class, max_classify_distance=1, min_nonclassify_distance=3):
+def tesseract_read(image):
+    """
+    Reads the text in the given image file, in lower case, using Tesseract.
+    """
+    # imported here, since they are slow to import and only needed for OCR
+    from PIL import Image # pylint: disable=C0415
+    from pytesseract import image_to_string # pylint: disable=C0415
+    return image_to_string(Image.open(image)).lower()
+
+OcrTools = namedtuple("OcrTools", ["crop", "read"])
+OcrTools.__doc__ = """
+The external tools used by the OCR pipeline.
+
+crop:   (pdf path, top edge of region, output image path) -> None
+read:   image path -> text read, in lower case
+"""
+
+DEFAULT_TOOLS = OcrTools(pdftoppm_crop, tesseract_read)
+
+def classify(image, people_class, max_classify_distance=1, min_nonclassify_distance=3,
+             tools=DEFAULT_TOOLS):
     """
     Runs an OCR classifier on a given image file, drawing from a dictionary
     """
-    read = image_to_string(Image.open(image)).lower()
-    result = None
-    for person in people_class:
-        dist = editdistance.eval(person, read)
-        if dist <= max_classify_distance:
-            if result is not None:
-                return None
-            result = people_class[person]
-        elif max_classify_distance < dist <= min_nonclassify_distance:
-            return None
-    return result
-
-def setup_ocr(raw_data, progress):
-    """
-    Grabs names from a pdf to an image
-    """
-    system("unzip {} -d {}/extract".format(raw_data, DATA_DIR))
-    base = DATA_DIR + "/extract/"
-    mainfolder = base + listdir(base)[0]
-    files = sorted(listdir(mainfolder))
-    p_bar = progress(len(files))
-    for index, path in enumerate(files):
-        p_bar.update(index)
-        fullpath = mainfolder + "/" + path
-        system("mkdir {}/ocr".format(DATA_DIR))
-        basic_format = r"pdftoppm -png -f 3 -l 3 -x 170 -y %s -W 900 -H 100 {} > {}/ocr/%s{}.png" \
-            .format(fullpath, DATA_DIR, index)
-        system(basic_format % (1030, "left"))
-        system(basic_format % (1115, "right"))
+    return classify_read(tools.read(image), people_class, max_classify_distance,
+                         min_nonclassify_distance)
+
+def classify_read(read, people_class, max_classify_distance=1, min_nonclassify_distance=3):
+    """
+    Classifies text read by OCR as the value in PEOPLE_CLASS of the unique name within
+        MAX_CLASSIFY_DISTANCE of it, or None if there is no such name or another name is within
+        MIN_NONCLASSIFY_DISTANCE. PEOPLE_CLASS should be a NameIndex when classifying many reads,
+        so that it is only indexed once.
+    """
+    if not isinstance(people_class, NameIndex):
+        people_class = NameIndex(people_class)
+    return people_class.classify(read, max_classify_distance, min_nonclassify_distance)
+
+def extract_exams(raw_data, directory):
+    """
+    Extracts the zip file of scanned exams RAW_DATA into DIRECTORY, outputting the sorted list of
+        paths of the scans.
+    """
+    with ZipFile(raw_data) as zipped:
+        zipped.extractall(directory)
+        names = sorted(x for x in zipped.namelist() if x.lower().endswith(".pdf"))
+    return [join(directory, x) for x in names]
+
+def _crop_and_read(task, tools, crop_directory):
+    """
+    Crops every name region out of the scan with the given index and path, and reads it.
+
+    Output: a list of (region name, image path, text read)
+    """
+    index, pdf = task
+    results = []
+    for region, y_loc in NAME_REGIONS:
+        output = join(crop_directory, "%s%s.png" % (index, region))
+        tools.crop(pdf, y_loc, output)
+        results.append((region, output, tools.read(output)))
+    return results
+
+def completed_exams(results_path):
+    """
+    The names of the exams with a result in the given results file. The last line may be
+        incomplete if a run was interrupted while writing it, in which case it is ignored.
+    """
+    done = set()
+    try:
+        with open(results_path) as fil:
+            for line in fil:
+                try:
+                    done.add(json.loads(line)["exam"])
+                except ValueError:
+                    continue
+    except FileNotFoundError:
+        pass
+    return done
+
+def _open_results(results_path):
+    """
+    Opens the results file for appending, starting a new line if the last one was cut off.
+    """
+    cut_off = False
+    try:
+        with open(results_path, "rb") as fil:
+            if fil.seek(0, 2) > 0:
+                fil.seek(-1, 2)
+                cut_off = fil.read(1) != b"\n"
+    except FileNotFoundError:
+        pass
+    fil = open(results_path, "a")
+    if cut_off:
+        fil.write("\n")
+    return fil
+
+def run_ocr(pdfs, people_class, results_path, crop_directory, tools=DEFAULT_TOOLS, n_processes=4,
+            progress=NoProgressBar, classifier=classify_read, root=None):
+    """
+    Crops and reads the name regions of every scan in PDFS in N_PROCESSES worker processes,
+        classifies each read against PEOPLE_CLASS (indexed once, as a NameIndex) with CLASSIFIER as
+        it arrives, and appends a JSON line per scan to RESULTS_PATH with the exam name and the
+        text read and classification of each region. Scans already in the results file are
+        skipped.
+
+    The name of each exam is the path of its scan relative to ROOT, such as the directory the scans
+        were extracted into, or the path as given if ROOT is None, so scans with the same file name
+        in different folders are kept apart.
+
+    Output: the number of scans processed
+    """
+    makedirs(crop_directory, exist_ok=True)
+    people_class = NameIndex(people_class)
+    done = completed_exams(results_path)
+    def _exam(pdf):
+        return normpath(pdf) if root is None else relpath(pdf, root)
+    tasks = [(index, pdf) for index, pdf in enumerate(pdfs) if _exam(pdf) not in done]
+    p_bar = progress(len(tasks))
+    reads = parallel_imap(lambda task: _crop_and_read(task, tools, crop_directory), tasks,
+                          n_processes)
+    # closed explicitly, so that the pool is shut down even if writing a result fails
+    with _open_results(results_path) as fil, closing(reads):
+        for count, (index, regions) in enumerate(reads):
+            p_bar.update(count)
+            record = {"exam" : _exam(tasks[index][1]), "regions" : {}}
+            for region, image, read in regions:
+                record["regions"][region] = {"image" : image, "read" : read,
+                                             "class" : classifier(read, people_class)}
+            fil.write(json.dumps(record) + "\n")
+            fil.flush()
+    return len(tasks)
+
+def setup_ocr(raw_data, people_class, progress=NoProgressBar, tools=DEFAULT_TOOLS, n_processes=4):
+    """
+    Extracts the scanned exams in the zip file RAW_DATA and runs the OCR pipeline on them, cropping
+        the name regions into DATA_DIR/ocr.
+
+    Output: the path of the results file; see run_ocr
+    """
+    extracted = join(DATA_DIR, "extract")
+    pdfs = extract_exams(raw_data, extracted)
+    results_path = join(DATA_DIR, "ocr.jsonl")
+    run_ocr(pdfs, people_class, results_path, join(DATA_DIR, "ocr"), tools, n_processes, progress,
+            root=extracted)
+    return results_path
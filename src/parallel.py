@@ -0,0 +1,76 @@
+"""
+Runs a function over many tasks in a pool of worker processes that share their inputs with the parent.
+
+The function and the tasks are never pickled: they are stored in this module before the workers are
+    forked, and each worker receives only the index of the task to run. This lets tasks refer to
+    large inputs (exams, seating charts, banks of trials) and to locally defined models and
+    summaries, which could not be sent to a worker otherwise. Only the results are sent back, so
+    they must be picklable.
+"""
+from contextlib import closing
+from multiprocessing import get_context, get_all_start_methods
+
+import numpy as np
+
+from graphics import NoProgressBar
+
+_SHARED = {}
+
+def _reseed():
+    """
+    Gives each worker its own random state; otherwise every forked worker would draw the same
+        numbers as the parent.
+    """
+    np.random.seed()
+
+def _call(index):
+    function, tasks = _SHARED["work"]
+    return index, function(tasks[index])
+
+def can_fork():
+    """
+    Whether worker processes can be forked on this platform.
+    """
+    return "fork" in get_all_start_methods()
+
+def parallel_map(function, tasks, n_processes=None, progress=NoProgressBar, weight=None):
+    """
+    Computes [function(task) for task in tasks] in N_PROCESSES forked worker processes (by default,
+        one per CPU).
+
+    If WEIGHT is given, tasks are handed out in decreasing order of weight(task), so that the longest
+        tasks do not end up running alone at the end. With a single process or task, on a platform
+        that cannot fork, or when called from a task of another parallel_map (in a worker, or while
+        the parent is consuming parallel_imap), every task is run in this process.
+    """
+    tasks = list(tasks)
+    results = [None] * len(tasks)
+    p_bar = progress(len(tasks))
+    with closing(parallel_imap(function, tasks, n_processes, weight)) as finished:
+        for done, (index, result) in enumerate(finished):
+            p_bar.update(done)
+            results[index] = result
+    return results
+
+def parallel_imap(function, tasks, n_processes=None, weight=None):
+    """
+    Like parallel_map, but outputs an iterable of (index of task, function(task)) in the order the
+        tasks finish, so results can be used as soon as they are ready.
+
+    The pool is shut down when the iterable is exhausted or closed, so a consumer that may stop
+        early should close it, e.g., with contextlib.closing.
+    """
+    tasks = list(tasks)
+    order = list(range(len(tasks)))
+    if weight is not None:
+        order.sort(key=lambda index: weight(tasks[index]), reverse=True)
+    if n_processes == 1 or len(tasks) <= 1 or not can_fork() or "work" in _SHARED:
+        for index in order:
+            yield index, function(tasks[index])
+        return
+    _SHARED["work"] = function, tasks
+    try:
+        with get_context("fork").Pool(n_processes, initializer=_reseed) as pool:
+            yield from pool.imap_unordered(_call, order)
+    finally:
+        del _SHARED["work"]
@@ -8,18 +8,32 @@ from graphics import TerminalProgressBar
 from evaluations import proc_evaluations
 from seating_chart import SeatingChart, AdjacencyType
 from constants import DATA_DIR
+import instrument
 
 
-def main(arg):
+def main(arg, *options):
     """
     The profiling test
+
+    Options:
+        --spans: record the time spent in each stage, writing spans.json and spans-trace.json
+        --allocations: with --spans, also record the memory allocated in each stage
     """
+    if "--spans" in options:
+        instrument.enable(allocations="--allocations" in options)
     evals = proc_evaluations('%s/real-data/Midterm_1_evaluations.zip' % DATA_DIR)
     seats = SeatingChart('%s/real-data/mt1_seats.csv' % DATA_DIR)
     if arg == "--plausible-params":
         profile_plausible_params(evals, seats)
     else:
         raise RuntimeError("Argument %s not recognized" % arg)
+    recorder = instrument.disable()
+    if recorder is not None:
+        instrument.export_json(recorder, "spans.json")
+        instrument.export_trace(recorder, "spans-trace.json")
+        print()
+        for name, stage in sorted(recorder.summary().items(), key=lambda x: -x[1]["seconds"]):
+            print("%-25s %8d calls %10.3fs" % (name, stage["count"], stage["seconds"]))
 
 
 def profile_plausible_params(evals, seats):
@@ -31,4 +45,4 @@ def profile_plausible_params(evals, seats):
                               score_diff_summary, 1, 10, TerminalProgressBar))
 
 if __name__ == '__main__':
-    main(argv[1])
+    main(*argv[1:])
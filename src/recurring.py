@@ -0,0 +1,173 @@
+"""
+Finds pairs of students who sat next to each other on several exams of a course and were unusually
+    similar each time.
+
+Usage: recurring.py N_PERMUTATIONS [N_PAIRS]
+
+The excess similarity of two adjacent students on an exam is the correlation of their exam profiles
+    (each centered on its own mean) minus the mean correlation of all pairs of students in their
+    room. Pairs adjacent on at least MIN_EXAMS exams are ranked by their excess summed over those
+    exams, and the total over all such pairs is tested against a null in which, on every exam, the
+    profiles of the graded students of each room are shuffled among them. The seating charts, and
+    so the recurring pairs, are kept as they were. Since a shuffle keeps every profile in its room,
+    the mean correlation of each room is computed once, in closed form, and every permutation only
+    needs the similarities along the edges between recurring pairs.
+"""
+import sys
+from collections import namedtuple, OrderedDict
+
+import numpy as np
+
+from analytics import compensate_for_grader_means
+from constants import DATA_DIR
+from evaluations import proc_evaluations
+from graphics import NoProgressBar, TerminalProgressBar
+from registry import StudentRegistry, encode_pairs, decode_pairs
+from seating_chart import SeatingChart, AdjacencyType
+from statistics import PermutationReport, TailType
+
+# the largest number of floats computed at once when evaluating a batch of permutations
+BATCH_FLOATS = 4000000
+
+RecurringPair = namedtuple("RecurringPair", ["first", "second", "n_exams", "excess"])
+
+def shuffle_within_groups(groups, rng, number=1):
+    """
+    Outputs an array with a row for each of NUMBER permutations of range(len(GROUPS)), in which each
+        index is only exchanged with the indices in the same group. GROUPS is a sorted integer
+        array with the group of each index.
+    """
+    keys = groups + rng.random_sample((number, len(groups)))
+    return np.argsort(keys, axis=1)
+
+class _ExamSimilarity:
+    """
+    The unit centered exam profiles of the students of a single exam, indexed by registry id, along
+        with the mean correlation within each room.
+    """
+    def __init__(self, registry, layout):
+        emails, matrix = layout.grades.rubric_matrix
+        centered = matrix - matrix.mean(axis=1, keepdims=True)
+        norms = np.linalg.norm(centered, axis=1)
+        unit = centered / np.where(norms == 0, 1, norms)[:, np.newaxis]
+        self.unit = np.zeros((len(registry), matrix.shape[1]))
+        self.unit[registry.ids_for(emails)] = unit
+        self.graded = layout.time_index >= 0
+        self.seated = layout.seated
+        self.edges = layout.edges
+        room_of_position = np.repeat(np.arange(len(layout.rooms)), np.diff(layout.room_starts))
+        self.edge_room = room_of_position[self.edges[:, 0]]
+        # the positions in seated of the graded students, whose profiles are shuffled in each room
+        self.graded_positions = np.flatnonzero(self.graded[self.seated])
+        self.graded_rooms = room_of_position[self.graded_positions]
+        self.room_mean = np.zeros(len(layout.rooms))
+        for room, (start, end) in enumerate(zip(layout.room_starts, layout.room_starts[1:])):
+            members = self.unit[self.seated[start:end][self.graded[self.seated[start:end]]]]
+            if len(members) < 2:
+                continue
+            total = members.sum(axis=0)
+            self.room_mean[room] = (total @ total - np.sum(members * members)) \
+                / (len(members) * (len(members) - 1))
+    def edge_excess(self):
+        """
+        The encoded pair of students and the excess similarity of every edge between two graded
+            students.
+        """
+        first, second = self.seated[self.edges[:, 0]], self.seated[self.edges[:, 1]]
+        graded = self.graded[first] & self.graded[second]
+        similarity = np.sum(self.unit[first[graded]] * self.unit[second[graded]], axis=1)
+        return (encode_pairs(first[graded], second[graded]),
+                similarity - self.room_mean[self.edge_room[graded]])
+    def shuffled_excess(self, codes, rng, number):
+        """
+        The total excess similarity along the edges between the encoded pairs of students in CODES,
+            for each of NUMBER permutations of the profiles of the graded students of each room.
+        """
+        first, second = self.seated[self.edges[:, 0]], self.seated[self.edges[:, 1]]
+        chosen = self.graded[first] & self.graded[second] \
+            & np.isin(encode_pairs(first, second), codes)
+        edges, rooms = self.edges[chosen], self.edge_room[chosen]
+        # the index in graded_positions of each graded position in seated
+        slot = np.zeros(len(self.seated), dtype=int)
+        slot[self.graded_positions] = np.arange(len(self.graded_positions))
+        profiles = self.unit[self.seated[self.graded_positions]]
+        order = shuffle_within_groups(self.graded_rooms, rng, number)
+        similarity = np.einsum("pek,pek->pe", profiles[order[:, slot[edges[:, 0]]]],
+                               profiles[order[:, slot[edges[:, 1]]]])
+        return (similarity - self.room_mean[rooms]).sum(axis=1)
+
+class RecurringNeighbors:
+    """
+    Ranks and tests the pairs of students who sat adjacent to each other on at least MIN_EXAMS of
+        the exams in a StudentRegistry (counting only the exams on which both were graded).
+    """
+    def __init__(self, registry, min_exams=2):
+        self.__registry = registry
+        self.__exams = [_ExamSimilarity(registry, layout) for layout in registry.exams]
+        every_exam = [exam.edge_excess() for exam in self.__exams]
+        codes, inverse, counts = np.unique(np.concatenate([x for x, _ in every_exam]),
+                                           return_inverse=True, return_counts=True)
+        totals = np.bincount(inverse, weights=np.concatenate([x for _, x in every_exam]),
+                             minlength=len(codes))
+        recurring = counts >= min_exams
+        # the encoded recurring pairs, the number of exams on which each sat adjacent, and the
+        #   total excess similarity of each
+        self.__codes, self.__counts, self.__totals = \
+            codes[recurring], counts[recurring], totals[recurring]
+    def ranking(self):
+        """
+        A list of RecurringPair, from the highest total excess similarity to the lowest.
+        """
+        first, second = decode_pairs(self.__codes)
+        order = np.argsort(-self.__totals, kind="stable")
+        return [RecurringPair(*self.__registry.emails_for([first[i], second[i]]),
+                              int(self.__counts[i]), float(self.__totals[i]))
+                for i in order]
+    def statistic(self):
+        """
+        The total excess similarity of every recurring pair.
+        """
+        return float(sum(pair.excess for pair in self.ranking()))
+    def permutation_test(self, number, seed=None, progress=NoProgressBar):
+        """
+        Tests the statistic against NUMBER permutations in which the profiles of the graded students
+            of every room of every exam are shuffled among them, evaluated in batches. The
+            seatings, and so the recurring pairs, are those observed.
+
+        Output: a PermutationReport with a known high tail
+        """
+        rng = np.random.RandomState(seed)
+        width = sum(max(len(exam.graded_positions), len(self.__codes) * exam.unit.shape[1])
+                    for exam in self.__exams)
+        batch = max(1, BATCH_FLOATS // max(width, 1))
+        p_bar = progress(number)
+        distribution = []
+        while len(distribution) < number:
+            size = min(batch, number - len(distribution))
+            distribution += sum(exam.shuffled_excess(self.__codes, rng, size)
+                                for exam in self.__exams).tolist()
+            p_bar.update(len(distribution) - 1)
+        return PermutationReport(self.statistic(), distribution, TailType.KNOWN_HIGH)
+
+def main(argv):
+    """
+    Ranks the recurring neighbors of the exams of the semester, and tests them.
+    """
+    if len(argv) not in (1, 2):
+        raise RuntimeError("Usage: recurring.py N_PERMUTATIONS [N_PAIRS]")
+    n_pairs = int(argv[1]) if len(argv) == 2 else 20
+    exams = OrderedDict()
+    for exam in "mt1", "mt2", "final":
+        exams[exam] = (
+            compensate_for_grader_means(
+                proc_evaluations('%s/real-data/%s_evaluations.zip' % (DATA_DIR, exam))),
+            SeatingChart('%s/real-data/%s_seats.csv' % (DATA_DIR, exam)))
+    neighbors = RecurringNeighbors(StudentRegistry(exams, AdjacencyType.sideways_only))
+    report = neighbors.permutation_test(int(argv[0]), seed=0, progress=TerminalProgressBar)
+    print()
+    for pair in neighbors.ranking()[:n_pairs]:
+        print("%s  %s  %d exams  %.4f" % pair)
+    print("Total excess similarity %.4f, p = %.4f" % (neighbors.statistic(), report.p_value))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
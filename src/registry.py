@@ -0,0 +1,143 @@
+"""
+An index of the students of a whole course across several exams, for longitudinal analysis.
+
+Every email that appears on any exam is interned to an integer id once. Each exam is then described
+    by arrays aligned with those ids, and its seating chart by the ids of the seated students in seat
+    order along with the pairs of seats that are adjacent. Pairs of students are encoded as single
+    integers, so the neighbors shared by several exams are found by intersecting sorted arrays rather
+    than by joining on email strings.
+"""
+from collections import namedtuple
+
+import numpy as np
+
+from seating_chart import AdjacencyType
+
+ExamLayout = namedtuple("ExamLayout", ["name", "grades", "seats", "time_index", "room", "rooms",
+                                       "seated", "room_starts", "edges"])
+ExamLayout.__doc__ = """
+The layout of a single exam in a StudentRegistry.
+
+name:           the name of the exam
+grades, seats:  the ExamGrades and SeatingChart of the exam
+time_index:     an integer array with the time index of each student id, or -1 if they were not
+                    graded on this exam
+room:           an integer array with the index in rooms of the room of each student id, or -1 if
+                    they were not seated
+rooms:          the list of room names
+seated:         an integer array of the ids of the seated students, in seat order, room by room
+room_starts:    an integer array of the position in seated at which each room starts, followed by
+                    len(seated)
+edges:          an integer array with a row (first, second) of positions in seated, first < second,
+                    for every pair of adjacent seats
+"""
+
+def encode_pairs(first, second):
+    """
+    Encodes each unordered pair of student ids in the aligned arrays FIRST and SECOND as an integer.
+    """
+    first, second = np.asarray(first, dtype=np.int64), np.asarray(second, dtype=np.int64)
+    return (np.minimum(first, second) << 32) | np.maximum(first, second)
+
+def decode_pairs(codes):
+    """
+    The inverse of encode_pairs.
+
+    Output: (lower ids, higher ids)
+    """
+    codes = np.asarray(codes, dtype=np.int64)
+    return codes >> 32, codes & 0xFFFFFFFF
+
+class StudentRegistry:
+    """
+    Interns the emails of every student of a course, and lays out each exam in terms of their ids.
+
+    Inputs:
+        exams: an ordered dictionary from exam name to (ExamGrades, SeatingChart)
+        adjacency_type: the type of adjacency used for the edges of every exam
+    """
+    def __init__(self, exams, adjacency_type=AdjacencyType.all_ways):
+        self.adjacency_type = adjacency_type
+        emails = set()
+        for grades, seats in exams.values():
+            emails.update(grades.emails)
+            emails.update(seats.emails)
+        self.__emails = sorted(emails)
+        self.__ids = {email : index for index, email in enumerate(self.__emails)}
+        self.__exams = [self.__layout(name, grades, seats)
+                        for name, (grades, seats) in exams.items()]
+    def __len__(self):
+        return len(self.__emails)
+    def __layout(self, name, grades, seats):
+        time_index = np.full(len(self), -1, dtype=int)
+        time_index[self.ids_for(grades.student_ids)] = grades.time_indices
+        room = np.full(len(self), -1, dtype=int)
+        rooms, seated, room_starts = [], [], [0]
+        for room_name, in_room in seats.emails_by_room:
+            ids = self.ids_for(in_room)
+            room[ids] = len(rooms)
+            rooms.append(room_name)
+            seated.extend(ids.tolist())
+            room_starts.append(len(seated))
+        position = {email : index for index, email in enumerate(self.emails_for(seated))}
+        edges = set()
+        for email, index in position.items():
+            for other in seats.adjacent_to(email, self.adjacency_type):
+                if other in position and position[other] != index:
+                    edges.add((min(index, position[other]), max(index, position[other])))
+        return ExamLayout(name, grades, seats, time_index, room, rooms,
+                          np.array(seated, dtype=int), np.array(room_starts, dtype=int),
+                          np.array(sorted(edges), dtype=int).reshape(-1, 2))
+    @property
+    def exams(self):
+        """
+        The ExamLayout of every exam, in order.
+        """
+        return self.__exams
+    def exam(self, name):
+        """
+        The ExamLayout of the exam with the given name.
+        """
+        for layout in self.__exams:
+            if layout.name == name:
+                return layout
+        raise RuntimeError("No exam named %r" % name)
+    def ids_for(self, emails):
+        """
+        An integer array of the ids of the given emails.
+        """
+        return np.array([self.__ids[email] for email in emails], dtype=int)
+    def emails_for(self, ids):
+        """
+        A list of the emails with the given ids.
+        """
+        return [self.__emails[index] for index in ids]
+    @staticmethod
+    def edge_codes(layout):
+        """
+        The sorted array of the encoded pairs of students sitting in adjacent seats on the exam with
+            the given layout.
+        """
+        seated = layout.seated
+        return np.unique(encode_pairs(seated[layout.edges[:, 0]], seated[layout.edges[:, 1]]))
+    def recurring_pairs(self, min_exams=2):
+        """
+        The pairs of students who sat adjacent to each other on at least MIN_EXAMS exams.
+
+        Output: (sorted array of encoded pairs, array of the number of exams on which each sat
+            adjacent)
+        """
+        every_exam = [np.zeros(0, dtype=np.int64)]
+        every_exam += [self.edge_codes(layout) for layout in self.__exams]
+        codes, counts = np.unique(np.concatenate(every_exam), return_counts=True)
+        recurring = counts >= min_exams
+        return codes[recurring], counts[recurring]
+    def adjacency_matrix(self, codes):
+        """
+        A boolean matrix with a row per encoded pair in CODES and a column per exam, which is true
+            where the pair sat adjacent on that exam.
+        """
+        matrix = np.zeros((len(codes), len(self.__exams)), dtype=bool)
+        for column, layout in enumerate(self.__exams):
+            matrix[:, column] = np.isin(codes, self.edge_codes(layout))
+        return matrix
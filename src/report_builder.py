@@ -0,0 +1,88 @@
+"""
+Builds the figures of a report in parallel, skipping those whose inputs and code have not changed.
+
+Each figure is described by a FigureTask, which declares the function that draws it, the inputs it
+    is drawn from, and any helper functions whose code affects it. A manifest next to the figures
+    records the digest of the inputs and code each figure was last drawn from.
+"""
+import json
+from os.path import exists, join
+
+from parallel import parallel_map
+from tools import fingerprint, function_identity, pyplot
+
+MANIFEST = ".figures.json"
+
+def input_fingerprint(value):
+    """
+    A digest of an input to a figure. Exams and seating charts are identified by their fingerprints,
+        functions and classes (such as models) by their code, and containers by their contents.
+    """
+    if hasattr(value, "fingerprint") and not isinstance(value, type):
+        return value.fingerprint
+    if callable(value):
+        return fingerprint([function_identity(value)])
+    if isinstance(value, dict):
+        return fingerprint((key, input_fingerprint(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return fingerprint(input_fingerprint(item) for item in value)
+    return fingerprint([value])
+
+class FigureTask:
+    """
+    A figure drawn by calling draw(*args, path=path, **kwargs), in a new figure of the given size if
+        one is given. The figure depends on the code of draw and of every function in depends.
+    """
+    def __init__(self, path, draw, args=(), kwargs=None, figsize=None, depends=()):
+        self.path = path
+        self.draw = draw
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.figsize = figsize
+        self.depends = depends
+    def __repr__(self):
+        return "FigureTask({!r}, {})".format(self.path, self.draw.__name__)
+    def key(self):
+        """
+        A digest of everything the figure is drawn from.
+        """
+        return fingerprint([input_fingerprint(self.args), input_fingerprint(self.kwargs),
+                            self.figsize,
+                            [function_identity(x) for x in (self.draw,) + tuple(self.depends)]])
+    def render(self):
+        """
+        Draws and saves the figure with the Agg backend, closing it afterwards.
+        """
+        plt = pyplot()
+        plt.switch_backend("Agg")
+        if self.figsize is not None:
+            plt.figure(figsize=self.figsize)
+        try:
+            self.draw(*self.args, path=self.path, **self.kwargs)
+        finally:
+            plt.close("all")
+
+def _read_manifest(path):
+    try:
+        with open(path) as fil:
+            return json.load(fil)
+    except FileNotFoundError:
+        return {}
+
+def build_figures(tasks, directory, n_processes=None, force=False):
+    """
+    Renders every task whose figure is missing or whose key differs from the one recorded in the
+        manifest in DIRECTORY, in N_PROCESSES worker processes.
+
+    Output: the list of paths that were rendered
+    """
+    manifest_path = join(directory, MANIFEST)
+    manifest = _read_manifest(manifest_path)
+    keys = {task.path : task.key() for task in tasks}
+    stale = [task for task in tasks
+             if force or manifest.get(task.path) != keys[task.path] or not exists(task.path)]
+    parallel_map(lambda task: task.render(), stale, n_processes)
+    manifest.update({task.path : keys[task.path] for task in stale})
+    with open(manifest_path, "w") as fil:
+        json.dump(manifest, fil, indent=2, sort_keys=True)
+    return [task.path for task in stale]
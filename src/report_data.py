@@ -0,0 +1,178 @@
+"""
+Computes the data series behind the figures of reporting.py without importing matplotlib, so batch
+    jobs that only need the numbers can skip rendering altogether.
+
+Usage: report_data.py OUTPUT_DIRECTORY
+
+Writes the series behind every figure of the grader comparison report as JSON tables, and the
+    matched difference intervals as CSV as well.
+"""
+import csv
+import json
+import sys
+from collections import namedtuple, OrderedDict
+from math import sqrt
+from os import makedirs
+from os.path import join
+
+import numpy as np
+
+from analytics import compensate_for_grader_means
+from constants import DATA_DIR
+from evaluations import proc_evaluations
+from graded_exam import GroupedProfile
+from seating_chart import UNKNOWN, SeatingChart, AdjacencyType
+from statistics import matched_differences_bootstrap
+
+GraderSeries = namedtuple("GraderSeries", ["grader", "count", "mean_score", "ci_score",
+                                           "mean_rubric", "ci_rubric"])
+QuestionSeries = namedtuple("QuestionSeries", ["question", "maximum", "graders"])
+ProfileSeries = namedtuple("ProfileSeries", ["name", "mean", "ci"])
+IntervalSeries = namedtuple("IntervalSeries", ["exam", "correction", "mean", "ci_bot", "ci_top"])
+
+def load_all():
+    """
+    Return evaluations, seats, and zero_meaned evaluations from each of the results.
+    """
+    evals = OrderedDict()
+    seats = OrderedDict()
+    zero_meaneds = OrderedDict()
+    zero_meaned_no_correction = OrderedDict()
+    for exam in "mt1", "mt2", "final":
+        evals[exam] = proc_evaluations('%s/real-data/%s_evaluations.zip' % (DATA_DIR, exam))
+        seats[exam] = SeatingChart('%s/real-data/%s_seats.csv' % (DATA_DIR, exam))
+        zero_meaneds[exam] = compensate_for_grader_means(evals[exam])
+        zero_meaned_no_correction[exam] = compensate_for_grader_means(evals[exam],
+                                                                      z_thresh=float('inf'))
+    return evals, seats, zero_meaneds, zero_meaned_no_correction
+
+def question_series(ques, question_name, min_count=20):
+    """
+    The mean score and rubric items given by each grader of the given ExamQuestion who graded at
+        least MIN_COUNT students, along with the half widths of their 95% confidence intervals.
+    """
+    graders = []
+    for grader in sorted(ques.graders):
+        question = ques.for_grader(grader)
+        count = len(list(question.emails))
+        if count < min_count:
+            continue
+        mean, ci = question.mean_score, question.std_score * 1.96 / sqrt(count)
+        graders.append(GraderSeries(grader, count, mean.score, ci.score,
+                                    np.array(mean.rubric_items), np.array(ci.rubric_items)))
+    maximum = max([ques.score_for(x).complete_score.score for x in ques.emails])
+    return QuestionSeries(question_name, maximum, graders)
+
+def grader_series(evals, q_filter=lambda _: True, min_count=20):
+    """
+    A list of question_series for every question of the given ExamGrades accepted by Q_FILTER.
+    """
+    return [question_series(ques, question_name, min_count)
+            for question_name, ques in evals if q_filter(question_name)]
+
+def region_profiles(evals, seats):
+    """
+    The GroupedProfile of the front, middle, and back of the rooms, in that order.
+    """
+    def _region(email):
+        if email not in seats.emails:
+            return None
+        region = seats.y_region(email)
+        return None if region == UNKNOWN else region
+    grouped = evals.grouped_profile(_region)
+    order = [grouped.groups.index(x) for x in ("front", "middle", "back") if x in grouped.groups]
+    return GroupedProfile([grouped.groups[x] for x in order], grouped.means[order],
+                          grouped.stds[order], grouped.counts[order])
+
+def room_profiles(evals, seats):
+    """
+    The GroupedProfile of every room.
+    """
+    def _room(email):
+        room = seats.room_for(email)
+        return room if isinstance(room, str) else None
+    return evals.grouped_profile(_room)
+
+def profile_series(grouped):
+    """
+    The percentage of students in each group of a GroupedProfile with each rubric item, with the
+        half widths of the error bars drawn for them.
+    """
+    return [ProfileSeries(name, 100 * mean, 100 * std / sqrt(len(mean)) * 1.96)
+            for name, mean, std in zip(grouped.groups, grouped.means, grouped.stds)]
+
+def matched_difference_series(exams, seats, gamblers_fallacy_corrections, similarity_fn,
+                              bootstrap_count=10000):
+    """
+    The bootstrapped mean and one-sided 95% confidence interval of the matched similarity difference
+        between one- and two-apart students, for every exam and gambler's fallacy correction.
+    """
+    return [IntervalSeries(exam, correction, boot.mean, boot.ci_bot, boot.ci_top)
+            for (exam, correction), boot in matched_differences_bootstrap(
+                exams, seats, AdjacencyType.sideways_only, gamblers_fallacy_corrections,
+                similarity_fn, bootstrap_count)]
+
+def to_records(series):
+    """
+    Converts a list of series into a list of dictionaries of plain values, suitable for JSON.
+    """
+    def _plain(value):
+        if isinstance(value, np.ndarray):
+            return value.tolist()
+        if isinstance(value, np.generic):
+            return value.item()
+        if isinstance(value, list):
+            return to_records(value)
+        return value
+    return [{field : _plain(value) for field, value in item._asdict().items()}
+            for item in series]
+
+def write_json(path, series):
+    """
+    Writes a list of series to PATH as a JSON list of records.
+    """
+    with open(path, "w") as fil:
+        json.dump(to_records(series), fil, indent=2)
+
+def write_csv(path, series):
+    """
+    Writes a list of series of scalars to PATH as a CSV file with a header.
+    """
+    records = to_records(series)
+    with open(path, "w", newline="") as fil:
+        writer = csv.DictWriter(fil, fieldnames=list(series[0]._fields))
+        writer.writeheader()
+        writer.writerows(records)
+
+def grader_comparison_tables(evals, seats, zero_meaneds, zero_meaned_no_correction):
+    """
+    An ordered dictionary from table name to the series behind each figure of the grader comparison
+        report.
+    """
+    corrections = list(range(3))
+    return OrderedDict([
+        ("grader-comparison", grader_series(evals["mt1"], q_filter=lambda x: x == 1.3)),
+        ("room-comparison", profile_series(room_profiles(evals["mt1"], seats["mt1"]))),
+        ("region-comparison", profile_series(region_profiles(evals["mt1"], seats["mt1"]))),
+        ("matched-diff-rubric-correlation", matched_difference_series(
+            zero_meaneds, seats, corrections, lambda x, y: x.correlation(y))),
+        ("matched-diff-negative-abs-score-diff", matched_difference_series(
+            zero_meaned_no_correction, seats, corrections, lambda x, y: -abs(x.score - y.score))),
+        ("matched-diff-question-correlation", matched_difference_series(
+            zero_meaned_no_correction, seats, corrections,
+            lambda x, y: x.question_correlation(y)))])
+
+def main(argv):
+    """
+    Writes the tables of the grader comparison report into the given directory.
+    """
+    if len(argv) != 1:
+        raise RuntimeError("Usage: report_data.py OUTPUT_DIRECTORY")
+    makedirs(argv[0], exist_ok=True)
+    for name, series in grader_comparison_tables(*load_all()).items():
+        write_json(join(argv[0], name + ".json"), series)
+        if name.startswith("matched-diff"):
+            write_csv(join(argv[0], name + ".csv"), series)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
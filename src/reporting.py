@@ -1,69 +1,66 @@
 """
 A module containing a variety of methods for reporting
 """
-from math import sqrt
+import sys
 
-from collections import OrderedDict
-
-from matplotlib import pyplot as plt
 import numpy as np
 
-from analytics import compensate_for_grader_means, all_pairs
-from constants import DATA_DIR
-from evaluations import proc_evaluations
-from seating_chart import UNKNOWN, SeatingChart, AdjacencyType
+from analytics import room_pair_statistics
+from graded_exam import ExamGrades
+from instrument import span
+from seating_chart import AdjacencyType, SeatingChart
 from statistics import permutation_test, Partition, Bootstrap, matched_differences_bootstrap
 from tools import TempParams
-from tools import show_or_save
+from tools import show_or_save, pyplot
 from models import ScoreIndependentModel, QuestionIndependentModel
+from report_builder import FigureTask, build_figures
+from report_data import load_all, question_series, profile_series
+from report_data import region_profiles, room_profiles
 
-def load_all():
-    """
-    Return evaluations, seats, and zero_meaned evaluations from each of the results.
-    """
-    evals = OrderedDict()
-    seats = OrderedDict()
-    zero_meaneds = OrderedDict()
-    zero_meaned_no_correction = OrderedDict()
-    for exam in "mt1", "mt2", "final":
-        evals[exam] = proc_evaluations('%s/real-data/%s_evaluations.zip' % (DATA_DIR, exam))
-        seats[exam] = SeatingChart('%s/real-data/%s_seats.csv' % (DATA_DIR, exam))
-        zero_meaneds[exam] = compensate_for_grader_means(evals[exam])
-        zero_meaned_no_correction[exam] = compensate_for_grader_means(evals[exam],
-                                                                      z_thresh=float('inf'))
-    return evals, seats, zero_meaneds, zero_meaned_no_correction
+def grader_comparison_figures(evals, seats, zero_meaneds, zero_meaned_no_correction):
+    """
+    Describes every figure of the grader comparison report as a FigureTask.
+    """
+    def _matched_difference(exams, similarity_fn, similarity_name, path):
+        return FigureTask(path, matched_difference_graph,
+                          (exams, seats, list(range(3)), similarity_fn, similarity_name),
+                          figsize=(10, 5), depends=_DEPENDS[matched_difference_graph])
+    return [
+        FigureTask("report/img/grader-comparison.png", create_grader_report,
+                   (evals["mt1"], "Midterm 1"),
+                   dict(q_filter=lambda x: x == 1.3, highlight={5 : "blue", 8 : "red"}),
+                   depends=_DEPENDS[create_grader_report]),
+        FigureTask("report/img/room-comparison.png", by_room_chart,
+                   (evals["mt1"], seats["mt1"], "Midterm 1"), depends=_DEPENDS[by_room_chart]),
+        FigureTask("report/img/region-comparison.png", by_region_chart,
+                   (evals["mt1"], seats["mt1"], "Midterm 1"), depends=_DEPENDS[by_region_chart]),
+        _matched_difference(zero_meaneds, lambda x, y: x.correlation(y),
+                            "rubric-item-level correlation",
+                            "report/img/matched-diff-rubric-correlation.png"),
+        _matched_difference(zero_meaned_no_correction, lambda x, y: -abs(x.score - y.score),
+                            "negative absolute score difference",
+                            "report/img/matched-diff-negative-abs-score-diff.png"),
+        _matched_difference(zero_meaned_no_correction, lambda x, y: x.question_correlation(y),
+                            "question-level correlation",
+                            "report/img/matched-diff-question-correlation.png"),
+        FigureTask("report/img/independents-not-working.png", model_grades_hist,
+                   ((ScoreIndependentModel, QuestionIndependentModel), evals["mt1"], seats["mt2"]),
+                   depends=_DEPENDS[model_grades_hist])]
 
-def grader_comparison_report():
-    """
-    Generates all the images necessary for the grader comparison report.
-    """
-    evals, seats, zero_meaneds, zero_meaned_no_correction = load_all()
-    create_grader_report(evals["mt1"], "Midterm 1", q_filter=lambda x: x == 1.3,
-                         path="report/img/grader-comparison.png", highlight={5 : "blue", 8 : "red"})
-    by_room_chart(evals["mt1"], seats["mt1"], "Midterm 1", path="report/img/room-comparison.png")
-    by_region_chart(evals["mt1"], seats["mt1"], "Midterm 1",
-                    path="report/img/region-comparison.png")
-    plt.figure(figsize=(10, 5))
-    matched_difference_graph(zero_meaneds, seats, list(range(3)),
-                             lambda x, y: x.correlation(y), "rubric-item-level correlation",
-                             path="report/img/matched-diff-rubric-correlation.png")
-    plt.figure(figsize=(10, 5))
-    matched_difference_graph(zero_meaned_no_correction, seats, list(range(3)),
-                             lambda x, y: -abs(x.score - y.score),
-                             "negative absolute score difference",
-                             path="report/img/matched-diff-negative-abs-score-diff.png")
-    plt.figure(figsize=(10, 5))
-    matched_difference_graph(zero_meaned_no_correction, seats, list(range(3)),
-                             lambda x, y: x.question_correlation(y),
-                             "question-level correlation",
-                             path="report/img/matched-diff-question-correlation.png")
-    model_grades_hist((ScoreIndependentModel, QuestionIndependentModel),
-                      evals["mt1"], seats["mt2"], path="report/img/independents-not-working.png")
+def grader_comparison_report(n_processes=None, force=False):
+    """
+    Generates all the images necessary for the grader comparison report, in parallel. Images whose
+        data and plotting code have not changed since they were last generated are skipped.
+    """
+    tasks = grader_comparison_figures(*load_all())
+    for path in build_figures(tasks, "report/img", n_processes, force):
+        print("Rendered %s" % path)
 
 def model_grades_hist(models, evals, seats, path):
     """
     Show the histogram for the score-independent and actual models.
     """
+    plt = pyplot()
     colors = ["red", "blue", "green"] * len(models)
     plt.figure()
     plt.hist([evals.evaluation_for(x).score for x in evals.emails],
@@ -79,19 +76,20 @@ def model_grades_hist(models, evals, seats, path):
     show_or_save(path, lgd)
 
 def permutation_test_of_pairs(statistic, name, zero_meaned, seats, progress, adjacency_type,
-                              path=None, number=100):
+                              path=None, number=100, n_processes=None):
     """
     Runs a permutation test on the differences between means of the given statistic in the adjacent
-        and non-adjacent pairs of students
+        and non-adjacent pairs of students. The statistic is computed for the pairs of each room in
+        one of N_PROCESSES worker processes.
     """
-    non_time_adjacents = list(all_pairs(zero_meaned, seats, 2, progress,
-                                        require_same_room=True, require_not_time_adj=True,
-                                        adjacency_type=adjacency_type))
+    plt = pyplot()
+    with span("pair generation"):
+        adjacent, other = room_pair_statistics(zero_meaned, seats, statistic, 2, adjacency_type,
+                                               n_processes, progress)
     plt.figure(figsize=(8, 3))
     report = permutation_test(
-        partition=Partition.partition(non_time_adjacents, lambda x: x.are_space_adjacent),
-        summary=lambda x, y: np.mean(
-            [statistic(u) for u in x]) - np.mean([statistic(u) for u in y]),
+        partition=Partition(adjacent, other),
+        summary=lambda x, y: np.mean(x) - np.mean(y),
         progress=progress,
         number=number)
     report.report(
@@ -114,21 +112,13 @@ def create_grader_report(evals, exam_name, q_filter=lambda _: True, path=None, h
         _report_for_question(ques, _color, exam_name, question_name, path)
 
 def _report_for_question(ques, color, exam_name, question_name, path):
-    def _all_graders():
-        # pylint: disable=W0640
-        for grader in sorted(ques.graders):
-            question = ques.for_grader(grader)
-            count = len(list(question.emails))
-            if count < 20:
-                continue
-            yield question.mean_score, question.std_score * 1.96 / sqrt(count)
+    plt = pyplot()
     def _bottom_plot():
-        xvals = list(range(len(means_stds[0][0].rubric_items)))
-        for index, mean_std in enumerate(means_stds):
-            mean, std = mean_std
+        xvals = list(range(len(series.graders[0].mean_rubric)))
+        for index, grader in enumerate(series.graders):
             plt.errorbar(np.array(xvals) + 1,
-                         100 * np.array(mean.rubric_items),
-                         yerr=100 * np.array(std.rubric_items),
+                         100 * grader.mean_rubric,
+                         yerr=100 * grader.ci_rubric,
                          fmt='-', label="Grader #%s" % (index + 1),
                          color=color(index + 1))
         plt.xlim(xvals[0] + 0.5, xvals[-1] + 1.5)
@@ -139,38 +129,34 @@ def _report_for_question(ques, color, exam_name, question_name, path):
         plt.xlabel("Rubric Item Number")
         show_or_save(path, lgd)
     def _top_plot():
-        for index, mean_std in enumerate(means_stds):
-            mean, std = mean_std
-            plt.errorbar([index + 1], [mean.score], yerr=[std.score],
+        for index, grader in enumerate(series.graders):
+            plt.errorbar([index + 1], [grader.mean_score], yerr=[grader.ci_score],
                          color=color(index + 1), label="95% CI", fmt="*")
-        plt.xlim(0.5, len(means_stds) + 0.5)
+        plt.xlim(0.5, len(series.graders) + 0.5)
         plt.title("Average score by grader for Midterm 1, Problem %s" % question_name)
         plt.ylabel("Points")
         plt.xlabel("Grader #")
-        plt.ylim(0, maximum)
-    means_stds = list(_all_graders())
-    maximum = max([ques.score_for(x).complete_score.score for x in ques.emails])
+        plt.ylim(0, series.maximum)
+    series = question_series(ques, question_name)
     plt.figure(figsize=(15, 3))
     plt.subplot(121)
     _top_plot()
     plt.subplot(122)
     _bottom_plot()
 
-def draw_exam_profiles(categories, exam_name, cat_type, path):
+def draw_exam_profiles(grouped, exam_name, cat_type, path):
     """
-    Gets a chart of every room's exam profile.
+    Gets a chart of the exam profile of every group in the given GroupedProfile.
     """
+    plt = pyplot()
     with TempParams(18):
         plt.figure(figsize=(15, 5))
-        for name, for_cat in categories:
-            if not isinstance(name, str):
-                continue
-            mean = 100 * np.mean(for_cat, axis=0)
-            std = 100 * np.std(for_cat, axis=0) / sqrt(len(mean)) * 1.96
-            plt.errorbar(np.arange(len(mean)), mean, yerr=std, label=name, fmt='-')
+        for series in profile_series(grouped):
+            plt.errorbar(np.arange(len(series.mean)), series.mean, yerr=series.ci,
+                         label=series.name, fmt='-')
         lgd = plt.legend(bbox_to_anchor=(1.25, 1))
         plt.ylim(-5, 105)
-        plt.xlim(-1, len(mean))
+        plt.xlim(-1, len(series.mean))
         plt.xlabel("Rubric Item (ordered by position on the exam)")
         plt.ylabel("% Students With Rubric Item (95% CI)")
         plt.title("%s Exam Profiles By %s" % (exam_name, cat_type))
@@ -180,27 +166,13 @@ def by_region_chart(evals, seats, exam_name, path=None):
     """
     Produce an exam profile chart of each sector of the room (Front/Middle/Back).
     """
-    by_room_position = {x : [] for x in ("front", "middle", "back")}
-    for email in evals.emails:
-        if email not in seats.emails:
-            continue
-        region = seats.y_region(email)
-        if region == UNKNOWN:
-            continue
-        by_room_position[region].append(evals.exam_profile(email))
-    draw_exam_profiles(by_room_position.items(), exam_name, "Region", path)
+    draw_exam_profiles(region_profiles(evals, seats), exam_name, "Region", path)
 
 def by_room_chart(evals, seats, exam_name, path=None):
     """
     Gets a chart of every room's exam profile.
     """
-    categories = []
-    for room, for_room in evals.by_room(seats):
-        average = []
-        for email in for_room.emails:
-            average.append([x for x in for_room.exam_profile(email)])
-        categories.append((room, average))
-    draw_exam_profiles(categories, exam_name, "Room", path)
+    draw_exam_profiles(room_profiles(evals, seats), exam_name, "Room", path)
 
 def matched_difference_graph(exams, seats, gamblers_fallacy_corrections,
                              similarity_fn, similarity_name, bootstrap_count=10000,
@@ -209,6 +181,7 @@ def matched_difference_graph(exams, seats, gamblers_fallacy_corrections,
     Draws a comparison graph of matched similarity differences between different exams and gambler's
         fallacy corrections.
     """
+    plt = pyplot()
     names, matched_boots = zip(*matched_differences_bootstrap(exams, seats,
                                                               AdjacencyType.sideways_only,
                                                               gamblers_fallacy_corrections,
@@ -230,5 +203,18 @@ def matched_difference_graph(exams, seats, gamblers_fallacy_corrections,
     lgd = plt.legend()
     show_or_save(path, lgd)
 
+# the helpers whose code affects each figure
+_DEPENDS = {
+    create_grader_report : (_report_for_question, question_series, show_or_save),
+    by_room_chart : (draw_exam_profiles, room_profiles, ExamGrades.grouped_profile,
+                     profile_series, TempParams.__enter__, TempParams.__exit__, show_or_save),
+    by_region_chart : (draw_exam_profiles, region_profiles, ExamGrades.grouped_profile,
+                       profile_series, TempParams.__enter__, TempParams.__exit__, show_or_save),
+    matched_difference_graph : (matched_differences_bootstrap,
+                                SeatingChart.similarity_layers_by_limit, ExamGrades.time_masks,
+                                Bootstrap.plot_errorbars, show_or_save),
+    model_grades_hist : (show_or_save,),
+}
+
 if __name__ == '__main__':
-    grader_comparison_report()
+    grader_comparison_report(force="--force" in sys.argv[1:])
@@ -0,0 +1,110 @@
+"""
+A local store of the null distributions simulated by model_on_params, so that rerunning an analysis
+    only simulates the trials that have not been simulated before.
+
+Each run is identified by a key combining the fingerprints of the exam and seating chart, the model
+    and the code of its methods, its parameters, the summary function, the seed, the bank of base
+    trials if one was used, and any functions or values the summary depends on. The code of a
+    function does not include the functions it calls or the globals it reads, so these must be
+    declared as dependencies of the run for editing them to invalidate its trials. Trial
+    i of a run is a deterministic function of its key and i, so the store keeps every trial simulated
+    so far rather than a fixed number: a run of n trials reuses however many of the first n are
+    stored and appends the rest.
+"""
+import sqlite3
+from os import getpid
+from os.path import join
+
+from constants import DATA_DIR
+from tools import class_identity, fingerprint, function_identity
+
+DEFAULT_PATH = join(DATA_DIR, "results.sqlite3")
+
+def model_identity(model):
+    """
+    Identifies a model class by its name and the code of the methods it defines or inherits, along
+        with the base model, its parameters, and the adjacency type for a binary_cheater model.
+    """
+    base_model = getattr(model, "base_model", None)
+    return (model.name(),
+            class_identity(model),
+            None if base_model is None else model_identity(base_model),
+            getattr(model, "base_params", None),
+            str(getattr(model, "adjacency", None)))
+
+def dependency_identity(dependency):
+    """
+    Identifies a dependency of a run: a function by its code, and any other value by its repr.
+    """
+    if callable(dependency):
+        return function_identity(dependency)
+    return repr(dependency)
+
+def run_key(true_grades, true_seats, model, params, summary, seed, bank=None, depends=()):
+    """
+    The key under which the trials of the given run of model_on_params are stored. DEPENDS lists
+        the functions the summary calls and the module-level values it reads.
+    """
+    return fingerprint([true_grades.fingerprint, true_seats.fingerprint, model_identity(model),
+                        tuple(float(x) for x in params), function_identity(summary), seed,
+                        None if bank is None else bank.fingerprint,
+                        [dependency_identity(x) for x in depends]])
+
+class ResultStore:
+    """
+    An SQLite database of the summary values of every simulated trial, by run key and trial index.
+
+    A connection is opened lazily by each process that uses the store, so a store created before
+        forking worker processes can be used by all of them.
+    """
+    def __init__(self, path=DEFAULT_PATH, timeout=60):
+        self.path = path
+        self.__timeout = timeout
+        self.__connection = None
+        self.__pid = None
+    def __repr__(self):
+        return "ResultStore({!r})".format(self.path)
+    @property
+    def _connection(self):
+        if self.__connection is None or self.__pid != getpid():
+            self.__connection = sqlite3.connect(self.path, timeout=self.__timeout)
+            self.__pid = getpid()
+            with self.__connection:
+                self.__connection.execute(
+                    "CREATE TABLE IF NOT EXISTS runs (key TEXT PRIMARY KEY, description TEXT)")
+                self.__connection.execute(
+                    "CREATE TABLE IF NOT EXISTS trials (key TEXT, trial INTEGER, value REAL, "
+                    "PRIMARY KEY (key, trial))")
+        return self.__connection
+    def values(self, key):
+        """
+        Every stored summary value for the given run, in order of trial. NaN values are stored as
+            NULL, and are converted back.
+        """
+        rows = self._connection.execute(
+            "SELECT value FROM trials WHERE key = ? ORDER BY trial", (key,))
+        return [float('nan') if value is None else value for value, in rows]
+    def extend(self, key, start, values, description=None):
+        """
+        Stores the given summary values as trials START, START + 1, ... of the given run. Trials
+            that are already stored (e.g., by another process) are left as they are.
+        """
+        with self._connection as connection:
+            connection.execute("INSERT OR IGNORE INTO runs VALUES (?, ?)", (key, description))
+            connection.executemany("INSERT OR IGNORE INTO trials VALUES (?, ?, ?)",
+                                   [(key, start + index, float(value))
+                                    for index, value in enumerate(values)])
+    def runs(self):
+        """
+        Outputs an iterable of (key, description, number of stored trials) for every run.
+        """
+        return self._connection.execute(
+            "SELECT runs.key, description, COUNT(trial) FROM runs "
+            "LEFT JOIN trials ON runs.key = trials.key GROUP BY runs.key")
+    def close(self):
+        """
+        Closes this process's connection, if it has one.
+        """
+        if self.__connection is not None and self.__pid == getpid():
+            self.__connection.close()
+        self.__connection = None
@@ -2,13 +2,20 @@
 A script to be run.
 """
 import sys
-from multiprocessing import Pool
+from functools import partial
+from multiprocessing import Manager
 
 from statistics import TailType
+from graphics import TerminalProgressBar, QueueProgressBar, ProgressMonitor
 
 from models import model_on_params, binary_cheater, one_way_vs_two_way_summary, RandomSeatingModel
+from models import BaseTrialBank, PointEvaluation
+from analytics import room_layer_differences
+from parallel import parallel_map
+from result_store import ResultStore
 
 from evaluations import proc_evaluations
+from graded_exam import ExamGrades
 from seating_chart import AdjacencyType, SeatingChart
 from constants import DATA_DIR
 
@@ -16,45 +23,70 @@ def usage():
     """
     Print out a usage statement
     """
-    raise RuntimeError("Usage: script.py GRANULARITY N_TRIALS N_THREADS")
+    raise RuntimeError("Usage: script.py GRANULARITY N_TRIALS N_THREADS [--common-random-numbers]")
 
-if len(sys.argv) != 4:
-    usage()
-
-try:
-    GRANULARITY = int(sys.argv[1])
-    N_TRIALS = int(sys.argv[2])
-    N_THREADS = int(sys.argv[3])
-except ValueError:
-    usage()
-
-def one_way_vs_two_way_summary_correlation(grades, seats):
+def one_way_vs_two_way_summary_correlation(grades, seats, n_processes=1):
     """
     Produces differences in the correlations between one-apart and two-apart individuals.
     """
     return one_way_vs_two_way_summary(grades, seats,
                                       gambler_fallacy_allowable_limit=GAMBLER_FALLACY_ALLOWABLE_LIMIT,
-                                      similarity_fn=lambda x, y: x.correlation(y))
+                                      similarity_fn=lambda x, y: x.correlation(y),
+                                      n_processes=n_processes)
 
 GAMBLER_FALLACY_ALLOWABLE_LIMIT = 1
 
-EVALS = proc_evaluations('%s/real-data/mt1_evaluations.zip' % DATA_DIR)
-SEATS = SeatingChart('%s/real-data/mt1_seats.csv' % DATA_DIR)
-
-MODEL = binary_cheater(RandomSeatingModel, (), AdjacencyType.sideways_only)
-
-TRUE_VALUE = one_way_vs_two_way_summary_correlation(EVALS, SEATS)
+# everything one_way_vs_two_way_summary_correlation calls or reads, which identifies its stored trials
+SUMMARY_DEPENDS = (one_way_vs_two_way_summary, room_layer_differences,
+                   SeatingChart.similarity_layers, SeatingChart.similarity_layers_by_limit,
+                   ExamGrades.time_masks, PointEvaluation.correlation,
+                   GAMBLER_FALLACY_ALLOWABLE_LIMIT)
 
-PARAMS = list((cheaters, ratio) for cheaters, ratio in MODEL.parameters(GRANULARITY) if cheaters < 0.3)
+SEED = 0
 
-def proc_param(param):
+def main(argv):
     """
-    Process the given parameter
+    Runs the binary cheater model on every parameter, writing the results to the log file.
     """
-    result = model_on_params(EVALS, SEATS, TRUE_VALUE, MODEL, param, one_way_vs_two_way_summary_correlation, N_TRIALS, tail_type=TailType.KNOWN_HIGH)
-    print(result)
-    sys.stdout.flush()
+    if len(argv) not in (3, 4) or argv[3:] not in ([], ["--common-random-numbers"]):
+        usage()
+    try:
+        granularity, n_trials, n_threads = (int(x) for x in argv[:3])
+    except ValueError:
+        usage()
+
+    evals = proc_evaluations('%s/real-data/mt1_evaluations.zip' % DATA_DIR)
+    seats = SeatingChart('%s/real-data/mt1_seats.csv' % DATA_DIR)
+
+    model = binary_cheater(RandomSeatingModel, (), AdjacencyType.sideways_only)
+
+    true_value = one_way_vs_two_way_summary_correlation(evals, seats, n_processes=n_threads)
+
+    params = list((cheaters, ratio) for cheaters, ratio in model.parameters(granularity) if cheaters < 0.3)
+
+    # shared with the workers, which are forked after it is built
+    bank = BaseTrialBank(evals, seats, model, n_trials) if len(argv) == 4 else None
+
+    # trials already simulated by an earlier run with the same data are read from here
+    store = ResultStore()
+
+    progress_queue = Manager().Queue()
+
+    def proc_param(param):
+        """
+        Process the given parameter
+        """
+        result = model_on_params(evals, seats, true_value, model, param, one_way_vs_two_way_summary_correlation, n_trials, tail_type=TailType.KNOWN_HIGH,
+                                 progress=partial(QueueProgressBar, queue=progress_queue), bank=bank,
+                                 store=store, seed=SEED, depends=SUMMARY_DEPENDS)
+        print(result)
+        sys.stdout.flush()
+
+    sys.stdout = open("log", "w")
 
-sys.stdout = open("log", "w")
+    with ProgressMonitor(progress_queue, len(params) * n_trials,
+                         partial(TerminalProgressBar, stream=sys.stderr)):
+        parallel_map(proc_param, params, n_threads)
 
-Pool(N_THREADS).map(proc_param, PARAMS)
+if __name__ == '__main__':
+    main(sys.argv[1:])
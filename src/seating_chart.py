@@ -6,21 +6,25 @@ import re
 import csv
 
 from functools import total_ordering
-from itertools import groupby
 from collections import defaultdict
 
 from abc import ABCMeta, abstractmethod
 from enum import Enum
 
+import numpy as np
 from numpy import argmin, mean
 
+from instrument import timed
+from tools import cached_property, fingerprint
+
 class SeatingChart:
     """
     Represents a graph of student seating locations.
     """
-    def __init__(self, file_loc):
+    @timed("chart compilation")
+    def __init__(self, file_loc, seat_parser=None):
         self.__file_loc = file_loc
-        self.__seating_chart = _get_seating_chart(file_loc)
+        self.__seating_chart = _get_seating_chart(file_loc, seat_parser or SEAT_PARSER)
         self.__adjacency = _get_direction_dictionary(self.__seating_chart)
         self.__by_room = {}
         for email in self.emails:
@@ -74,16 +78,31 @@ class SeatingChart:
         Gets all layers from 0..up_to-1 of numbers. The ith element contains the average similarity
             between email and all the values with i students between them.
         """
+        for layer in self.similarity_layers_by_limit(email, up_to, adjacency_type, evals,
+                                                     similarity_fn,
+                                                     [gambler_fallacy_allowable_limit]):
+            yield layer[0]
+
+    def similarity_layers_by_limit(self, email, up_to, adjacency_type, evals, similarity_fn,
+                                   gambler_fallacy_allowable_limits):
+        """
+        Like similarity_layers, but for several gambler's fallacy allowable limits in one pass. The
+            similarity to each neighbor is computed once, and the time adjacency of the whole layer
+            is checked against every limit at once.
+
+        Output: an iterable of layers, each a list with the average similarity for each limit
+        """
+        own_id = evals.ids_for([email])
         for layer in self.adjacency_layers(email, up_to, adjacency_type):
-            values = [similarity_fn(evals.evaluation_for(email),
-                                    evals.evaluation_for(other_email))
-                      for other_email in layer
-                      if other_email in evals.emails
-                      and evals.time_diff(email, other_email) <= gambler_fallacy_allowable_limit]
-            if values == []:
-                yield float('nan')
-            else:
-                yield mean(values)
+            others = [other_email for other_email in layer if other_email in evals.emails]
+            masks = evals.time_masks(np.repeat(own_id, len(others)), evals.ids_for(others),
+                                     gambler_fallacy_allowable_limits)
+            needed = masks.any(axis=0)
+            values = np.array([similarity_fn(evals.evaluation_for(email),
+                                             evals.evaluation_for(other_email))
+                               if is_needed else float('nan')
+                               for other_email, is_needed in zip(others, needed)])
+            yield [mean(values[mask]) if mask.any() else float('nan') for mask in masks]
 
     def all_adjacencies(self, zero_meaned, up_to, adjacency_type, gambler_fallacy_allowable_limit):
         """
@@ -94,13 +113,15 @@ class SeatingChart:
         for email in zero_meaned.emails:
             layers = self.adjacency_layers(email, up_to, adjacency_type)
             evalu = zero_meaned.evaluation_for(email)
+            own_id = zero_meaned.ids_for([email])
             for adj, layer in zip(adjacencies, layers):
-                for other_email in layer:
-                    if other_email not in zero_meaned.emails:
-                        continue
-                    if zero_meaned.time_diff(email, other_email) <= gambler_fallacy_allowable_limit:
-                        continue
-                    adj.append((evalu, zero_meaned.evaluation_for(other_email)))
+                others = [other_email for other_email in layer if other_email in zero_meaned.emails]
+                (time_adjacent,) = zero_meaned.time_masks(
+                    np.repeat(own_id, len(others)), zero_meaned.ids_for(others),
+                    [gambler_fallacy_allowable_limit])
+                adj.extend((evalu, zero_meaned.evaluation_for(other_email))
+                           for other_email, is_time_adjacent in zip(others, time_adjacent)
+                           if not is_time_adjacent)
         return adjacencies
 
     def are_adjacent(self, first, second, adjacency_type):
@@ -146,6 +167,12 @@ class SeatingChart:
         if loc is None:
             return None
         return loc.room
+    @cached_property
+    def fingerprint(self):
+        """
+        A digest of every student's location, which identifies this chart in the result store.
+        """
+        return fingerprint((email, self._location(email)) for email in sorted(self.emails))
     def y_region(self, email):
         """
         Get the y region (top, middle, bottom) of the given email.
@@ -172,6 +199,12 @@ class Column:
         self.val = val
         self.cmin = cmin
         self.cmax = cmax
+        # a rational in [0, 1] representing an abstract concept of horizontal location (percentage
+        #   left to right)
+        if cmax == cmin:
+            self.location = 0.5
+        else:
+            self.location = (val - cmin) / (cmax - cmin)
     def __repr__(self):
         return "Column(val={}, cmin={}, cmax={})".format(self.val, self.cmin, self.cmax)
     def relation(self, other):
@@ -199,15 +232,6 @@ class Column:
         The number of possible seats total
         """
         return self.cmax - self.cmin
-    @property
-    def location(self):
-        """
-        A rational in [0, 1] representing an abstract concept of horizontal location (percentage
-            left to right)
-        """
-        if self.cmax == self.cmin:
-            return 0.5
-        return (self.val - self.cmin) / (self.cmax - self.cmin)
 
 class Direction(Enum):
     """
@@ -256,11 +280,23 @@ class ColumnRelation(Enum):
 class Row:
     """
     Represents a bounded row.
+
+    The y region (front, middle, or back of the room) is computed once; a room with a single row is
+        considered to be entirely in the middle.
     """
     def __init__(self, val, rmin, rmax):
         self.__val = val
         self.__rmin = rmin
         self.__rmax = rmax
+        y_loc = 0.5 if rmax == rmin else (val - rmin) / (rmax - rmin)
+        if y_loc < 1 / 3:
+            self.y_region = "front"
+        elif y_loc < 2 / 3:
+            self.y_region = "middle"
+        else:
+            self.y_region = "back"
+    def __repr__(self):
+        return "Row(val={}, rmin={}, rmax={})".format(self.__val, self.__rmin, self.__rmax)
     def __lt__(self, other):
         # pylint: disable=W0212
         return self.__val < other.__val
@@ -274,20 +310,6 @@ class Row:
         Move the given row in that direction, returning the new value.
         """
         return Row(self.__val + y_off, self.__rmin, self.__rmax)
-    @property
-    def __y_loc(self):
-        return (self.__val - self.__rmin) / (self.__rmax - self.__rmin)
-    @property
-    def y_region(self):
-        """
-        Returns whether we're in the front, middle, or back of the room.
-        """
-        if self.__y_loc < 1 / 3:
-            return "front"
-        elif self.__y_loc < 2 / 3:
-            return "middle"
-        else:
-            return "back"
 
 class AbstractLocation(metaclass=ABCMeta):
     """
@@ -336,25 +358,19 @@ class Location(AbstractLocation):
         self.__room = room
         self.__row = row
         self.__column = column
+        self.__row_identifier = room, row
     @staticmethod
-    def create_location(room, seat):
-        """
-        Parses a seat number
-        """
-        match = re.search(r"([A-Za-z])([0-9]+)", seat)
-        if match:
-            return Location(room, row=ord(match.group(1)) - ord('A'), column=int(match.group(2)))
-        match = re.search(r"Row (\d+), Table ([A-Z]+), Seat ([i]+)", seat)
-        if match:
-            roman = {"i" : 1, "ii" : 2, "iii" : 3, "iv" : 4}[match.group(3)]
-            return Location(room, int(match.group(1)), (ord(match.group(2)) - ord('A'), roman))
-        match = re.search(r"N/A|FALSE", seat)
-        if match:
+    def create_location(room, seat, seat_parser=None):
+        """
+        Parses a seat number, using the given SeatParser or SEAT_PARSER if none is provided.
+        """
+        parsed = (seat_parser or SEAT_PARSER).parse(room, seat)
+        if parsed is UNKNOWN:
             return UNKNOWN
-        match = re.search(r"(Front|Desk).*", seat)
-        if match:
-            return UNKNOWN # TODO handle these better
-        raise RuntimeError(seat)
+        row, table, column = parsed
+        if table == NO_TABLE:
+            return Location(room, row, column)
+        return Location(room, row, (table, column))
     def __repr__(self):
         return "Location(room={!r}, row={!r}, column={!r})".format(self.room, self.row, self.column)
     def __lt__(self, other):
@@ -364,6 +380,9 @@ class Location(AbstractLocation):
     def __eq__(self, other):
         return not self < other and not other < self
     @property
+    def row_identifier(self):
+        return self.__row_identifier
+    @property
     def room(self):
         return self.__room
     @property
@@ -407,52 +426,193 @@ class UnknownLocation(AbstractLocation):
         return False
 UNKNOWN = UnknownLocation()
 
-def __read_seating_chart(seat_file):
+NO_TABLE = -1
+"""
+The table number given to seats in formats which do not have tables.
+"""
+
+class SeatFormat:
     """
-    Reads a seating chart from a file
+    A way of writing seat labels, recognized by a precompiled regular expression.
+
+    convert takes the match and returns a tuple (row, table, column) of integers, with table being
+        NO_TABLE if the format has no tables, or UNKNOWN if the label does not describe a seat.
     """
-    with open(seat_file) as fil:
-        data = list(csv.reader(fil))
-    email_loc = data[0].index("Email Address")
-    seat_loc = data[0].index("Seat")
-    room_loc = data[0].index("Room")
-    return [(x[email_loc], Location.create_location(x[room_loc], x[seat_loc])) for x in data[1:]]
-
-def __normalize_columns_in_chart(seating_chart):
-    """
-    Converts tuple columns into single numbers. Sets up minima and maxima for each column and places
-        everything into Column objects.
-    """
-    yield from [x for x in seating_chart if isinstance(x[1], UnknownLocation)]
-    knowns = [x for x in seating_chart if not isinstance(x[1], UnknownLocation)]
-    knowns.sort(key=lambda x: x[1])
-    def _normal_rows(sorted_by_room):
-        for _, grouped_items in groupby(sorted_by_room, key=lambda x: x[1].room):
-            grouped_items = list(grouped_items)
-            minimum = min([x[1].row for x in grouped_items])
-            maximum = max([x[1].row for x in grouped_items])
-            for email, loc in grouped_items:
-                yield email, Location(loc.room, Row(loc.row, minimum, maximum), loc.column)
-    for _, grouped_items in groupby(_normal_rows(knowns), key=lambda x: x[1].row_identifier):
-        grouped_items = list(grouped_items)
-        raw_col = [x[1].column for x in grouped_items]
-        if isinstance(raw_col[0], tuple):
-            number_per_table = max([v for _, v in raw_col])
-            columns = [number_per_table * u + v for u, v in raw_col]
+    def __init__(self, name, pattern, convert):
+        self.name = name
+        self.__regex = re.compile(pattern)
+        self.__convert = convert
+    def __repr__(self):
+        return "SeatFormat({!r})".format(self.name)
+    def parse(self, seat):
+        """
+        Parses the given seat label, returning None if it is not in this format.
+        """
+        match = self.__regex.search(seat)
+        if match is None:
+            return None
+        return self.__convert(match)
+
+ROMAN_SEATS = {"i" : 1, "ii" : 2, "iii" : 3, "iv" : 4}
+
+DEFAULT_SEAT_FORMATS = (
+    SeatFormat("letter-number", r"([A-Za-z])([0-9]+)",
+               lambda match: (ord(match.group(1)) - ord('A'), NO_TABLE, int(match.group(2)))),
+    SeatFormat("row-table-seat", r"Row (\d+), Table ([A-Z]+), Seat ([i]+)",
+               lambda match: (int(match.group(1)),
+                              ord(match.group(2)) - ord('A'),
+                              ROMAN_SEATS[match.group(3)])),
+    SeatFormat("not-applicable", r"N/A|FALSE", lambda _: UNKNOWN),
+    SeatFormat("front-or-desk", r"(Front|Desk).*", lambda _: UNKNOWN), # TODO handle these better
+)
+
+class SeatParser:
+    """
+    Parses seat labels by trying a sequence of SeatFormats in order. Formats registered for a room
+        are tried before the default ones when parsing seats in that room.
+    """
+    def __init__(self, default_formats=DEFAULT_SEAT_FORMATS):
+        self.__defaults = list(default_formats)
+        self.__per_room = defaultdict(list)
+        self.__formats_for = {}
+    def register(self, seat_format, room=None):
+        """
+        Registers a new format, to be tried first in the given room, or in every room if room is None.
+        """
+        if room is None:
+            self.__defaults.insert(0, seat_format)
         else:
-            columns = raw_col
-        min_of_current = min(columns)
-        max_of_current = max(columns)
-        for email_loc, adjusted_col in zip(grouped_items, columns):
-            email, loc = email_loc
-            bounded_col = Column(adjusted_col, min_of_current, max_of_current)
-            yield email, Location(loc.room, loc.row, bounded_col)
+            self.__per_room[room].insert(0, seat_format)
+        self.__formats_for = {}
+    def formats_for(self, room):
+        """
+        The list of formats to try, in order, for seats in the given room.
+        """
+        if room not in self.__formats_for:
+            self.__formats_for[room] = self.__per_room.get(room, []) + self.__defaults
+        return self.__formats_for[room]
+    def parse(self, room, seat):
+        """
+        Parses the given seat label into (row, table, column) or UNKNOWN.
+        """
+        for seat_format in self.formats_for(room):
+            parsed = seat_format.parse(seat)
+            if parsed is not None:
+                return parsed
+        raise RuntimeError(seat)
+
+SEAT_PARSER = SeatParser()
+"""
+The SeatParser used by default. New room layouts can be added with SEAT_PARSER.register.
+"""
+
+class ChartColumns:
+    """
+    A parsed seating chart, as a list of emails and aligned integer arrays.
+
+    rooms is the list of room names, indexed by room_codes. Seats for which known is False have an
+        UNKNOWN location and meaningless row, table, and column values.
+    """
+    def __init__(self, emails, rooms, room_codes, rows, tables, columns, known):
+        self.emails = emails
+        self.rooms = rooms
+        self.room_codes = room_codes
+        self.rows = rows
+        self.tables = tables
+        self.columns = columns
+        self.known = known
+    def __len__(self):
+        return len(self.emails)
+
+def _read_seating_chart(seat_file, seat_parser):
+    """
+    Reads a seating chart from a file into a ChartColumns, one line at a time.
+    """
+    emails, rooms, room_codes, rows, tables, columns, known = [], [], [], [], [], [], []
+    code_per_room = {}
+    with open(seat_file) as fil:
+        reader = csv.reader(fil)
+        header = next(reader)
+        email_loc = header.index("Email Address")
+        seat_loc = header.index("Seat")
+        room_loc = header.index("Room")
+        for line in reader:
+            room = line[room_loc]
+            parsed = seat_parser.parse(room, line[seat_loc])
+            if room not in code_per_room:
+                code_per_room[room] = len(rooms)
+                rooms.append(room)
+            emails.append(line[email_loc])
+            room_codes.append(code_per_room[room])
+            if parsed is UNKNOWN:
+                parsed = NO_TABLE, NO_TABLE, NO_TABLE
+                known.append(False)
+            else:
+                known.append(True)
+            rows.append(parsed[0])
+            tables.append(parsed[1])
+            columns.append(parsed[2])
+    return ChartColumns(emails, rooms, np.array(room_codes, dtype=int), np.array(rows, dtype=int),
+                        np.array(tables, dtype=int), np.array(columns, dtype=int),
+                        np.array(known, dtype=bool))
+
+def _group_starts(*keys):
+    """
+    Given sorted arrays of keys, returns the index at which each run of equal keys starts.
+    """
+    if len(keys[0]) == 0:
+        return np.zeros(0, dtype=int)
+    changes = np.zeros(len(keys[0]), dtype=bool)
+    changes[0] = True
+    for key in keys:
+        changes[1:] |= key[1:] != key[:-1]
+    return np.flatnonzero(changes)
+
+def _grouped_bounds(values, starts):
+    """
+    Returns arrays aligned with VALUES of the minimum and maximum value over each group, where the
+        groups are contiguous and begin at STARTS.
+    """
+    sizes = np.diff(np.append(starts, len(values)))
+    minima = np.repeat(np.minimum.reduceat(values, starts), sizes)
+    maxima = np.repeat(np.maximum.reduceat(values, starts), sizes)
+    return minima, maxima
+
+def __normalize_columns_in_chart(columns):
+    """
+    Converts table and seat columns into single numbers and places every seat into Row and Column
+        objects bounded by the minimum and maximum row of its room and column of its row.
+
+    Outputs an iterable of (email, location) with the unknown locations first, followed by the known
+        locations sorted by room, row, and column.
+    """
+    for index in np.flatnonzero(~columns.known):
+        yield columns.emails[index], UNKNOWN
+    known = np.flatnonzero(columns.known)
+    room_rank = np.argsort(np.argsort(columns.rooms, kind='mergesort'), kind='mergesort')
+    rooms = room_rank[columns.room_codes[known]]
+    order = known[np.lexsort((columns.columns[known], columns.tables[known],
+                              columns.rows[known], rooms))]
+    rooms = room_rank[columns.room_codes[order]]
+    rows, tables, seats = columns.rows[order], columns.tables[order], columns.columns[order]
+    if len(order) == 0:
+        return
+    rmin, rmax = _grouped_bounds(rows, _group_starts(rooms))
+    row_starts = _group_starts(rooms, rows)
+    _, number_per_table = _grouped_bounds(seats, row_starts)
+    adjusted = np.where(tables == NO_TABLE, seats, number_per_table * tables + seats)
+    cmin, cmax = _grouped_bounds(adjusted, row_starts)
+    for position, index in enumerate(order.tolist()):
+        room = columns.rooms[columns.room_codes[index]]
+        row = Row(int(rows[position]), int(rmin[position]), int(rmax[position]))
+        column = Column(int(adjusted[position]), int(cmin[position]), int(cmax[position]))
+        yield columns.emails[index], Location(room, row, column)
 
-def _get_seating_chart(seat_file):
+def _get_seating_chart(seat_file, seat_parser):
     """
     Performs process of getting a seating chart from a file and normalizing the columns.
     """
-    return dict(__normalize_columns_in_chart(__read_seating_chart(seat_file)))
+    return dict(__normalize_columns_in_chart(_read_seating_chart(seat_file, seat_parser)))
 
 def _get_direction_dictionary(chart):
     """
@@ -460,8 +620,9 @@ def _get_direction_dictionary(chart):
 
     Returns a lookup table dictionary EMAIL -> DIRECTION -> EMAIL of the person in that direction.
     """
-    ident = lambda c: c[1].row_identifier
-    by_row = {x : tuple(y) for x, y in groupby(sorted(chart.items(), key=ident), key=ident)}
+    by_row = defaultdict(list)
+    for email, location in chart.items():
+        by_row[location.row_identifier].append((email, location))
     direct = defaultdict(lambda: defaultdict(lambda: UNKNOWN))
     for email in chart:
         location = chart[email]
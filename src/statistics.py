@@ -5,10 +5,10 @@ A module containing a variety of methods for statistical analyses.
 from random import shuffle
 from enum import Enum
 
-from matplotlib import pyplot as plt
 import numpy as np
 from numpy.random import choice
-from tools import show_or_save
+from instrument import timed
+from tools import show_or_save, pyplot
 
 class TailType(Enum):
     """
@@ -38,6 +38,57 @@ class TailType(Enum):
             TailType.KNOWN_HIGH : greater / total,
             TailType.KNOWN_LOW : smaller / total
         }[self]
+    def p_value_bounds(self, greater, smaller, total, z_score):
+        """
+        Gets a confidence interval (low, high) on the p-value that infinitely many samples would
+            give, from the Wilson score interval of the fraction of samples in the tail.
+
+        Input:
+            greater, smaller, total, as in p_value
+            z_score, the width of the interval in standard errors
+        """
+        tail, factor = {
+            TailType.UNKNOWN : (min(greater, smaller), 2),
+            TailType.KNOWN_HIGH : (greater, 1),
+            TailType.KNOWN_LOW : (smaller, 1)
+        }[self]
+        fraction = tail / total
+        denominator = 1 + z_score ** 2 / total
+        center = (fraction + z_score ** 2 / (2 * total)) / denominator
+        half_width = z_score * np.sqrt(fraction * (1 - fraction) / total
+                                       + z_score ** 2 / (4 * total ** 2)) / denominator
+        return min(1, factor * (center - half_width)), min(1, factor * (center + half_width))
+
+class SequentialTest:
+    """
+    A stopping rule for Monte Carlo p-values, in the spirit of Besag and Clifford's sequential Monte
+        Carlo tests: trials are drawn in batches, and drawing stops as soon as a confidence interval
+        on the p-value lies entirely above or entirely below the significance level. Parameter
+        points that are clearly plausible or clearly implausible are thus decided after a batch or
+        two, leaving the trials for the borderline ones.
+
+    Inputs:
+        alpha:      the significance level
+        batch_size: the number of trials between checks
+        z_score:    the width of the confidence interval in standard errors
+    """
+    def __init__(self, alpha=0.05, batch_size=100, z_score=3):
+        self.alpha = alpha
+        self.batch_size = batch_size
+        self.z_score = z_score
+    def should_stop(self, value, distribution, tail_type):
+        """
+        Whether the p-value of VALUE against the DISTRIBUTION drawn so far is decidedly above or
+            below alpha. Only checked once every batch_size trials.
+        """
+        total = len(distribution)
+        if total == 0 or total % self.batch_size != 0:
+            return False
+        distribution = np.array(distribution)
+        greater = np.count_nonzero(distribution >= value)
+        smaller = np.count_nonzero(distribution <= value)
+        low, high = tail_type.p_value_bounds(greater, smaller, total, self.z_score)
+        return high < self.alpha or low > self.alpha
 
 def permutation_test(partition, summary, number, progress, tail_type=TailType.UNKNOWN):
     """
@@ -49,6 +100,7 @@ def permutation_test(partition, summary, number, progress, tail_type=TailType.UN
                     for a, b in _permute(partition.group_a, partition.group_b, number, progress)]
     return PermutationReport(value, distribution, tail_type)
 
+@timed("p-value computation")
 def p_value(value, distribution, tail_type):
     """
     Returns a p value of a given value against a given distribution. I.e., returns 2 times the
@@ -73,6 +125,7 @@ class PermutationReport:
         """
         if all(np.isnan(self.__distr)): # pylint: disable=E1101
             return
+        plt = pyplot()
         plt.hist(self.__distr, label="Permutation Distribution", color="green")
         plt.axvline(self.__val, label="Actual Sample", color="red")
         if title is not None:
@@ -90,6 +143,12 @@ class PermutationReport:
         Get the p-value for the difference in distributions.
         """
         return p_value(self.__val, self.__distr, self.__tail_type)
+    @property
+    def n_trials(self):
+        """
+        The number of trials actually used to build the distribution.
+        """
+        return len(self.__distr)
     def __repr__(self):
         return "PermutationReport({}, {}, {})".format(self.__val, self.__distr, self.__tail_type)
 
@@ -148,6 +207,7 @@ class Bootstrap:
         """
         self._plot_ci(self.distribution)
     def _plot_ci(self, dataset):
+        plt = pyplot()
         plt.hist(dataset)
         plt.axvspan(self.ci_bot, self.ci_top, alpha=0.5, color="green")
     @staticmethod
@@ -165,10 +225,10 @@ class Bootstrap:
         """
         if xvals is None:
             xvals = np.arange(len(bootstraps))
-        plt.errorbar(xvals, [x.mean for x in bootstraps],
-                     yerr=[[x.mean-x.ci_bot for x in bootstraps],
-                           [x.ci_top - x.mean for x in bootstraps]],
-                     **kwargs)
+        pyplot().errorbar(xvals, [x.mean for x in bootstraps],
+                          yerr=[[x.mean-x.ci_bot for x in bootstraps],
+                                [x.ci_top - x.mean for x in bootstraps]],
+                          **kwargs)
 
 def matched_differences_bootstrap(exams, seating_charts, adjacency_type,
                                   gambler_limits, similarity_fn, bootstrap_count):
@@ -184,18 +244,20 @@ def matched_differences_bootstrap(exams, seating_charts, adjacency_type,
 
     Output: an iterable ((exam name, gambler fallacy limit), bootstrap of matched differences)
     """
+    gambler_limits = list(gambler_limits)
     for exam in exams:
-        for gfal in gambler_limits:
-            matched_diff = []
-            chart = seating_charts[exam]
-            for email in exams[exam].emails:
-                one_apart, two_apart \
-                    = chart.similarity_layers(email, 2, adjacency_type,
-                                              exams[exam],
-                                              similarity_fn,
-                                              gambler_fallacy_allowable_limit=gfal)
-                diff = one_apart - two_apart
+        matched_diffs = [[] for _ in gambler_limits]
+        chart = seating_charts[exam]
+        for email in exams[exam].emails:
+            one_apart, two_apart \
+                = chart.similarity_layers_by_limit(email, 2, adjacency_type,
+                                                   exams[exam],
+                                                   similarity_fn,
+                                                   gambler_limits)
+            for matched_diff, one, two in zip(matched_diffs, one_apart, two_apart):
+                diff = one - two
                 if np.isnan(diff):
                     continue
                 matched_diff.append(diff)
+        for gfal, matched_diff in zip(gambler_limits, matched_diffs):
             yield (exam, gfal), Bootstrap(matched_diff, bootstrap_count, ci_above=100, ci_below=5)
@@ -0,0 +1,206 @@
+"""
+Generates synthetic exams and seating charts, written in the same formats as the real data.
+"""
+import csv
+from os.path import join
+from string import ascii_uppercase
+from zipfile import ZipFile
+
+import numpy as np
+
+EVALUATION_HEADER = ["Question ID", "Name", "SID", "Email", "Score"]
+SEATING_HEADER = ["Name", "Student ID", "Role", "Email Address", "First_Middle", "First", "Room",
+                  "Index", "Seat"]
+TABLE_SEATS = ["i", "ii", "iii"]
+
+def student_email(index):
+    """
+    The email address of the synthetic student with the given index.
+    """
+    return "student%05d@berkeley.edu" % index
+
+class Room:
+    """
+    The layout of a room in which an exam is taken.
+
+    Seats are either labelled by row letter and column number (e.g., B12), or if tables_per_row is
+        given, by "Row r, Table T, Seat s" with seats_per_table seats at each table.
+    """
+    def __init__(self, name, rows, columns=None, tables_per_row=None, seats_per_table=None):
+        if tables_per_row is None:
+            if rows > len(ascii_uppercase):
+                raise RuntimeError("At most %s rows can be labelled by letter" % len(ascii_uppercase))
+            self.columns = columns
+        else:
+            if tables_per_row > len(ascii_uppercase) or seats_per_table > len(TABLE_SEATS):
+                raise RuntimeError("Too many tables or seats per table to label")
+            self.columns = tables_per_row * seats_per_table
+        self.name = name
+        self.rows = rows
+        self.tables_per_row = tables_per_row
+        self.seats_per_table = seats_per_table
+    def __repr__(self):
+        return "Room({!r}, rows={}, columns={})".format(self.name, self.rows, self.columns)
+    @property
+    def capacity(self):
+        """
+        The number of seats in the room
+        """
+        return self.rows * self.columns
+    def label(self, row, column):
+        """
+        The label of the seat in the given (zero-indexed) row and column.
+        """
+        if self.tables_per_row is None:
+            return "%s%s" % (ascii_uppercase[row], column + 1)
+        table, seat = divmod(column, self.seats_per_table)
+        return "Row %s, Table %s, Seat %s" % (row + 1, ascii_uppercase[table], TABLE_SEATS[seat])
+
+class SyntheticExam:
+    """
+    A randomly generated exam, along with the seating chart it was taken under.
+
+    Inputs:
+        n_students:         the number of students taking the exam
+        rooms:              a list of Rooms, filled in order with students in a random order. By
+                                default, as many 20 by 25 rooms as are needed.
+        n_questions:        the number of questions
+        rubric_size:        the number of rubric items per question, each worth one point
+        grader_biases:      one bias per grader, added to the log-odds of selecting every rubric
+                                item; each question's students are split between graders in
+                                grading order
+        n_cheater_pairs:    the number of students who copy from the student sitting next to them
+        copy_ratio:         the fraction of rubric items each cheater copies
+        unknown_seats:      the fraction of students whose seat is recorded as N/A
+        seed:               the random seed
+
+    Each student has an ability and each rubric item a difficulty, and items are selected
+        independently with probability logistic(ability - difficulty + grader bias).
+    """
+    def __init__(self, n_students, rooms=None, n_questions=5, rubric_size=4,
+                 grader_biases=(0, 0, 0, 0), n_cheater_pairs=0, copy_ratio=0.5, unknown_seats=0,
+                 seed=0):
+        rng = np.random.RandomState(seed)
+        if rooms is None:
+            n_rooms = -(-n_students // 500) or 1
+            rooms = [Room("Room %s" % (x + 1), 20, 25) for x in range(n_rooms)]
+        self.n_students = n_students
+        self.rooms = rooms
+        self.n_questions = n_questions
+        self.rubric_size = rubric_size
+        self.grader_biases = grader_biases
+        self.seats = self.__assign_seats(rng, unknown_seats)
+        self.rubric_items = self.__grade(rng)
+        self.cheaters = self.__cheat(rng, n_cheater_pairs, copy_ratio)
+    def __assign_seats(self, rng, unknown_seats):
+        """
+        Returns a list with, for each student, either None or (room index, row, column).
+        """
+        seated = rng.permutation(self.n_students)
+        seated = seated[:int(round(len(seated) * (1 - unknown_seats)))]
+        if len(seated) > sum(room.capacity for room in self.rooms):
+            raise RuntimeError("Not enough seats for %s students" % len(seated))
+        seats = [None] * self.n_students
+        position = 0
+        for room_index, room in enumerate(self.rooms):
+            for seat in range(room.capacity):
+                if position == len(seated):
+                    return seats
+                seats[seated[position]] = (room_index,) + divmod(seat, room.columns)
+                position += 1
+        return seats
+    def __grade(self, rng):
+        """
+        Returns a boolean array of rubric items, indexed by student, question, and rubric item.
+        """
+        ability = rng.normal(0, 1, size=(self.n_students, 1, 1))
+        difficulty = rng.normal(0, 1, size=(1, self.n_questions, self.rubric_size))
+        biases = np.array(self.grader_biases, dtype=float)[self.graders]
+        log_odds = ability - difficulty + biases[:, :, np.newaxis]
+        probability = 1 / (1 + np.exp(-log_odds))
+        return rng.random_sample(probability.shape) < probability
+    def __cheat(self, rng, n_cheater_pairs, copy_ratio):
+        """
+        Makes some students copy from their neighbor on the right, returning (cheater, mark) pairs
+            of student indices.
+        """
+        by_seat = {seat : student for student, seat in enumerate(self.seats) if seat is not None}
+        candidates = [(student, by_seat[(room, row, column + 1)])
+                      for (room, row, column), student in sorted(by_seat.items())
+                      if (room, row, column + 1) in by_seat]
+        if n_cheater_pairs > len(candidates):
+            raise RuntimeError("Only %s students have a neighbor" % len(candidates))
+        chosen = rng.choice(len(candidates), size=n_cheater_pairs, replace=False)
+        cheaters = []
+        for cheater, mark in (candidates[x] for x in sorted(chosen)):
+            copied = rng.random_sample((self.n_questions, self.rubric_size)) < copy_ratio
+            self.rubric_items[cheater][copied] = self.rubric_items[mark][copied]
+            cheaters.append((cheater, mark))
+        return cheaters
+    @property
+    def graders(self):
+        """
+        An array of grader indices, indexed by student and question.
+        """
+        by_student = np.arange(self.n_students) * len(self.grader_biases) // max(self.n_students, 1)
+        return np.repeat(by_student[:, np.newaxis], self.n_questions, axis=1)
+    @property
+    def cheater_emails(self):
+        """
+        A list of (cheater email, mark email) pairs.
+        """
+        return [(student_email(x), student_email(y)) for x, y in self.cheaters]
+    def write_evaluations(self, path):
+        """
+        Writes a zip file of evaluations, with one CSV per question in the format read by
+            evaluations.proc_evaluations. Students are graded in order of index.
+        """
+        graders = self.graders
+        rubric_names = ["Rubric Item %s" % (item + 1) for item in range(self.rubric_size)]
+        header = ",".join(EVALUATION_HEADER + rubric_names + ["Adjustment", "Comments", "Grader"])
+        with ZipFile(path, 'w') as zipped:
+            for question in range(self.n_questions):
+                lines = [header]
+                for index in range(self.n_students):
+                    selected = self.rubric_items[index, question]
+                    rubric = ["true" if x else "false" for x in selected]
+                    lines.append(",".join([str(index), "Student %s" % index, str(index),
+                                           student_email(index), str(selected.sum())]
+                                          + rubric
+                                          + ["", "", "Grader %s" % graders[index, question]]))
+                zipped.writestr("synthetic/%s_Question_%s.csv" % (question + 1, question + 1),
+                                "\n".join(lines) + "\n")
+    def write_seating_chart(self, path):
+        """
+        Writes a seating chart in the format read by seating_chart.SeatingChart.
+        """
+        with open(path, 'w', newline='') as fil:
+            writer = csv.writer(fil)
+            writer.writerow(SEATING_HEADER)
+            for index, seat in enumerate(self.seats):
+                if seat is None:
+                    room, label = self.rooms[0].name, "N/A"
+                else:
+                    room, label = self.rooms[seat[0]].name, self.rooms[seat[0]].label(*seat[1:])
+                writer.writerow(["Student %s" % index, index, "Student", student_email(index),
+                                 "Student", "Student", room, index, label])
+    def write(self, directory):
+        """
+        Writes the evaluations zip and seating chart into DIRECTORY.
+
+        Output: (path of the evaluations zip, path of the seating chart)
+        """
+        evaluations = join(directory, "synthetic_evaluations.zip")
+        seats = join(directory, "synthetic_seats.csv")
+        self.write_evaluations(evaluations)
+        self.write_seating_chart(seats)
+        return evaluations, seats
+
+def write_exam(directory, n_students, seed=0):
+    """
+    Writes an evaluations zip and seating chart for a default SyntheticExam of N_STUDENTS students
+        into DIRECTORY.
+
+    Output: (path of the evaluations zip, path of the seating chart)
+    """
+    return SyntheticExam(n_students, seed=seed).write(directory)
@@ -1,23 +1,89 @@
 """
 Tests for various modules.
 """
+import json
+import subprocess
+import sys
 from unittest import TestCase, main
+from collections import OrderedDict
+from functools import partial
+from io import StringIO
+from os.path import abspath, dirname, exists, join
+from queue import Queue
+from tempfile import TemporaryDirectory
+from zipfile import ZipFile
 
 
+import numpy as np
 from numpy.testing import assert_almost_equal as aae
 
-from seating_chart import SeatingChart, Location, AdjacencyType
+from seating_chart import SeatingChart, Location, AdjacencyType, SeatFormat, SeatParser, UNKNOWN
 from constants import DATA_DIR
-from evaluations import proc_evaluations
+from evaluations import proc_evaluations, _parse_evaluation_rows, _merge_questions
+from evaluations import IncrementalEvaluations
 from analytics import compensate_for_grader_means, all_pairs, ExamPair, _unusualness
+from analytics import CompensationCache, GraderMonitor
+from analytics import Totals, room_pair_statistics, room_pair_totals, room_layer_differences
 from graded_exam import ExamQuestion
-from graphics import NoProgressBar
+from graphics import NoProgressBar, TerminalProgressBar, QueueProgressBar, ProgressMonitor
+from benchmark import regressions, heavy_imports, startup_over_budget, STARTUP_BUDGET
+import instrument
+from synthetic import SyntheticExam, Room
+from models import one_way_vs_two_way_summary, model_on_params, RandomSeatingModel
+from models import score_diff_summary
+from result_store import ResultStore, run_key
+from tools import function_identity
+from registry import StudentRegistry, decode_pairs
+from recurring import RecurringNeighbors, shuffle_within_groups
+from parallel import parallel_map
+from ocr import OcrTools, NAME_REGIONS, extract_exams, run_ocr, classify_read
+from name_index import NameIndex, edit_distance
+from report_data import grader_series, profile_series, region_profiles
+from report_data import matched_difference_series, write_json, write_csv
+from report_builder import FigureTask, build_figures, input_fingerprint
+from comparison import compare_models, comparison_table, default_models, SUMMARIES
+from models import GridRefinement, BaseTrialBank, binary_cheater, ScoreIndependentModel
+from models import QuestionIndependentModel, BATCH_TRIALS
+from statistics import SequentialTest, TailType
+from tools import cached_property
 
 
-EVALS_SAMPLE = proc_evaluations('data/test-evals.zip')
-EVALS_SIMPLE_SAMPLE = proc_evaluations('data/test-simple-evals.zip')
-SEATS_SAMPLE = SeatingChart('data/test-seats.csv')
-SEATS_SIMPLE_SAMPLE = SeatingChart('data/test-seats-simple.csv')
+class _Fixtures:
+    """
+    The sample exams and seating charts, each loaded the first time a test uses it.
+    """
+    @cached_property
+    def evals_sample(self):
+        """
+        The sample evaluations
+        """
+        return proc_evaluations('data/test-evals.zip')
+    @cached_property
+    def evals_simple_sample(self):
+        """
+        The simple sample evaluations
+        """
+        return proc_evaluations('data/test-simple-evals.zip')
+    @cached_property
+    def seats_sample(self):
+        """
+        The sample seating chart
+        """
+        return SeatingChart('data/test-seats.csv')
+    @cached_property
+    def seats_simple_sample(self):
+        """
+        The simple sample seating chart
+        """
+        return SeatingChart('data/test-seats-simple.csv')
+    @property
+    def simple(self):
+        """
+        The simple sample evaluations and seating chart
+        """
+        return self.evals_simple_sample, self.seats_simple_sample
+
+FIXTURES = _Fixtures()
 
 class TestAnalytics(TestCase):
     """
@@ -30,7 +96,7 @@ class TestAnalytics(TestCase):
             by running it on a sample and testing two individuals to check that they were adjusted
             appropriately.
         """
-        compensated = compensate_for_grader_means(EVALS_SAMPLE, 1000)
+        compensated = compensate_for_grader_means(FIXTURES.evals_sample, 1000)
         q_eval = compensated.evaluation_for('Q@berkeley.edu').evals
         aae(+0.625, q_eval[0].complete_score.score)
         aae(+1.000, q_eval[1].complete_score.score)
@@ -43,12 +109,12 @@ class TestAnalytics(TestCase):
         """
         Tests the all_correlations method by exact checking on a small test case.
         """
-        corrs = list(all_pairs(EVALS_SIMPLE_SAMPLE, SEATS_SIMPLE_SAMPLE, 1, NoProgressBar,
+        corrs = list(all_pairs(*FIXTURES.simple, 1, NoProgressBar,
                                False, False, AdjacencyType.all_ways))
         self.assertEqual(6, len(corrs))
         expect_cors = {
-            ExamPair(EVALS_SIMPLE_SAMPLE.evaluation_for("%s@berkeley.edu" % first),
-                     EVALS_SIMPLE_SAMPLE.evaluation_for("%s@berkeley.edu" % second),
+            ExamPair(FIXTURES.evals_simple_sample.evaluation_for("%s@berkeley.edu" % first),
+                     FIXTURES.evals_simple_sample.evaluation_for("%s@berkeley.edu" % second),
                      time, space, room)
             for first, second, time, space, room in [
                 ("Q", "W", True, True, True),
@@ -60,6 +126,37 @@ class TestAnalytics(TestCase):
             ]
         }
         self.assertEqual(set(expect_cors), set(corrs))
+    def test_per_room(self):
+        """
+        Tests that the per-room statistics combine into the same result as the sequential ones.
+        """
+        evals, seats = FIXTURES.evals_sample, FIXTURES.seats_sample
+        def _statistic(pair):
+            return pair.abs_score_diff
+        pairs = list(all_pairs(evals, seats, 0, NoProgressBar, True, True, AdjacencyType.all_ways))
+        expected = ([_statistic(x) for x in pairs if x.are_space_adjacent],
+                    [_statistic(x) for x in pairs if not x.are_space_adjacent])
+        self.assertTrue(expected[0] and expected[1])
+        def _similarity(first, second):
+            return -abs(first.score - second.score)
+        layer_diffs = [one - two for one, two in (
+            seats.similarity_layers(x, 2, AdjacencyType.all_ways, evals, _similarity, 100)
+            for x in evals.emails) if not np.isnan(one - two)]
+        for n_processes in 1, 2:
+            self.assertEqual(expected, room_pair_statistics(evals, seats, _statistic, 0,
+                                                            AdjacencyType.all_ways, n_processes))
+            adjacent, other = room_pair_totals(evals, seats, _statistic, 0, AdjacencyType.all_ways,
+                                               n_processes)
+            self.assertEqual((len(expected[0]), len(expected[1])), (adjacent.count, other.count))
+            self.assertAlmostEqual(np.mean(expected[0]), adjacent.mean)
+            self.assertAlmostEqual(np.mean(expected[1]), other.mean)
+            diffs = room_layer_differences(evals, seats, AdjacencyType.all_ways, 100,
+                                           _similarity, n_processes)
+            self.assertEqual(len(layer_diffs), diffs.count)
+            self.assertAlmostEqual(np.mean(layer_diffs), diffs.mean)
+        self.assertAlmostEqual(score_diff_summary(evals, seats),
+                               score_diff_summary(evals, seats, n_processes=2))
+        self.assertTrue(np.isnan(Totals.combine([]).mean))
     @staticmethod
     def test_unusualness():
         """
@@ -68,10 +165,25 @@ class TestAnalytics(TestCase):
         For calculations, see calculation-of-unusualness.odt, which uses the bernouili random
             variable variance p(1-p).
         """
-        question = ExamQuestion(EVALS_SAMPLE, 1)
+        question = ExamQuestion(FIXTURES.evals_sample, 1)
         actual = _unusualness("Grader A", question)
         expected = 0.1800983877
         aae(expected, actual)
+    @staticmethod
+    def test_grader_monitor():
+        """
+        Checks that the streaming grader monitor agrees with the batch unusualness calculation.
+        """
+        monitor = GraderMonitor(z_thresh=0.5)
+        monitor.observe_exam(FIXTURES.evals_sample)
+        for problem, question in FIXTURES.evals_sample:
+            for grader in question.graders:
+                aae(_unusualness(grader, question), monitor.unusualness(problem, grader))
+        expected = {(problem, grader)
+                    for problem, question in FIXTURES.evals_sample
+                    for grader in question.graders
+                    if _unusualness(grader, question) > 0.5}
+        assert expected == {(problem, grader) for problem, grader, _ in monitor.flagged()}
 
 class TestExamQuestion(TestCase):
     """
@@ -81,7 +193,7 @@ class TestExamQuestion(TestCase):
         """
         Tests to make sure for_grader works to specification.
         """
-        question = ExamQuestion(EVALS_SAMPLE, 1)
+        question = ExamQuestion(FIXTURES.evals_sample, 1)
         self.assertEqual({"Grader %s" % g for g in "ABC"}, question.graders)
         for grader in question.graders:
             self.assertEqual({grader}, question.for_grader(grader).graders)
@@ -96,20 +208,40 @@ class TestGradedExams(TestCase):
         """
         Tests the function by_rooms, which splits the exam into several for each room.
         """
-        by_rooms = list(EVALS_SAMPLE.by_room(SEATS_SAMPLE))
+        by_rooms = list(FIXTURES.evals_sample.by_room(FIXTURES.seats_sample))
         all_emails = sorted(x for _, y in by_rooms for x in y.emails)
-        self.assertEqual(all_emails, sorted(EVALS_SAMPLE.emails))
+        self.assertEqual(all_emails, sorted(FIXTURES.evals_sample.emails))
         for room, exam in by_rooms:
             for email in exam.emails:
-                self.assertEqual(room, SEATS_SAMPLE.room_for(email))
-                self.assertEqual(exam.evaluation_for(email), EVALS_SAMPLE.evaluation_for(email))
+                self.assertEqual(room, FIXTURES.seats_sample.room_for(email))
+                self.assertEqual(exam.evaluation_for(email),
+                                 FIXTURES.evals_sample.evaluation_for(email))
     def test_remove(self):
         """
         Tests the function remove, which removes some email addresses.
         """
-        some_emails = list(EVALS_SAMPLE.emails)[::3]
-        removed = EVALS_SAMPLE.remove(some_emails)
-        self.assertEqual(sorted(list(removed.emails) + some_emails), sorted(EVALS_SAMPLE.emails))
+        some_emails = list(FIXTURES.evals_sample.emails)[::3]
+        removed = FIXTURES.evals_sample.remove(some_emails)
+        self.assertEqual(sorted(list(removed.emails) + some_emails),
+                         sorted(FIXTURES.evals_sample.emails))
+    def test_grouped_profile(self):
+        """
+        Tests that the grouped exam profile matches the profiles of each group computed separately.
+        """
+        evals, seats = FIXTURES.evals_sample, FIXTURES.seats_sample
+        def _grader(email):
+            return evals._question_score_for(1.0, email).grader # pylint: disable=W0212
+        for key in seats.room_for, _grader:
+            grouped = evals.grouped_profile(key)
+            self.assertEqual(len(evals.emails), sum(grouped.counts))
+            for group, mean, std, count in zip(*grouped):
+                profiles = [evals.exam_profile(x) for x in evals.emails if key(x) == group]
+                self.assertEqual(len(profiles), count)
+                aae(np.mean(profiles, axis=0), mean)
+                aae(np.std(profiles, axis=0), std)
+        grouped = evals.grouped_profile(lambda x: "A" if x < "M" else None)
+        self.assertEqual(["A"], grouped.groups)
+        self.assertEqual(len([x for x in evals.emails if x < "M"]), grouped.counts[0])
     def test_time_diff(self):
         """
         Tests the time_diff function thoroughly on a evals_sample.
@@ -117,7 +249,186 @@ class TestGradedExams(TestCase):
         emails = [x + "@berkeley.edu" for x in "QWERTYUIOP"]
         for index_a, email_a in enumerate(emails):
             for index_b, email_b in enumerate(emails):
-                self.assertEqual(index_a - index_b, EVALS_SAMPLE.time_diff(email_a, email_b))
+                self.assertEqual(index_a - index_b,
+                                 FIXTURES.evals_sample.time_diff(email_a, email_b))
+    def test_time_masks(self):
+        """
+        Tests that the vectorized time differences and masks agree with time_diff, and that the
+            similarity layers for several limits agree with filtering each layer by time_diff.
+        """
+        evals, seats = FIXTURES.evals_sample, FIXTURES.seats_sample
+        emails = sorted(evals.emails)
+        pairs = [(x, y) for x in emails for y in emails]
+        first, second = (evals.ids_for(column) for column in zip(*pairs))
+        self.assertEqual([evals.time_diff(x, y) for x, y in pairs],
+                         evals.time_diffs(first, second).tolist())
+        masks = evals.time_masks(first, second, [-2, 0, 3])
+        for limit, mask in zip([-2, 0, 3], masks):
+            self.assertEqual([evals.time_diff(x, y) <= limit for x, y in pairs], mask.tolist())
+        self.assertEqual([-1], evals.ids_for(["nobody@berkeley.edu"]).tolist())
+        with TemporaryDirectory() as directory:
+            path = join(directory, "seats.csv")
+            with open("data/test-seats.csv") as original, open(path, "w") as fil:
+                fil.write(original.read().rstrip("\n")
+                          + "\nZ,1,Student,Z@berkeley.edu,Z,Z,Room 2,7,A1\n")
+            seated = SeatingChart(path)
+        self.assertIn("Z@berkeley.edu", seated.emails)
+        unknown, known = evals.ids_for(["Z@berkeley.edu"]), evals.ids_for(["W@berkeley.edu"])
+        self.assertRaises(KeyError, evals.time_diffs, unknown, known)
+        self.assertEqual([[False], [False]],
+                         evals.time_masks(unknown, known, [0, 100]).tolist())
+        self.assertEqual([[False, True]], evals.time_masks(np.concatenate([unknown, known]),
+                                                           np.concatenate([known, known]),
+                                                           [0]).tolist())
+        self.assertTrue(all(np.isnan(x) for x in seated.similarity_layers(
+            "Z@berkeley.edu", 2, AdjacencyType.all_ways, evals, lambda x, y: 1, 100)))
+        def _similarity(first, second):
+            return -abs(first.score - second.score)
+        limits = [-3, 0, 1, 100]
+        for email in emails:
+            by_limit = list(seats.similarity_layers_by_limit(email, 2, AdjacencyType.all_ways,
+                                                             evals, _similarity, limits))
+            layers = list(seats.adjacency_layers(email, 2, AdjacencyType.all_ways))
+            for index, limit in enumerate(limits):
+                expected = []
+                for layer in layers:
+                    values = [_similarity(evals.evaluation_for(email), evals.evaluation_for(x))
+                              for x in layer
+                              if x in evals.emails and evals.time_diff(email, x) <= limit]
+                    expected.append(np.mean(values) if values else float('nan'))
+                aae(expected, [layer[index] for layer in by_limit])
+
+class TestEvaluations(TestCase):
+    """
+    Tests the parsing of evaluation CSVs
+    """
+    header = ["Question ID", "Name", "SID", "Email", "Score", "Correct", "Blank",
+              "Adjustment", "Comments", "Grader"]
+    rows = [["0", "Q", "1", "Q@berkeley.edu", "2", "true", "false", "", "", "Grader A"],
+            ["1", "W", "2", "W@berkeley.edu", "0.5", "false", "true", "0.5", "ok", "Grader B"],
+            ["2", "E", "3", "E@berkeley.edu", "1", "true", "false", "-1", "", "Grader A"],
+            []]
+    def test_columns(self):
+        """
+        Tests that a question CSV is parsed into aligned columns.
+        """
+        columns = _parse_evaluation_rows([self.header] + self.rows)
+        self.assertEqual(3, len(columns))
+        self.assertEqual([[True, False], [False, True], [True, False]],
+                         columns.rubric_items.tolist())
+        self.assertEqual([2, 0.5, 1], columns.scores.tolist())
+        self.assertEqual([0, 0.5, -1], columns.adjustments.tolist())
+        self.assertEqual(["Grader A", "Grader B", "Grader A"],
+                         [columns.graders[x] for x in columns.grader_codes])
+        question = columns.scored_question(1)
+        self.assertEqual("W@berkeley.edu", question.email)
+        self.assertEqual([0, 1], question.rubric_items)
+        self.assertEqual("Grader B", question.grader)
+    def test_unknown_rubric_value(self):
+        """
+        Tests that rubric cells other than true and false are rejected.
+        """
+        with self.assertRaises(KeyError):
+            _parse_evaluation_rows([self.header, self.rows[0][:5] + ["yes"] + self.rows[0][6:]])
+    def test_merge(self):
+        """
+        Tests that questions are joined by row and that missing or reordered submissions are rejected.
+        """
+        first = _parse_evaluation_rows([self.header] + self.rows)
+        second_rows = [row[:5] + ["false", "true"] + row[7:] if row else row for row in self.rows]
+        second = _parse_evaluation_rows([self.header] + second_rows)
+        merged = _merge_questions([(2.0, second), (1.0, first)])
+        evaluation = merged.evaluation_for("Q@berkeley.edu")
+        self.assertEqual([1, 0, 0, 1], evaluation.rubrics)
+        self.assertEqual(4, evaluation.score)
+        for rows in self.rows[:2], self.rows[::-1][1:]:
+            with self.assertRaises(RuntimeError):
+                _merge_questions([(1.0, first), (2.0, _parse_evaluation_rows([self.header] + rows))])
+
+class TestIncrementalEvaluations(TestCase):
+    """
+    Tests ingesting successive exports of an evaluations zip.
+    """
+    @staticmethod
+    def _modified_export(path, replacements, extra=()):
+        """
+        Writes a copy of test-evals.zip to PATH with the given (member, old, new) text replacements,
+            and the given (member, contents) extra members.
+        """
+        with ZipFile('data/test-evals.zip') as original, ZipFile(path, 'w') as modified:
+            for member in original.namelist():
+                contents = original.read(member).decode()
+                for name, old, new in replacements:
+                    if member == name:
+                        contents = contents.replace(old, new)
+                modified.writestr(member, contents)
+            for member, contents in extra:
+                modified.writestr(member, contents)
+    def assert_same_grades(self, expected, actual):
+        """
+        Asserts that two ExamGrades objects contain the same evaluations.
+        """
+        self.assertEqual(sorted(expected.emails), sorted(actual.emails))
+        for email in expected.emails:
+            self.assertEqual(repr(expected.evaluation_for(email)),
+                             repr(actual.evaluation_for(email)))
+    def test_update(self):
+        """
+        Tests that only changed questions are reported and that the patched grades and compensation
+            match a full reload.
+        """
+        cache = CompensationCache(1000)
+        incremental = IncrementalEvaluations(caches=[cache])
+        self.assertEqual({1, 2, 3}, incremental.update('data/test-evals.zip'))
+        self.assert_same_grades(FIXTURES.evals_sample, incremental.grades)
+        cache.compensate(incremental.grades)
+        self.assertEqual(set(), incremental.update('data/test-evals.zip'))
+        with TemporaryDirectory() as directory:
+            path = directory + "/test-evals.zip"
+            self._modified_export(path, [("test-evals/2_Question_2.csv", "Grader A", "Grader D")])
+            changed = incremental.update(path)
+            self.assertEqual({2}, changed)
+            self.assert_same_grades(proc_evaluations(path), incremental.grades)
+        self.assert_same_grades(compensate_for_grader_means(incremental.grades, 1000),
+                                cache.compensate(incremental.grades))
+    def test_update_compensation(self):
+        """
+        Tests that compensation with a finite threshold matches compensating a full reload after a
+            question changes, that other files in the export are ignored, and that a question that
+            fails to parse is read again by the next update.
+        """
+        cache = CompensationCache(1)
+        incremental = IncrementalEvaluations(caches=[cache])
+        extra = [("__MACOSX/test-evals/._2_Question_2.csv", "\0"), ("test-evals/README", "")]
+        with TemporaryDirectory() as directory:
+            path = directory + "/test-evals.zip"
+            self._modified_export(path, [], extra)
+            self.assertEqual({1, 2, 3}, incremental.update(path))
+            cache.compensate(incremental.grades)
+            self._modified_export(path, [("test-evals/2_Question_2.csv", "true", "maybe")], extra)
+            self.assertRaises(KeyError, incremental.update, path)
+            self._modified_export(path, [("test-evals/2_Question_2.csv", "Grader A", "Grader D")],
+                                  extra)
+            self.assertEqual({2}, incremental.update(path))
+            expected = proc_evaluations(path)
+        self.assert_same_grades(expected, incremental.grades)
+        self.assert_same_grades(compensate_for_grader_means(expected, 1),
+                                cache.compensate(incremental.grades))
+    def test_quoted_newlines(self):
+        """
+        Tests that line breaks inside quoted cells are kept, as they are by proc_evaluations.
+        """
+        incremental = IncrementalEvaluations()
+        with TemporaryDirectory() as directory:
+            path = directory + "/test-evals.zip"
+            self._modified_export(path, [("test-evals/2_Question_2.csv",
+                                          "0,Q,234,Q@berkeley.edu,4,true,false,false,false,,,",
+                                          '0,Q,234,Q@berkeley.edu,4,true,false,false,false,,'
+                                          '"x\ny\u2028z\x0b",')])
+            incremental.update(path)
+            self.assert_same_grades(proc_evaluations(path), incremental.grades)
+        self.assertEqual("x\ny\u2028z\x0b",
+                         incremental.grades.evaluation_for("Q@berkeley.edu").evals[1].comments)
 
 class TestSeatingChart(TestCase):
     """
@@ -162,6 +473,13 @@ class TestSeatingChart(TestCase):
                          set(seats.adjacent_to("E@berkeley.edu", AdjacencyType.all_ways)))
         # pylint: disable=W0212
         self.assertEqual(0.5, seats._location("W@berkeley.edu").column.location)
+    def test_y_region(self):
+        """
+        Tests the y regions, including a room with only a single row.
+        """
+        seats = SeatingChart('data/test-seats-complex.csv')
+        self.assertEqual(["front", "middle", "back", "back", "middle"],
+                         [seats.y_region("%s@berkeley.edu" % x) for x in "QROPA"])
     def test_adjacency_layers(self):
         """
         Ensures that the adjacency layers function is working correctly.
@@ -183,6 +501,625 @@ class TestLocation(TestCase):
                          Location.create_location("room", "D2"))
         self.assertEqual(Location('room', row=0, column=12),
                          Location.create_location("room", "A12"))
+    def test_table_format(self):
+        """
+        Tests the Row, Table, Seat format and the labels for unknown seats.
+        """
+        self.assertEqual(Location('room', row=3, column=(1, 2)),
+                         Location.create_location("room", "Row 3, Table B, Seat ii"))
+        self.assertIs(UNKNOWN, Location.create_location("room", "N/A"))
+        self.assertIs(UNKNOWN, Location.create_location("room", "Front Desk"))
+        with self.assertRaises(RuntimeError):
+            Location.create_location("room", "???")
+    def test_registered_format(self):
+        """
+        Tests that formats registered for a room are tried first, and only in that room.
+        """
+        parser = SeatParser()
+        parser.register(SeatFormat("number-letter", r"([0-9]+)([A-Z])",
+                                   lambda match: (int(match.group(1)), -1,
+                                                  ord(match.group(2)) - ord('A'))),
+                        room="hall")
+        self.assertEqual(Location('hall', row=1, column=1),
+                         Location.create_location("hall", "1B2", parser))
+        self.assertEqual(Location('room', row=1, column=2),
+                         Location.create_location("room", "1B2", parser))
+
+class TestModels(TestCase):
+    """
+    Tests running models
+    """
+    def test_sequential(self):
+        """
+        Tests that clearly decided p-values stop early and that borderline ones use every trial.
+        """
+        def _run(true_value, alpha):
+            _, p_val, report = model_on_params(
+                *FIXTURES.simple, true_value, RandomSeatingModel, (),
+                lambda grades, seats: rng.random_sample(), 2000, tail_type=TailType.KNOWN_HIGH,
+                sequential=SequentialTest(alpha=alpha, batch_size=100))
+            return p_val, report.n_trials
+        rng = np.random.RandomState(0)
+        p_val, n_trials = _run(2, 0.05)
+        self.assertEqual(200, n_trials)
+        self.assertLess(p_val, 0.05)
+        p_val, n_trials = _run(0.5, 0.05)
+        self.assertEqual(100, n_trials)
+        self.assertGreater(p_val, 0.05)
+        _, n_trials = _run(0.5, 0.5)
+        self.assertEqual(2000, n_trials)
+    def test_grid_refinement(self):
+        """
+        Tests that the adaptive sweep only refines cells on the boundary of the plausible region.
+        """
+        def _evaluate(params):
+            return params, (1 if params[0] + params[1] < 0.7 else 0), None
+        refinement = GridRefinement(bounds=((0, 1), (0, 2)), alpha=0.05, initial=3, max_depth=3)
+        results = list(refinement.sweep(_evaluate))
+        params = [x for x, _, _ in results]
+        self.assertEqual(len(params), len(set(params)))
+        self.assertEqual([(0, 0), (0, 1), (0, 2)], params[:3])
+        self.assertLess(len(params), 17 * 17 / 2)
+        finest = [(x, y) for x, y in params if round(x * 16) % 2 == 1 or round(y * 8) % 2 == 1]
+        self.assertTrue(all(abs(x + y - 0.7) < 0.4 for x, y in finest))
+        self.assertEqual(results[:10], list(refinement.sweep(_evaluate, budget=10)))
+
+    def test_base_trial_bank(self):
+        """
+        Tests that every parameter point reuses the banked base trials, and that the same trial is
+            perturbed identically each time.
+        """
+        model = binary_cheater(RandomSeatingModel, (), AdjacencyType.sideways_only)
+        bank = BaseTrialBank(*FIXTURES.simple, model, 5, seed=1)
+        self.assertEqual(5, len(bank))
+        def _rubrics(params):
+            rubrics = []
+            def _summary(grades, _):
+                rubrics.append(tuple(tuple(grades.evaluation_for(x).rubrics)
+                                     for x in sorted(grades.emails)))
+                return 0
+            model_on_params(*FIXTURES.simple, 0, model, params, _summary, 5, bank=bank)
+            return rubrics
+        base = [tuple(tuple(x.points) for _, x in sorted(bank.grades(i).items())) for i in range(5)]
+        self.assertEqual(base, _rubrics((0, 0.5)))
+        self.assertEqual(base, _rubrics((0.5, 0)))
+        self.assertEqual(_rubrics((0.5, 0.5)), _rubrics((0.5, 0.5)))
+        other = binary_cheater(ScoreIndependentModel, (), AdjacencyType.sideways_only)
+        self.assertRaises(RuntimeError, model_on_params, *FIXTURES.simple,
+                          0, other, (0, 0), None, 5, bank=bank)
+        self.assertRaises(RuntimeError, model_on_params, *FIXTURES.simple,
+                          0, model, (0, 0), None, 6, bank=bank)
+
+    def test_batched_models(self):
+        """
+        Tests that the batched models draw every trial at once with scores summing the points.
+        """
+        np.random.seed(0)
+        for model in ScoreIndependentModel, QuestionIndependentModel:
+            evals, seats = FIXTURES.simple
+            simulated = model(evals).create_grades_batch(seats, 300)
+            self.assertEqual(300, len(simulated))
+            means = []
+            for grades in simulated:
+                self.assertEqual(evals.emails, grades.emails)
+                for email in grades.emails:
+                    evalu = grades.evaluation_for(email)
+                    self.assertAlmostEqual(sum(evalu.points), evalu.score)
+                means.append(grades.mean_score)
+            self.assertAlmostEqual(evals.mean_score, np.mean(means), delta=0.2)
+            single = model(evals).create_grades(seats)
+            self.assertEqual(evals.emails, single.emails)
+        def _mean_scores(n_trials, store=None):
+            means = []
+            def _summary(grades, _):
+                means.append(grades.mean_score)
+                return grades.mean_score
+            model_on_params(*FIXTURES.simple, 0, ScoreIndependentModel, (), _summary, n_trials,
+                            store=store, seed=2)
+            return means
+        first_batch = ScoreIndependentModel(evals).create_grades_batch(
+            seats, BATCH_TRIALS, np.random.RandomState([2, 0]))
+        self.assertEqual([x.mean_score for x in first_batch], _mean_scores(BATCH_TRIALS))
+        with TemporaryDirectory() as directory:
+            store = ResultStore(join(directory, "results.sqlite3"))
+            resumed = _mean_scores(BATCH_TRIALS + 2, store) + _mean_scores(3 * BATCH_TRIALS, store)
+            self.assertEqual(_mean_scores(3 * BATCH_TRIALS), resumed)
+            store.close()
+    def test_result_store(self):
+        """
+        Tests that stored trials are reused, that only the missing trials are simulated, and that
+            the result is the same as simulating every trial.
+        """
+        calls = []
+        def _summary(grades, seats):
+            calls.append(None)
+            return one_way_vs_two_way_summary(grades, seats, gambler_fallacy_allowable_limit=1,
+                                              similarity_fn=lambda x, y: x.correlation(y))
+        def _run(n_trials, store):
+            del calls[:]
+            _, p_val, report = model_on_params(*FIXTURES.simple, 0,
+                                               RandomSeatingModel, (), _summary, n_trials,
+                                               store=store, seed=4)
+            return p_val, report.n_trials, len(calls)
+        state = np.random.get_state()[1].copy()
+        _run(3, None)
+        self.assertTrue(np.array_equal(state, np.random.get_state()[1]))
+        with TemporaryDirectory() as directory:
+            store = ResultStore(join(directory, "results.sqlite3"))
+            self.assertEqual(3, _run(3, store)[2])
+            self.assertEqual(0, _run(3, store)[2])
+            p_val, n_trials, simulated = _run(8, store)
+            self.assertEqual((8, 5), (n_trials, simulated))
+            self.assertEqual((p_val, 8, 8), _run(8, None))
+            self.assertEqual([8], [count for _, _, count in store.runs()])
+            store.close()
+        self.assertRaises(RuntimeError, model_on_params, *FIXTURES.simple,
+                          0, RandomSeatingModel, (), _summary, 3, store=store)
+        source = "def summary(grades, seats):\n    return (lambda x: x)(grades)\n"
+        first, second = {}, {}
+        exec(source, first) # pylint: disable=W0122
+        exec(source, second) # pylint: disable=W0122
+        self.assertEqual(function_identity(first["summary"]), function_identity(second["summary"]))
+        self.assertNotEqual(function_identity(score_diff_summary)[2],
+                            function_identity(one_way_vs_two_way_summary)[2])
+        key = partial(run_key, *FIXTURES.simple, RandomSeatingModel, (), _summary, 4)
+        self.assertEqual(key(depends=(1,)), key(depends=(1,)))
+        self.assertNotEqual(key(depends=(1,)), key(depends=(2,)))
+        self.assertNotEqual(key(), key(depends=(one_way_vs_two_way_summary,)))
+
+class TestParallel(TestCase):
+    """
+    Tests the process pool helper and the model comparison harness
+    """
+    def test_parallel_map(self):
+        """
+        Tests that tasks may refer to unpicklable shared state and that results keep their order.
+        """
+        shared = {x : (lambda x=x: x * x) for x in range(20)}
+        squares = parallel_map(lambda x: shared[x](), range(20), n_processes=3,
+                               weight=lambda x: x % 7)
+        self.assertEqual([x * x for x in range(20)], squares)
+        nested = parallel_map(lambda x: parallel_map(lambda y: x * y, range(3), n_processes=2),
+                              range(4), n_processes=2)
+        self.assertEqual([[0, x, 2 * x] for x in range(4)], nested)
+    def test_compare_models(self):
+        """
+        Tests that the comparison harness covers the whole grid and gives the same seeded results in
+            parallel as sequentially.
+        """
+        exams = OrderedDict([("simple", FIXTURES.simple)])
+        models = default_models()
+        summaries = OrderedDict([("correlation", SUMMARIES["one vs two away correlation"])])
+        results = compare_models(exams, models, summaries, 4, n_processes=2, seed=1)
+        self.assertEqual(list(models), [x.model for x in results])
+        self.assertTrue(all(x.report.n_trials == 4 for x in results))
+        sequential = compare_models(exams, models, summaries, 4, n_processes=1, seed=1)
+        self.assertEqual([x.p_value for x in sequential], [x.p_value for x in results])
+        table = comparison_table(results).split("\n")
+        self.assertEqual(len(models) + 2, len(table))
+        self.assertTrue(table[0].startswith("Exam"))
+
+def _draw_line(values, path):
+    """
+    Draws the given values for TestReportBuilder.
+    """
+    from matplotlib import pyplot as plt
+    plt.plot(values)
+    plt.savefig(path)
+
+def _draw_model(model, path):
+    """
+    Draws the value of the given model class for TestReportBuilder.
+    """
+    _draw_line([model().value()], path)
+
+class TestRegistry(TestCase):
+    """
+    Tests the cross-exam student registry
+    """
+    def test_registry(self):
+        """
+        Tests that the layout of each exam matches its grades and seating chart, and that the pairs
+            adjacent on several exams are found.
+        """
+        exams = OrderedDict([("first", (FIXTURES.evals_sample, FIXTURES.seats_sample)),
+                             ("simple", FIXTURES.simple),
+                             ("again", (FIXTURES.evals_sample, FIXTURES.seats_sample))])
+        registry = StudentRegistry(exams)
+        emails = sorted(set(FIXTURES.seats_sample.emails) | set(FIXTURES.evals_simple_sample.emails))
+        self.assertEqual(emails, registry.emails_for(range(len(registry))))
+        layout = registry.exam("simple")
+        for email, index in zip(emails, registry.ids_for(emails)):
+            if email in FIXTURES.evals_simple_sample.emails:
+                self.assertEqual(FIXTURES.evals_simple_sample.time_diff(email, "Q@berkeley.edu"),
+                                 layout.time_index[index] - layout.time_index[
+                                     registry.ids_for(["Q@berkeley.edu"])[0]])
+            else:
+                self.assertEqual(-1, layout.time_index[index])
+        first = registry.exam("first")
+        self.assertEqual(len(FIXTURES.seats_sample.emails), first.room_starts[-1])
+        expected = {(x, y) for x in emails for y in emails
+                    if x < y and x in FIXTURES.seats_sample.emails
+                    and y in FIXTURES.seats_sample.emails
+                    and FIXTURES.seats_sample.are_adjacent(x, y, AdjacencyType.all_ways)}
+        def _pairs(codes):
+            return set(zip(*[registry.emails_for(ids) for ids in decode_pairs(codes)]))
+        self.assertTrue(expected)
+        self.assertEqual(expected, _pairs(registry.edge_codes(first)))
+        codes, counts = registry.recurring_pairs()
+        self.assertTrue(expected <= _pairs(codes))
+        self.assertTrue(all(counts >= 2))
+        matrix = registry.adjacency_matrix(codes)
+        self.assertEqual(counts.tolist(), matrix.sum(axis=1).tolist())
+        self.assertTrue(matrix[:, 0].all() and matrix[:, 2].all())
+        self.assertRaises(RuntimeError, registry.exam, "missing")
+
+class TestRecurring(TestCase):
+    """
+    Tests the recurring neighbor detector
+    """
+    def test_recurring(self):
+        """
+        Tests the ranking against a direct computation of the excess similarities, and that the
+            shuffles only exchange profiles within a room.
+        """
+        evals, seats = FIXTURES.evals_sample, FIXTURES.seats_sample
+        exams = OrderedDict([("first", (evals, seats)), ("simple", FIXTURES.simple),
+                             ("again", (evals, seats))])
+        registry = StudentRegistry(exams)
+        neighbors = RecurringNeighbors(registry)
+        def _similarity(grades, first, second):
+            first, second = (np.array(grades.exam_profile(x)) for x in (first, second))
+            first, second = first - first.mean(), second - second.mean()
+            return first @ second / (np.linalg.norm(first) * np.linalg.norm(second))
+        def _excess(grades, chart, first, second):
+            room = [x for x in chart.emails if x in grades.emails
+                    and chart.room_for(x) == chart.room_for(first)]
+            mean = np.mean([_similarity(grades, x, y) for x in room for y in room if x != y])
+            return _similarity(grades, first, second) - mean
+        ranking = neighbors.ranking()
+        self.assertTrue(ranking)
+        self.assertEqual(sorted(ranking, key=lambda x: -x.excess), ranking)
+        for pair in ranking:
+            adjacent = [(grades, chart) for grades, chart in exams.values()
+                        if {pair.first, pair.second} <= grades.emails
+                        and chart.are_adjacent(pair.first, pair.second, AdjacencyType.all_ways)]
+            self.assertEqual(len(adjacent), pair.n_exams)
+            self.assertAlmostEqual(sum(_excess(grades, chart, pair.first, pair.second)
+                                       for grades, chart in adjacent), pair.excess)
+        self.assertAlmostEqual(sum(x.excess for x in ranking), neighbors.statistic())
+        groups = np.repeat([0, 1, 2], [5, 1, 4])
+        shuffled = shuffle_within_groups(groups, np.random.RandomState(0), 50)
+        self.assertTrue((groups[shuffled] == groups).all())
+        self.assertTrue((np.sort(shuffled, axis=1) == np.arange(len(groups))).all())
+        self.assertTrue((shuffled != np.arange(len(groups))).any())
+        report = neighbors.permutation_test(30, seed=2)
+        self.assertEqual(30, report.n_trials)
+        self.assertEqual(report.p_value, neighbors.permutation_test(30, seed=2).p_value)
+
+class TestReportBuilder(TestCase):
+    """
+    Tests building cached figures in parallel
+    """
+    def test_build_figures(self):
+        """
+        Tests that only missing figures and those whose inputs changed are rendered.
+        """
+        with TemporaryDirectory() as directory:
+            def _tasks(first, second):
+                return [FigureTask(join(directory, "first.png"), _draw_line, (first,)),
+                        FigureTask(join(directory, "second.png"), _draw_line, (second,),
+                                   figsize=(3, 2))]
+            self.assertEqual(2, len(build_figures(_tasks([1, 2], [3]), directory, n_processes=2)))
+            self.assertTrue(exists(join(directory, "second.png")))
+            self.assertEqual([], build_figures(_tasks([1, 2], [3]), directory, n_processes=2))
+            self.assertEqual([join(directory, "second.png")],
+                             build_figures(_tasks([1, 2], [4]), directory, n_processes=2))
+            self.assertEqual(2, len(build_figures(_tasks([1, 2], [4]), directory, force=True)))
+        self.assertEqual(input_fingerprint([FIXTURES.evals_simple_sample, lambda x: x + 1]),
+                         input_fingerprint([FIXTURES.evals_simple_sample, lambda x: x + 1]))
+        self.assertNotEqual(input_fingerprint([lambda x: x + 1]),
+                            input_fingerprint([lambda x: x + 2]))
+    def test_class_inputs(self):
+        """
+        Tests that a figure drawn from a class, such as a model, is redrawn when a method of the
+            class changes.
+        """
+        def _model(value):
+            namespace = {}
+            exec("class Model:\n    def value(self):\n        return %s\n" % value, # pylint: disable=W0122
+                 namespace)
+            return namespace["Model"]
+        with TemporaryDirectory() as directory:
+            def _tasks(model):
+                return [FigureTask(join(directory, "model.png"), _draw_model, (model,))]
+            self.assertEqual(1, len(build_figures(_tasks(_model(1)), directory, n_processes=1)))
+            self.assertEqual([], build_figures(_tasks(_model(1)), directory, n_processes=1))
+            self.assertEqual(1, len(build_figures(_tasks(_model(2)), directory, n_processes=1)))
+        self.assertNotEqual(input_fingerprint(ScoreIndependentModel),
+                            input_fingerprint(QuestionIndependentModel))
+
+class TestReportData(TestCase):
+    """
+    Tests computing the data behind the report without plotting it
+    """
+    def test_series(self):
+        """
+        Tests the per-grader, per-region, and matched difference series.
+        """
+        (question,) = grader_series(FIXTURES.evals_simple_sample, min_count=1)
+        self.assertEqual(["Grader A", "Grader B"], [x.grader for x in question.graders])
+        self.assertEqual([3, 1], [x.count for x in question.graders])
+        aae([2 / 3, 1 / 3, 1 / 3], question.graders[0].mean_rubric)
+        self.assertEqual([], grader_series(FIXTURES.evals_simple_sample)[0].graders)
+        regions = profile_series(region_profiles(*FIXTURES.simple))
+        self.assertEqual(["front", "middle", "back"], [x.name for x in regions])
+        aae([50, 0, 50], regions[1].mean)
+        intervals = matched_difference_series({"simple" : FIXTURES.evals_simple_sample},
+                                              {"simple" : FIXTURES.seats_simple_sample}, [0, 1],
+                                              lambda x, y: x.correlation(y), bootstrap_count=50)
+        self.assertEqual([("simple", 0), ("simple", 1)], [x[:2] for x in intervals])
+        with TemporaryDirectory() as directory:
+            write_json(join(directory, "graders.json"), [question])
+            with open(join(directory, "graders.json")) as fil:
+                self.assertEqual(3, json.load(fil)[0]["graders"][0]["count"])
+            write_csv(join(directory, "intervals.csv"), intervals)
+            with open(join(directory, "intervals.csv")) as fil:
+                self.assertEqual("exam,correction,mean,ci_bot,ci_top", fil.readline().strip())
+    def test_headless(self):
+        """
+        Tests that computing the report data does not import matplotlib.
+        """
+        code = "import sys, report_data; sys.exit('matplotlib' in sys.modules)"
+        self.assertEqual(0, subprocess.call([sys.executable, "-c", code],
+                                            cwd=dirname(abspath(__file__))))
+
+def _stub_crop(pdf, y_loc, output):
+    """
+    Stands in for pdftoppm in TestOcr: the scan holds one name per line, from the top region down.
+    """
+    with open(pdf) as fil:
+        names = fil.read().split("\n")
+    with open(output, "w") as fil:
+        fil.write(names[[y for _, y in NAME_REGIONS].index(y_loc)])
+
+def _stub_read(image):
+    """
+    Stands in for Tesseract in TestOcr.
+    """
+    with open(image) as fil:
+        return fil.read()
+
+class TestOcr(TestCase):
+    """
+    Tests the OCR pipeline with stand-ins for the external tools
+    """
+    def test_name_index(self):
+        """
+        Tests that the index finds the same names and classifications as comparing against every
+            name on the roster.
+        """
+        self.assertEqual(3, edit_distance("kitten", "sitting"))
+        self.assertEqual(0, edit_distance("", ""))
+        rng = np.random.RandomState(0)
+        def _name():
+            return "".join(rng.choice(list("abcde"), rng.randint(2, 7)))
+        people = {_name() : index for index in range(200)}
+        index = NameIndex(people)
+        self.assertEqual(people, dict(index))
+        reads = [_name() for _ in range(200)]
+        for read in reads:
+            distances = {name : edit_distance(read, name) for name in people}
+            self.assertEqual(sorted((name, dist) for name, dist in distances.items() if dist <= 2),
+                             sorted(index.within(read, 2)))
+            close = [people[name] for name, dist in distances.items() if dist <= 1]
+            ambiguous = any(1 < dist <= 3 for dist in distances.values())
+            expected = close[0] if len(close) == 1 and not ambiguous else None
+            self.assertEqual(expected, classify_read(read, index))
+        self.assertEqual(classify_read(reads[0], index), classify_read(reads[0], people))
+        self.assertEqual([classify_read(read, index, 0, 0) for read in reads],
+                         index.classify_all(reads, 0, 0))
+    def test_name_index_sublinear(self):
+        """
+        Tests that a search only computes the edit distance of a small part of a large roster.
+        """
+        rng = np.random.RandomState(0)
+        letters = list("abcdefghijklmnopqrstuvwxyz ")
+        roster = ["".join(rng.choice(letters, rng.randint(10, 20))) for _ in range(3000)]
+        calls = []
+        def _distance(first, second):
+            calls.append(None)
+            return edit_distance(first, second)
+        index = NameIndex({name : name for name in roster}, distance=_distance)
+        for name in roster[:100]:
+            read = list(name)
+            read[rng.randint(len(read))] = rng.choice(letters)
+            self.assertEqual(name, index.classify("".join(read)))
+        self.assertLess(len(calls), 100 * len(roster) / 100)
+    def test_resume(self):
+        """
+        Tests that every scan is classified once, even when a run is interrupted, and that scans
+            with the same file name in different folders are kept apart.
+        """
+        tools = OcrTools(_stub_crop, _stub_read)
+        people = {"alice" : "a@berkeley.edu", "bob" : "b@berkeley.edu"}
+        def _classifier(read, people_class):
+            return people_class.get(read)
+        with TemporaryDirectory() as directory:
+            with ZipFile(join(directory, "scans.zip"), "w") as zipped:
+                for index, names in enumerate(["alice\nbob", "bob\nalice", "bob\ncarol"]):
+                    zipped.writestr("scans/%s.pdf" % index, names)
+                zipped.writestr("other/0.pdf", "carol\nalice")
+            extracted = join(directory, "extract")
+            pdfs = extract_exams(join(directory, "scans.zip"), extracted)
+            results = join(directory, "results.jsonl")
+            crops = join(directory, "crops")
+            self.assertEqual(1, run_ocr(pdfs[:1], people, results, crops, tools,
+                                        classifier=_classifier, root=extracted))
+            with open(results, "a") as fil:
+                fil.write('{"exam" : "scans/1.pd')
+            self.assertEqual(3, run_ocr(pdfs, people, results, crops, tools, n_processes=2,
+                                        classifier=_classifier, root=extracted))
+            self.assertEqual(0, run_ocr(pdfs, people, results, crops, tools,
+                                        classifier=_classifier, root=extracted))
+            def _failing(read, _):
+                raise ValueError(read)
+            self.assertRaises(ValueError, run_ocr, pdfs, people, join(directory, "failed.jsonl"),
+                              crops, tools, n_processes=2, classifier=_failing)
+            self.assertEqual([1, 4], parallel_map(lambda x: x * x, [1, 2], n_processes=2))
+            with open(results) as fil:
+                records = [json.loads(x) for x in fil if x.startswith('{"exam": ')]
+        by_exam = {x["exam"] : x["regions"] for x in records}
+        self.assertEqual(4, len(records))
+        self.assertEqual([join("other", "0.pdf")] + [join("scans", "%s.pdf" % x) for x in range(3)],
+                         sorted(by_exam))
+        self.assertEqual("b@berkeley.edu", by_exam[join("scans", "1.pdf")]["left"]["class"])
+        self.assertEqual("carol", by_exam[join("scans", "2.pdf")]["right"]["read"])
+        self.assertEqual(None, by_exam[join("scans", "2.pdf")]["right"]["class"])
+        self.assertEqual("carol", by_exam[join("other", "0.pdf")]["left"]["read"])
+        self.assertEqual("a@berkeley.edu", by_exam[join("scans", "0.pdf")]["left"]["class"])
+
+class TestSynthetic(TestCase):
+    """
+    Tests the synthetic exam generator
+    """
+    @staticmethod
+    def _load(n_cheater_pairs):
+        """
+        Generates, writes, and reads back a two room exam with the given number of cheaters.
+        """
+        exam = SyntheticExam(300, rooms=[Room("Hall", 10, 12),
+                                         Room("Tables", 14, tables_per_row=4, seats_per_table=3)],
+                             n_questions=6, rubric_size=5, grader_biases=(0, 1, -1),
+                             n_cheater_pairs=n_cheater_pairs, copy_ratio=0.9, unknown_seats=0.05,
+                             seed=3)
+        with TemporaryDirectory() as directory:
+            evaluations, seats = exam.write(directory)
+            return exam, proc_evaluations(evaluations), SeatingChart(seats)
+    def test_round_trip(self):
+        """
+        Tests that the generated files are read back with every student, seat, and grader.
+        """
+        exam, evals, seats = self._load(10)
+        self.assertEqual(300, len(evals.emails))
+        self.assertEqual({"Hall", "Tables"}, {room for room, _ in seats.emails_by_room if room})
+        self.assertEqual(15, len([x for x in seats.emails if not seats.room_for(x)]))
+        for _, question in evals:
+            self.assertEqual({"Grader 0", "Grader 1", "Grader 2"}, question.graders)
+        for cheater, mark in exam.cheater_emails:
+            self.assertTrue(seats.are_adjacent(cheater, mark, AdjacencyType.sideways_only))
+    def test_planted_signal(self):
+        """
+        Tests that the one-apart versus two-apart correlation summary detects planted cheaters.
+        """
+        def _summary(n_cheater_pairs):
+            _, evals, seats = self._load(n_cheater_pairs)
+            return one_way_vs_two_way_summary(compensate_for_grader_means(evals, float('inf')),
+                                              seats, 1, lambda x, y: x.correlation(y))
+        self.assertGreater(_summary(60), _summary(0) + 0.1)
+
+class TestInstrument(TestCase):
+    """
+    Tests the recording of spans
+    """
+    def test_spans(self):
+        """
+        Tests that spans are only recorded while enabled, and that nesting is tracked.
+        """
+        compensate_for_grader_means(FIXTURES.evals_sample)
+        self.assertIsNone(instrument.disable())
+        instrument.enable(allocations=True)
+        with instrument.span("outer"):
+            compensate_for_grader_means(FIXTURES.evals_sample)
+            compensate_for_grader_means(FIXTURES.evals_sample)
+        recorder = instrument.disable()
+        with instrument.span("ignored"):
+            pass
+        summary = recorder.summary()
+        self.assertEqual({"outer", "grader compensation"}, set(summary))
+        self.assertEqual(2, summary["grader compensation"]["count"])
+        self.assertLessEqual(summary["grader compensation"]["seconds"], summary["outer"]["seconds"])
+        self.assertEqual(["outer", "grader compensation"], recorder.records[0]["stack"])
+        self.assertIn("allocated", recorder.records[0])
+
+class TestProgress(TestCase):
+    """
+    Tests the progress bars
+    """
+    def test_throttling(self):
+        """
+        Tests that the terminal progress bar only redraws once per interval, and on the final value.
+        """
+        times = iter([0, 1, 1.05, 2, 2.01])
+        stream = StringIO()
+        p_bar = TerminalProgressBar(4, n_cols=6, min_interval=0.1, stream=stream,
+                                    clock=lambda: next(times))
+        for index in range(4):
+            p_bar.update(index)
+        self.assertEqual(["", "|-   | 1.0/s ETA 0:00:03", "|--- | 1.5/s ETA 0:00:01",
+                          "|----| 2.0/s ETA 0:00:00"], stream.getvalue().split("\r"))
+    def test_monitor(self):
+        """
+        Tests that progress sent from several bars through a queue is summed.
+        """
+        queue = Queue()
+        totals = []
+        class _Recorder(NoProgressBar):
+            def update(self, new_value):
+                totals.append(new_value + 1)
+        with ProgressMonitor(queue, 5, _Recorder) as monitor:
+            first, second = QueueProgressBar(2, queue, 0), QueueProgressBar(3, queue, 0)
+            for index in range(3):
+                second.update(index)
+            first.update(0)
+            first.update(1)
+        self.assertEqual(5, monitor.completed)
+        self.assertEqual([1, 2, 3, 4, 5], totals)
+        times = iter([0, 0.01, 0.02, 0.03])
+        with ProgressMonitor(queue, 10, NoProgressBar) as monitor:
+            with QueueProgressBar(10, queue, clock=lambda: next(times)) as p_bar:
+                for index in range(3):
+                    p_bar.update(index)
+        self.assertEqual(3, monitor.completed)
+    def test_early_stop(self):
+        """
+        Tests that a run stopped early by its sequential test sends its last trial to the monitor.
+        """
+        queue = Queue()
+        with ProgressMonitor(queue, 2000, NoProgressBar) as monitor:
+            _, _, report = model_on_params(
+                *FIXTURES.simple, 2, RandomSeatingModel, (), lambda grades, seats: 0.0, 2000,
+                tail_type=TailType.KNOWN_HIGH, sequential=SequentialTest(batch_size=100),
+                progress=partial(QueueProgressBar, queue=queue, min_interval=1000))
+        self.assertLess(report.n_trials, 2000)
+        self.assertEqual(report.n_trials, monitor.completed)
+
+class TestBenchmark(TestCase):
+    """
+    Tests the comparison of benchmark results against a baseline
+    """
+    def test_regressions(self):
+        """
+        Tests that only stages slower than the tolerance allows are reported.
+        """
+        baseline = [{"stage" : "a", "students" : 100, "seconds" : 1.0},
+                    {"stage" : "b", "students" : 100, "seconds" : 1.0}]
+        results = [{"stage" : "a", "students" : 100, "seconds" : 1.4},
+                   {"stage" : "b", "students" : 100, "seconds" : 1.6},
+                   {"stage" : "b", "students" : 1000, "seconds" : 100}]
+        self.assertEqual([(results[1], 1.0)], list(regressions(results, baseline, 1.5)))
+    def test_startup(self):
+        """
+        Tests that the compute-only entry points do not import the plotting or OCR libraries, and
+            that startup times over budget are reported.
+        """
+        for module in sorted(STARTUP_BUDGET):
+            self.assertEqual([], heavy_imports(module))
+        results = [{"stage" : "startup script", "students" : 0, "seconds" : 0.1},
+                   {"stage" : "startup profile", "students" : 0, "seconds" : 0.7},
+                   {"stage" : "a", "students" : 100, "seconds" : 100}]
+        self.assertEqual([(results[1], 0.5)],
+                         list(startup_over_budget(results, {"script" : 0.5, "profile" : 0.5})))
 
 if __name__ == '__main__':
     main()
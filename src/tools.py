@@ -2,8 +2,10 @@
 Random tools that don't fit anywhere else
 """
 
-import matplotlib as mp
-import matplotlib.pyplot as plt
+from functools import partial
+from hashlib import sha1
+from inspect import unwrap
+from types import FunctionType
 
 def flatten(vals):
     """
@@ -11,6 +13,69 @@ def flatten(vals):
     """
     return [x for y in vals for x in y]
 
+def fingerprint(items):
+    """
+    A hex digest identifying the given iterable of objects by their reprs, for use as a cache key.
+    """
+    digest = sha1()
+    for item in items:
+        digest.update(repr(item).encode("utf-8"))
+        digest.update(b"\n")
+    return digest.hexdigest()
+
+def function_identity(function):
+    """
+    Identifies a function by its name and a digest of its code (including any functions defined in
+        it), so that editing the function changes its identity. Partial applications include their
+        arguments, decorated functions are identified by the function they wrap, and classes by
+        class_identity.
+    """
+    if isinstance(function, type):
+        return class_identity(function)
+    if isinstance(function, partial):
+        return (function_identity(function.func), function.args,
+                sorted(function.keywords.items()))
+    function = unwrap(function)
+    code = getattr(function, "__code__", None)
+    code_digest = None if code is None else fingerprint(_code_parts(code))
+    return (getattr(function, "__module__", None),
+            getattr(function, "__qualname__", repr(function)),
+            code_digest)
+
+def class_identity(cls):
+    """
+    Identifies a class by its name and the function_identity of every method it defines or
+        inherits (including static and class methods), so that editing a method changes its
+        identity.
+    """
+    methods = []
+    for klass in cls.__mro__:
+        for _, value in sorted(vars(klass).items()):
+            if isinstance(value, (staticmethod, classmethod)):
+                value = value.__func__
+            if isinstance(value, FunctionType):
+                methods.append(function_identity(value))
+    return (cls.__module__, cls.__qualname__, methods)
+
+def _code_parts(code):
+    """
+    The bytecode and constants of a code object, recursing into nested code objects, whose reprs
+        would otherwise include their memory addresses.
+    """
+    yield code.co_code
+    for const in code.co_consts:
+        if hasattr(const, "co_code"):
+            yield from _code_parts(const)
+        else:
+            yield const
+
+def pyplot():
+    """
+    Imports matplotlib.pyplot, which is slow to import, the first time something is plotted.
+    """
+    import matplotlib.pyplot as plt # pylint: disable=C0415
+    return plt
+
 class TempParams:
     """
     Allows for setting parameters temporarily (only font right now).
@@ -19,16 +84,18 @@ class TempParams:
         self.new_font = new_font
         self.font = -1
     def __enter__(self):
-        self.font = mp.rcParams['font.size']
-        mp.rcParams.update({'font.size': self.new_font})
+        rc_params = pyplot().rcParams
+        self.font = rc_params['font.size']
+        rc_params.update({'font.size': self.new_font})
     def __exit__(self, typ, value, traceback):
         del typ, value, traceback
-        mp.rcParams.update({'font.size': self.font})
+        pyplot().rcParams.update({'font.size': self.font})
 
 def show_or_save(path, lgd):
     """
     Either shows or saves
     """
+    plt = pyplot()
     if path is None:
         plt.show()
     else: